@@ -0,0 +1,304 @@
+"""Offline component benchmarks for feature extraction, index builds, search and index loading
+
+    python benchmark.py [--sizes 10000,100000] [--index-types flat,hnsw,ivf] [--output results.json]
+    python benchmark.py --compare before.json after.json
+
+Everything runs locally against synthetic data: generated JPEGs for feature
+extraction and clustered random embeddings for the index benchmarks, so no
+dataset, database or network is touched. Timings do not depend on the model's
+weights, so the keras backend uses seeded random weights unless RESNET_WEIGHTS
+is set; RESNET_WEIGHTS=imagenet downloads the ImageNet weights on first use.
+The server's own functions are timed
+(extract_features, preprocess_batch/predict_batch, build_faiss_index_sync,
+search_index, load_index), so results track the code at each commit.
+Results are written as JSON; --compare prints the relative change of every
+timing between two result files.
+"""
+import argparse
+import asyncio
+import json
+import os
+import platform
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timezone
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+# Must be set before server reads its configuration
+os.environ.setdefault('RESNET_WEIGHTS', 'random')
+
+import server  # noqa: E402
+
+ROOT_DIR = Path(__file__).parent
+
+
+def percentiles(samples_ms: list) -> dict:
+    samples = np.asarray(samples_ms)
+    return {
+        "p50_ms": float(np.percentile(samples, 50)),
+        "p95_ms": float(np.percentile(samples, 95)),
+        "p99_ms": float(np.percentile(samples, 99)),
+        "mean_ms": float(samples.mean()),
+    }
+
+
+def synthetic_embeddings(count: int, dimension: int, seed: int = 0) -> np.ndarray:
+    """Clustered non-negative vectors, shaped roughly like pooled ResNet activations"""
+    rng = np.random.default_rng(seed)
+    clusters = max(1, count // 100)
+    centers = rng.gamma(1.0, 1.0, size=(clusters, dimension)).astype('float32')
+    features = np.empty((count, dimension), dtype='float32')
+    for start in range(0, count, 65536):
+        stop = min(count, start + 65536)
+        noise = rng.gamma(1.0, 0.5, size=(stop - start, dimension)).astype('float32')
+        features[start:stop] = centers[rng.integers(0, clusters, stop - start)] + noise
+    return features
+
+
+def write_synthetic_images(directory: Path, count: int, size=(640, 480), seed: int = 0) -> list:
+    """Smooth random colour fields saved as JPEGs at a typical photo resolution"""
+    rng = np.random.default_rng(seed)
+    paths = []
+    for i in range(count):
+        coarse = rng.integers(0, 256, size=(6, 8, 3), dtype=np.uint8)
+        path = directory / f"synthetic_{i:05d}.jpg"
+        Image.fromarray(coarse).resize(size, Image.BILINEAR).save(path, quality=90)
+        paths.append(str(path))
+    return paths
+
+
+def bench_extraction(image_count: int, batch_size: int) -> dict:
+    """Single-image extract_features and batched decode + inference throughput"""
+    with tempfile.TemporaryDirectory() as scratch:
+        paths = write_synthetic_images(Path(scratch), image_count)
+        started = time.perf_counter()
+        server.load_feature_extractor()
+        model_load_s = time.perf_counter() - started
+        server.extract_features(paths[0])  # warm-up
+
+        single = min(len(paths), 32)
+        started = time.perf_counter()
+        for path in paths[:single]:
+            server.extract_features(path)
+        single_s = time.perf_counter() - started
+
+        decode_s = inference_s = 0.0
+        for start in range(0, len(paths), batch_size):
+            t0 = time.perf_counter()
+            batch, kept, _ = server.preprocess_batch(paths[start:start + batch_size])
+            t1 = time.perf_counter()
+            server.predict_batch(batch)
+            decode_s += t1 - t0
+            inference_s += time.perf_counter() - t1
+
+    return {
+        "backend": server.FEATURE_BACKEND,
+        "model_id": server.MODEL_ID,
+        "images": image_count,
+        "batch_size": batch_size,
+        "model_load_s": model_load_s,
+        "single_images_per_sec": single / single_s,
+        "batched_images_per_sec": image_count / (decode_s + inference_s),
+        "decode_ms_per_image": decode_s * 1000 / image_count,
+        "inference_ms_per_image": inference_s * 1000 / image_count,
+    }
+
+
+def bench_index(features: np.ndarray, index_type: str, top_ks: list, queries: int) -> dict:
+    """Build time, per-query latency percentiles, batched throughput and recall for one index"""
+    import faiss
+
+    normalized = features.copy()
+    started = time.perf_counter()
+    index = server.build_faiss_index_sync(normalized, index_type)
+    build_s = time.perf_counter() - started
+
+    rng = np.random.default_rng(1)
+    sample = normalized[rng.choice(len(normalized), size=min(queries, len(normalized)), replace=False)]
+    query_vectors = sample + rng.normal(0, 0.01, size=sample.shape).astype('float32')
+    faiss.normalize_L2(query_vectors)
+
+    exact = faiss.IndexFlatIP(normalized.shape[1])
+    exact.add(normalized)
+    result = {
+        "index_type": server.index_type_name(index),
+        "requested_type": index_type,
+        "vector_storage": server.index_storage(index),
+        "ntotal": int(index.ntotal),
+        "dimension": int(normalized.shape[1]),
+        "build_s": build_s,
+        "index_bytes": int(faiss.serialize_index(index).nbytes),
+        "search": [],
+    }
+
+    for k in top_ks:
+        k = min(k, len(normalized))
+        _, truth = exact.search(query_vectors, k)
+        server.search_index(index, query_vectors[:1], k)  # warm-up
+        latencies, found = [], []
+        for query in query_vectors:
+            started = time.perf_counter()
+            _, ids = server.search_index(index, query.reshape(1, -1), k)
+            latencies.append((time.perf_counter() - started) * 1000)
+            found.append(ids[0])
+        started = time.perf_counter()
+        server.search_index(index, query_vectors, k)
+        batch_s = time.perf_counter() - started
+        hits = sum(len(set(f) & set(t)) for f, t in zip(found, truth))
+        result["search"].append({
+            "top_k": k,
+            "queries": len(query_vectors),
+            **percentiles(latencies),
+            "batched_qps": len(query_vectors) / batch_s,
+            "recall": hits / truth.size,
+        })
+    return result
+
+
+def bench_load_index(features: np.ndarray, mmap: bool) -> dict:
+    """Time load_index on a published snapshot, in memory or memory-mapped"""
+    settings = ("DATA_DIR", "SNAPSHOTS_DIR", "CURRENT_SNAPSHOT_FILE", "INDEX_MMAP", "MMAP_FEATURES")
+    saved = {name: getattr(server, name) for name in settings}
+    with tempfile.TemporaryDirectory() as scratch:
+        try:
+            # Point the server's snapshot locations at a scratch data directory
+            server.DATA_DIR = Path(scratch)
+            server.SNAPSHOTS_DIR = server.DATA_DIR / "snapshots"
+            server.CURRENT_SNAPSHOT_FILE = server.DATA_DIR / "CURRENT"
+            server.INDEX_MMAP = mmap
+            server.MMAP_FEATURES = mmap or server.VECTOR_STORAGE != "float32"
+
+            normalized = features.copy()
+            index = server.build_faiss_index_sync(normalized)
+            paths = [f"/dataset/category_{i % 100}/image_{i:07d}.jpg" for i in range(len(normalized))]
+            directory = server.new_snapshot_dir()
+            server.save_index_artifacts(directory, index, normalized, paths)
+            server.publish_snapshot(directory, server.snapshot_manifest(directory, index, len(paths)))
+            del index
+
+            started = time.perf_counter()
+            loaded = asyncio.run(server.load_index())
+            load_s = time.perf_counter() - started
+            result = {
+                "ntotal": int(server.faiss_index.ntotal) if loaded else 0,
+                "index_type": server.index_type_name(server.faiss_index) if loaded else None,
+                "mmap": mmap,
+                "load_s": load_s,
+            }
+        finally:
+            # Release mapped files before the scratch directory goes away, then restore the settings
+            server.faiss_index, server.features_array, server.image_paths = None, None, []
+            server.live_dir, server.index_mmapped = None, False
+            for name, value in saved.items():
+                setattr(server, name, value)
+    return result
+
+
+def environment() -> dict:
+    import faiss
+    try:
+        commit = subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], cwd=ROOT_DIR, capture_output=True, text=True
+        ).stdout.strip() or None
+    except OSError:
+        commit = None
+    return {
+        "commit": commit,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "python": platform.python_version(),
+        "numpy": np.__version__,
+        "faiss": faiss.__version__,
+        "platform": platform.platform(),
+        "cpu_count": os.cpu_count(),
+    }
+
+
+def compare(before_path: str, after_path: str):
+    """Print the relative change of every timing present in both result files"""
+    def flatten(node, prefix=""):
+        values = {}
+        if isinstance(node, dict):
+            label = "/".join(
+                f"{key}={node[key]}" for key in ("index_type", "requested_type", "ntotal", "top_k", "mmap")
+                if key in node
+            )
+            for key, value in node.items():
+                values.update(flatten(value, f"{prefix}{label + '/' if label else ''}{key}."))
+        elif isinstance(node, list):
+            for item in node:
+                values.update(flatten(item, prefix))
+        elif isinstance(node, (int, float)) and not isinstance(node, bool):
+            values[prefix.rstrip(".")] = node
+        return values
+
+    with open(before_path) as f:
+        before = flatten({k: v for k, v in json.load(f).items() if k != "environment"})
+    with open(after_path) as f:
+        after = flatten({k: v for k, v in json.load(f).items() if k != "environment"})
+    for key in sorted(set(before) & set(after)):
+        if not key.rsplit(".", 1)[-1].endswith(("_ms", "_s", "_per_sec", "_qps", "recall")):
+            continue
+        old, new = before[key], after[key]
+        change = (new - old) / old * 100 if old else float("inf")
+        print(f"{key:<90} {old:>12.4f} -> {new:>12.4f} ({change:+.1f}%)")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="10000,100000", help="comma-separated synthetic index sizes")
+    parser.add_argument("--dimension", type=int, default=2048)
+    parser.add_argument("--index-types", default="flat,hnsw,ivf,ivfpq")
+    parser.add_argument("--top-k", default="1,10,50")
+    parser.add_argument("--queries", type=int, default=200)
+    parser.add_argument("--images", type=int, default=64, help="synthetic images for the extraction benchmark")
+    parser.add_argument("--batch-size", type=int, default=server.FEATURE_BATCH_SIZE)
+    parser.add_argument("--skip-extraction", action="store_true", help="skip benchmarks that need the model")
+    parser.add_argument("--skip-load", action="store_true")
+    parser.add_argument("--output", help="write results to this JSON file (default: stdout)")
+    parser.add_argument("--compare", nargs=2, metavar=("BEFORE", "AFTER"), help="compare two result files")
+    args = parser.parse_args()
+
+    if args.compare:
+        compare(*args.compare)
+        return
+
+    sizes = [int(size) for size in args.sizes.split(",")]
+    top_ks = [int(k) for k in args.top_k.split(",")]
+    results = {"environment": environment(), "arguments": vars(args)}
+
+    if not args.skip_extraction:
+        print(f"Extraction: {args.images} images, batch size {args.batch_size}", file=sys.stderr)
+        try:
+            results["extraction"] = bench_extraction(args.images, args.batch_size)
+        except Exception as e:
+            results["extraction"] = {"error": str(e)}
+
+    results["index"] = []
+    for size in sizes:
+        features = synthetic_embeddings(size, args.dimension)
+        for index_type in args.index_types.split(","):
+            print(f"Index: {index_type} over {size} x {args.dimension}", file=sys.stderr)
+            results["index"].append(bench_index(features, index_type, top_ks, args.queries))
+
+    if not args.skip_load:
+        results["load_index"] = []
+        for size in sizes:
+            features = synthetic_embeddings(size, args.dimension)
+            for mmap in (False, True):
+                print(f"load_index: {size} vectors, mmap={mmap}", file=sys.stderr)
+                results["load_index"].append(bench_load_index(features, mmap))
+
+    output = json.dumps(results, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    else:
+        print(output)
+
+
+if __name__ == "__main__":
+    main()
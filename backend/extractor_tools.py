@@ -0,0 +1,245 @@
+"""Export, quantize and compare the ResNet50 feature extractor backends
+
+    python extractor_tools.py export [--weights imagenet|random|FILE]
+    python extractor_tools.py quantize [--calibration-dir DIR] [--dynamic]
+    python extractor_tools.py compare [--images DIR | --synthetic N] [--output report.json]
+
+export writes models/resnet50.onnx (needs TensorFlow and tf2onnx) together with
+the Keras weights it was exported from. quantize writes models/resnet50.int8.onnx
+(needs onnx and onnxruntime). compare embeds the same images with every backend
+and reports cosine agreement, nearest-neighbour overlap and throughput against
+the reference backend. With --weights random and --synthetic it runs without
+network access or a dataset.
+"""
+import argparse
+import io
+import json
+import os
+import sys
+import tempfile
+import time
+from pathlib import Path
+
+import numpy as np
+from PIL import Image
+
+import feature_extractors
+import image_decode
+
+ROOT_DIR = Path(__file__).parent
+MODELS_DIR = Path(os.environ.get('MODELS_DIR', str(ROOT_DIR / "data" / "models")))
+DATASET_DIR = ROOT_DIR / "uploads" / "dataset"
+IMAGE_EXTENSIONS = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+
+
+def list_images(directory: Path, limit: int) -> list:
+    paths = sorted(p for p in directory.rglob("*") if p.suffix.lower() in IMAGE_EXTENSIONS)
+    return [str(p) for p in paths[:limit]]
+
+
+def synthetic_images(count: int, seed: int = 0) -> list:
+    """Smooth random colour fields encoded as JPEG bytes, so decoding is exercised too"""
+    rng = np.random.default_rng(seed)
+    images = []
+    for _ in range(count):
+        coarse = rng.integers(0, 256, size=(8, 8, 3), dtype=np.uint8)
+        img = Image.fromarray(coarse).resize((320, 240), Image.BILINEAR)
+        buffer = io.BytesIO()
+        img.save(buffer, format='JPEG', quality=90)
+        images.append(buffer.getvalue())
+    return images
+
+
+def preprocess(sources: list) -> np.ndarray:
+    arrays = [image_decode.load_image_array(source) for source in sources]
+    return image_decode.preprocess_input(np.stack(arrays))
+
+
+def embed(extractor, sources: list, batch_size: int):
+    """Embed sources in batches, returning (features, seconds spent in inference)"""
+    chunks, seconds = [], 0.0
+    for start in range(0, len(sources), batch_size):
+        batch = preprocess(sources[start:start + batch_size])
+        started = time.perf_counter()
+        features = extractor.predict(batch)
+        seconds += time.perf_counter() - started
+        chunks.append(np.asarray(features, dtype='float32').reshape(len(batch), -1))
+    return np.concatenate(chunks), seconds
+
+
+def normalize(features: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(features, axis=1, keepdims=True)
+    return features / np.maximum(norms, 1e-12)
+
+
+def neighbour_overlap(reference: np.ndarray, candidate: np.ndarray, k: int) -> float:
+    """Mean fraction of each image's k nearest neighbours that both embeddings agree on"""
+    k = min(k, len(reference) - 1)
+    if k < 1:
+        return 1.0
+
+    def neighbours(features):
+        scores = features @ features.T
+        np.fill_diagonal(scores, -np.inf)
+        return np.argsort(-scores, axis=1)[:, :k]
+
+    ref, cand = neighbours(reference), neighbours(candidate)
+    return float(np.mean([len(set(a) & set(b)) / k for a, b in zip(ref, cand)]))
+
+
+def default_weights() -> str:
+    exported = MODELS_DIR / feature_extractors.EXPORTED_WEIGHTS_FILE
+    return str(exported) if exported.exists() else "imagenet"
+
+
+def export_onnx(args):
+    """Export the Keras model to ONNX with a dynamic batch dimension"""
+    import tensorflow as tf
+
+    MODELS_DIR.mkdir(parents=True, exist_ok=True)
+    model = feature_extractors.KerasExtractor(args.weights).model
+    model.save_weights(str(MODELS_DIR / feature_extractors.EXPORTED_WEIGHTS_FILE))
+
+    output_path = MODELS_DIR / feature_extractors.ONNX_MODEL_FILES["onnx"]
+    try:
+        import tf2onnx
+    except ImportError:
+        sys.exit("ONNX export needs tf2onnx: pip install tf2onnx")
+    signature = [tf.TensorSpec((None,) + image_decode.BATCH_ITEM_SHAPE, tf.float32, name="input")]
+    tf2onnx.convert.from_keras(model, input_signature=signature, opset=args.opset, output_path=str(output_path))
+    print(f"Exported {output_path}")
+
+
+class CalibrationReader:
+    """Feeds preprocessed batches to the static quantizer"""
+
+    def __init__(self, input_name: str, sources: list, batch_size: int):
+        self.input_name = input_name
+        self.batches = iter([sources[i:i + batch_size] for i in range(0, len(sources), batch_size)])
+
+    def get_next(self):
+        batch = next(self.batches, None)
+        if batch is None:
+            return None
+        return {self.input_name: preprocess(batch)}
+
+
+def quantize_onnx(args):
+    """Quantize the exported ONNX graph to int8"""
+    import onnx
+    from onnxruntime.quantization import (
+        CalibrationMethod, QuantFormat, QuantType, quantize_dynamic, quantize_static,
+    )
+    from onnxruntime.quantization.shape_inference import quant_pre_process
+
+    source = MODELS_DIR / feature_extractors.ONNX_MODEL_FILES["onnx"]
+    target = MODELS_DIR / feature_extractors.ONNX_MODEL_FILES["onnx-int8"]
+    if not source.exists():
+        sys.exit(f"{source} not found; run `python extractor_tools.py export` first")
+
+    if args.dynamic:
+        # Weights only; activations are quantized on the fly, no calibration data needed
+        quantize_dynamic(str(source), str(target), weight_type=QuantType.QInt8)
+    else:
+        if args.calibration_dir:
+            sources = list_images(Path(args.calibration_dir), args.calibration_images)
+        else:
+            sources = list_images(DATASET_DIR, args.calibration_images)
+        if not sources:
+            sources = synthetic_images(args.calibration_images)
+        input_name = onnx.load(str(source), load_external_data=False).graph.input[0].name
+        with tempfile.TemporaryDirectory() as scratch:
+            # Shape inference and op fusion first, so Conv+BatchNorm quantize as one op
+            prepared = Path(scratch) / "prepared.onnx"
+            quant_pre_process(str(source), str(prepared), skip_symbolic_shape=True)
+            quantize_static(
+                str(prepared), str(target),
+                CalibrationReader(input_name, sources, args.batch_size),
+                quant_format=QuantFormat.QDQ,
+                activation_type=QuantType.QUInt8,
+                weight_type=QuantType.QInt8,
+                per_channel=True,
+                calibrate_method=CalibrationMethod.MinMax,
+            )
+        print(f"Calibrated on {len(sources)} images")
+    print(f"Quantized {target}")
+
+
+def compare_backends(args):
+    """Embed the same images with each backend and measure agreement with the reference"""
+    if args.synthetic:
+        sources = synthetic_images(args.synthetic)
+    else:
+        sources = list_images(Path(args.images), args.limit)
+    if not sources:
+        sys.exit("No images to compare")
+
+    backends = args.backends.split(",")
+    reference = args.reference or backends[0]
+    if reference not in backends:
+        backends.insert(0, reference)
+
+    embeddings, report = {}, {"images": len(sources), "reference": reference, "backends": {}}
+    for backend in backends:
+        extractor = feature_extractors.create_extractor(backend, args.weights, MODELS_DIR)
+        # Warm-up pass so one-off graph compilation does not count against throughput
+        extractor.predict(preprocess(sources[:1]))
+        features, seconds = embed(extractor, sources, args.batch_size)
+        embeddings[backend] = normalize(features)
+        report["backends"][backend] = {
+            "model_id": feature_extractors.model_identifier(backend, args.weights, MODELS_DIR),
+            "images_per_sec": round(len(sources) / seconds, 2) if seconds else None,
+            "inference_seconds": round(seconds, 3),
+        }
+
+    for backend in backends:
+        cosine = np.sum(embeddings[backend] * embeddings[reference], axis=1)
+        report["backends"][backend].update(
+            cosine_mean=round(float(cosine.mean()), 6),
+            cosine_min=round(float(cosine.min()), 6),
+            cosine_p5=round(float(np.percentile(cosine, 5)), 6),
+            **{f"neighbour_overlap_at_{args.k}": round(
+                neighbour_overlap(embeddings[reference], embeddings[backend], args.k), 4
+            )},
+        )
+
+    output = json.dumps(report, indent=2)
+    if args.output:
+        Path(args.output).write_text(output)
+    print(output)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    export = commands.add_parser("export", help="export the Keras model to ONNX")
+    export.add_argument("--weights", default="imagenet", help='"imagenet", "random" or a .weights.h5 file')
+    export.add_argument("--opset", type=int, default=17)
+    export.set_defaults(handler=export_onnx)
+
+    quantize = commands.add_parser("quantize", help="quantize the ONNX model to int8")
+    quantize.add_argument("--dynamic", action="store_true", help="dynamic quantization without calibration")
+    quantize.add_argument("--calibration-dir", help="images to calibrate on (defaults to the dataset)")
+    quantize.add_argument("--calibration-images", type=int, default=128)
+    quantize.add_argument("--batch-size", type=int, default=16)
+    quantize.set_defaults(handler=quantize_onnx)
+
+    compare = commands.add_parser("compare", help="compare embeddings across backends")
+    compare.add_argument("--images", default=str(DATASET_DIR))
+    compare.add_argument("--limit", type=int, default=500)
+    compare.add_argument("--synthetic", type=int, default=0, help="use N generated images instead of --images")
+    compare.add_argument("--backends", default=",".join(feature_extractors.FEATURE_BACKENDS))
+    compare.add_argument("--reference", help="backend the others are compared to (default: the first)")
+    compare.add_argument("--weights", default=default_weights(), help="Keras weights for the keras backend")
+    compare.add_argument("--batch-size", type=int, default=32)
+    compare.add_argument("--k", type=int, default=10)
+    compare.add_argument("--output", help="also write the JSON report to this file")
+    compare.set_defaults(handler=compare_backends)
+
+    args = parser.parse_args()
+    args.handler(args)
+
+
+if __name__ == "__main__":
+    main()
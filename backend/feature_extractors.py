@@ -0,0 +1,96 @@
+"""ResNet50 feature extractor backends
+
+All backends take batches preprocessed by image_decode (224x224x3, BGR,
+mean-subtracted float32) and return 2048-d average-pooled embeddings.
+
+- keras: the TensorFlow Keras reference model
+- onnx: the same network exported to ONNX and run with ONNX Runtime
+- onnx-int8: a quantized copy of the ONNX graph
+
+ONNX models are produced by extractor_tools.py. TensorFlow is only imported
+by the keras backend, and ONNX Runtime only by the onnx backends.
+"""
+import hashlib
+from pathlib import Path
+
+import numpy as np
+
+FEATURE_BACKENDS = ("keras", "onnx", "onnx-int8")
+ONNX_MODEL_FILES = {"onnx": "resnet50.onnx", "onnx-int8": "resnet50.int8.onnx"}
+# Keras weights saved next to exported graphs so comparisons use the exact same network
+EXPORTED_WEIGHTS_FILE = "resnet50.weights.h5"
+# Seed for weights="random", so randomly initialised models are reproducible across processes
+RANDOM_WEIGHTS_SEED = 0
+
+
+def _file_tag(path: Path) -> str:
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()[:12]
+
+
+def model_identifier(backend: str, weights: str, models_dir: Path) -> str:
+    """Stable id for the embeddings a backend produces, used to key cached vectors"""
+    if backend in ONNX_MODEL_FILES:
+        model_path = models_dir / ONNX_MODEL_FILES[backend]
+        tag = _file_tag(model_path) if model_path.exists() else "missing"
+        return f"{backend}-resnet50-{tag}-avg"
+    if weights in ("imagenet", "random"):
+        tag = weights
+    else:
+        tag = _file_tag(Path(weights)) if Path(weights).exists() else "missing"
+    return f"keras-resnet50-{tag}-avg"
+
+
+class KerasExtractor:
+    """TensorFlow Keras ResNet50 without its classifier head"""
+
+    backend = "keras"
+
+    def __init__(self, weights: str = "imagenet"):
+        from tensorflow.keras.applications import ResNet50
+
+        if weights == "random":
+            import keras
+            keras.utils.set_random_seed(RANDOM_WEIGHTS_SEED)
+            weights = None
+        self.model = ResNet50(weights=weights, include_top=False, pooling='avg')
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        return self.model.predict(batch, batch_size=len(batch), verbose=0)
+
+
+class OnnxExtractor:
+    """ResNet50 graph executed by ONNX Runtime on the CPU"""
+
+    def __init__(self, model_path: Path, backend: str = "onnx", threads: int = 0):
+        import onnxruntime as ort
+
+        if not Path(model_path).exists():
+            raise FileNotFoundError(
+                f"{model_path} not found; create it with `python extractor_tools.py export`"
+            )
+        options = ort.SessionOptions()
+        options.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            options.intra_op_num_threads = threads
+        self.backend = backend
+        self.session = ort.InferenceSession(
+            str(model_path), sess_options=options, providers=["CPUExecutionProvider"]
+        )
+        self.input_name = self.session.get_inputs()[0].name
+
+    def predict(self, batch: np.ndarray) -> np.ndarray:
+        batch = np.ascontiguousarray(batch, dtype='float32')
+        return self.session.run(None, {self.input_name: batch})[0]
+
+
+def create_extractor(backend: str, weights: str, models_dir: Path):
+    """Instantiate the extractor for a backend name"""
+    if backend == "keras":
+        return KerasExtractor(weights)
+    if backend in ONNX_MODEL_FILES:
+        return OnnxExtractor(models_dir / ONNX_MODEL_FILES[backend], backend)
+    raise ValueError(f"Unknown feature backend {backend!r}; expected one of {FEATURE_BACKENDS}")
@@ -0,0 +1,82 @@
+"""Image decode and ResNet50 preprocessing without TensorFlow
+
+Runs both in-process and inside decode worker processes, so it imports only
+numpy and Pillow. The output matches keras load_img(target_size=(224, 224))
+followed by resnet50.preprocess_input ("caffe" mode: BGR, mean-subtracted).
+"""
+import io
+from multiprocessing import shared_memory
+
+import numpy as np
+from PIL import Image
+
+TARGET_SIZE = (224, 224)
+BATCH_ITEM_SHAPE = (TARGET_SIZE[1], TARGET_SIZE[0], 3)
+# ImageNet channel means in BGR order, as used by keras resnet50.preprocess_input
+CAFFE_MEAN = np.array([103.939, 116.779, 123.68], dtype='float32')
+# JPEGs at least this many times the target size are downscaled during decoding
+DRAFT_MIN_RATIO = 2
+# Resampling filter used to reach TARGET_SIZE
+RESIZE_FILTER = Image.NEAREST
+# dHash compares horizontally adjacent pixels of a (HASH_SIZE + 1) x HASH_SIZE grayscale thumbnail
+HASH_SIZE = 8
+
+
+def load_image_array(source, draft: bool = True) -> np.ndarray:
+    """Decode an image (file path or raw bytes) into a 224x224x3 float32 RGB array"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        if (draft and img.format == 'JPEG'
+                and img.size[0] >= DRAFT_MIN_RATIO * TARGET_SIZE[0]
+                and img.size[1] >= DRAFT_MIN_RATIO * TARGET_SIZE[1]):
+            # Let libjpeg decode at 1/2, 1/4 or 1/8 scale instead of full resolution
+            img.draft('RGB', TARGET_SIZE)
+        if img.mode != 'RGB':
+            img = img.convert('RGB')
+        img = img.resize(TARGET_SIZE, RESIZE_FILTER)
+        return np.asarray(img, dtype='float32')
+
+
+def decode_identifier(draft: bool) -> str:
+    """Tag for the decode settings that change the pixels fed to the model"""
+    return Image.Resampling(RESIZE_FILTER).name.lower() + ("-draft" if draft else "")
+
+
+def difference_hash(source) -> str:
+    """64-bit dHash of an image as 16 hex digits; resized or re-encoded copies differ in few bits"""
+    if isinstance(source, bytes):
+        source = io.BytesIO(source)
+    with Image.open(source) as img:
+        # Only JPEGs honour draft; they decode straight to a small grayscale image
+        img.draft('L', (HASH_SIZE * 8, HASH_SIZE * 8))
+        pixels = np.asarray(img.convert('L').resize((HASH_SIZE + 1, HASH_SIZE), Image.BOX), dtype='int16')
+    bits = pixels[:, 1:] > pixels[:, :-1]
+    return np.packbits(bits).tobytes().hex()
+
+
+def preprocess_input(batch: np.ndarray) -> np.ndarray:
+    """RGB -> BGR and ImageNet mean subtraction"""
+    batch = batch[..., ::-1]
+    return np.subtract(batch, CAFFE_MEAN, dtype='float32')
+
+
+def decode_into_shared(shm_name: str, count: int, items, draft: bool = True):
+    """Decode (slot, source) items into slots of a (count, 224, 224, 3) float32 shared buffer
+
+    Returns a list of (slot, error) for the items that could not be decoded.
+    """
+    # The parent creates and unlinks the buffer; workers only attach to it
+    shm = shared_memory.SharedMemory(name=shm_name)
+    batch = np.ndarray((count,) + BATCH_ITEM_SHAPE, dtype='float32', buffer=shm.buf)
+    failed = []
+    try:
+        for slot, source in items:
+            try:
+                batch[slot] = preprocess_input(load_image_array(source, draft))
+            except Exception as e:
+                failed.append((slot, str(e)))
+    finally:
+        del batch
+        shm.close()
+    return failed
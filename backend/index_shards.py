@@ -0,0 +1,233 @@
+"""Index shards and the worker-process side of sharded search
+
+A sharded snapshot splits its vectors across shards/shard-NNN directories by a
+stable hash of each image's path or category. A shard directory holds its own
+FAISS index, the global positions of its rows (ids.npy) and their
+full-precision vectors (features.npy), so any process that can read it can
+serve it. Shard workers run the functions below and import only numpy and
+FAISS, never TensorFlow or the server module. The index reading and exact search
+helpers here are shared with the server's unsharded search path.
+"""
+import os
+import zlib
+from pathlib import Path
+
+import numpy as np
+
+SHARD_KEYS = {"hash", "category"}
+SHARDS_DIR = "shards"
+
+# Shards opened in this worker process: snapshot key -> state dict
+_shards = {}
+
+
+def shard_key(path: str, by: str) -> str:
+    return os.path.basename(os.path.dirname(path)) if by == "category" else path
+
+
+def bucket(key: str, count: int) -> int:
+    """Stable shard number for a key; crc32 rather than hash() so every process agrees"""
+    return zlib.crc32(key.encode('utf-8')) % count
+
+
+def shard_of(path: str, count: int, by: str) -> int:
+    return bucket(shard_key(path, by), count)
+
+
+def shard_dir(snapshot_dir, shard: int) -> Path:
+    return Path(snapshot_dir) / SHARDS_DIR / f"shard-{shard:03d}"
+
+
+def write_shard(directory: Path, index, ids: np.ndarray, features: np.ndarray):
+    """Write one shard: its index, the global positions of its rows and their raw vectors"""
+    import faiss
+    directory.mkdir(parents=True, exist_ok=True)
+    faiss.write_index(index, str(directory / "faiss_index.bin"))
+    np.save(str(directory / "ids.npy"), np.asarray(ids, dtype='int64'))
+    np.save(str(directory / "features.npy"), features)
+
+
+def extend_shard(source: Path, destination: Path, ids: np.ndarray, features: np.ndarray) -> int:
+    """Write a copy of a shard with rows added at the given global positions, returning its size
+
+    ids must all be past the shard's existing positions, so ids.npy stays sorted.
+    """
+    import faiss
+    index = read_index(source / "faiss_index.bin", mmap=False)
+    normalized = np.array(features, dtype='float32')
+    faiss.normalize_L2(normalized)
+    index.add(normalized)
+    stored = np.load(str(source / "features.npy"), mmap_mode='r')
+    write_shard(
+        destination, index,
+        np.concatenate([np.load(str(source / "ids.npy")), np.asarray(ids, dtype='int64')]),
+        np.concatenate([stored, np.asarray(features, dtype=stored.dtype)])
+    )
+    return int(index.ntotal)
+
+
+def read_index(path: Path, mmap: bool):
+    """Read an index file, optionally as a read-only memory-mapped view"""
+    import faiss
+    if not mmap:
+        return faiss.read_index(str(path))
+    flag = getattr(faiss, 'IO_FLAG_MMAP_IFC', faiss.IO_FLAG_MMAP)
+    return faiss.read_index(str(path), flag | faiss.IO_FLAG_READ_ONLY)
+
+
+def vector_storage(index) -> str:
+    """How an index stores vectors: "float32", "float16", "int8" or "pq" codes"""
+    import faiss
+    if isinstance(index, faiss.IndexHNSW):
+        index = faiss.downcast_index(index.storage)
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "pq"
+    if isinstance(index, (faiss.IndexScalarQuantizer, faiss.IndexIVFScalarQuantizer)):
+        return {
+            faiss.ScalarQuantizer.QT_fp16: "float16",
+            faiss.ScalarQuantizer.QT_8bit: "int8",
+        }.get(index.sq.qtype, "sq")
+    return "float32"
+
+
+def search_parameters(index, nprobe=None, ef_search=None, selector=None):
+    """FAISS SearchParameters for the per-query knobs (and optional ID selector) that apply to this index"""
+    import faiss
+    if isinstance(index, faiss.IndexIVF) and (nprobe or selector is not None):
+        params = faiss.SearchParametersIVF(nprobe=nprobe or index.nprobe)
+    elif isinstance(index, faiss.IndexHNSW) and (ef_search or selector is not None):
+        params = faiss.SearchParametersHNSW(efSearch=ef_search or index.hnsw.efSearch)
+    elif selector is not None:
+        params = faiss.SearchParameters()
+    else:
+        return None
+    if selector is not None:
+        params.sel = selector
+    return params
+
+
+def normalized_rows(features, rows: np.ndarray) -> np.ndarray:
+    """L2-normalized float32 copy of the given rows of a (possibly memory-mapped) feature matrix"""
+    import faiss
+    vectors = np.array(features[rows], dtype='float32')
+    faiss.normalize_L2(vectors)
+    return vectors
+
+
+def exact_top_k(vectors: np.ndarray, ids: np.ndarray, queries: np.ndarray, k: int):
+    """Exact top-k of normalized queries against normalized vectors, returned as (scores, ids)"""
+    scores = queries @ vectors.T
+    k = min(k, len(ids))
+    top = np.argpartition(-scores, k - 1, axis=1)[:, :k]
+    order = np.argsort(-np.take_along_axis(scores, top, axis=1), axis=1)
+    top = np.take_along_axis(top, order, axis=1)
+    return np.take_along_axis(scores, top, axis=1), ids[top]
+
+
+def rerank(vectors_for, queries: np.ndarray, candidates: np.ndarray, k: int):
+    """Re-score candidate ids with full-precision vectors from vectors_for(ids) and keep the best k per query"""
+    distances = np.full((len(queries), k), np.finfo('float32').min, dtype='float32')
+    indices = np.full((len(queries), k), -1, dtype='int64')
+    for row, query in enumerate(queries):
+        # Sorted ids turn the gather into forward reads of a mapped file
+        ids = np.sort(candidates[row][candidates[row] >= 0])
+        if len(ids) == 0:
+            continue
+        scores = vectors_for(ids) @ query
+        top = np.argsort(-scores)[:k]
+        distances[row, :len(top)] = scores[top]
+        indices[row, :len(top)] = ids[top]
+    return distances, indices
+
+
+def open_shard(key: str, directory: str, mmap: bool) -> int:
+    """Load a shard into this worker under key, replacing any shard already open there"""
+    directory = Path(directory)
+    index = read_index(directory / "faiss_index.bin", mmap)
+    _shards[key] = {
+        "directory": directory,
+        "index": index,
+        "mmapped": mmap,
+        "compressed": vector_storage(index) != "float32",
+        "ids": np.load(str(directory / "ids.npy")),
+        # Full-precision rows stay on disk; only re-ranking and exact scans read them
+        "features": np.load(str(directory / "features.npy"), mmap_mode='r'),
+        "extra": None,
+    }
+    return int(index.ntotal)
+
+
+def close_shard(key: str):
+    _shards.pop(key, None)
+
+
+def add_to_shard(key: str, ids: np.ndarray, features: np.ndarray) -> int:
+    """Append rows to an open shard in memory; the shard files are left as built"""
+    import faiss
+    shard = _shards[key]
+    if shard["mmapped"]:
+        # A mapped index is read-only; take a private copy before the first append
+        shard["index"] = read_index(shard["directory"] / "faiss_index.bin", mmap=False)
+        shard["mmapped"] = False
+    normalized = np.array(features, dtype='float32')
+    faiss.normalize_L2(normalized)
+    shard["index"].add(normalized)
+    shard["ids"] = np.concatenate([shard["ids"], np.asarray(ids, dtype='int64')])
+    extra = shard["extra"]
+    shard["extra"] = normalized if extra is None else np.concatenate([extra, normalized])
+    return int(shard["index"].ntotal)
+
+
+def _vectors(shard, local: np.ndarray) -> np.ndarray:
+    """Normalized vectors for local row numbers, from the shard file or rows added since"""
+    base = len(shard["features"])
+    vectors = np.empty((len(local), shard["index"].d), dtype='float32')
+    stored = local < base
+    if stored.any():
+        vectors[stored] = normalized_rows(shard["features"], local[stored])
+    if (~stored).any():
+        vectors[~stored] = shard["extra"][local[~stored] - base]
+    return vectors
+
+
+def search_shard(key: str, queries: np.ndarray, k: int, nprobe=None, ef_search=None,
+                 rerank_factor: int = 1, allowed=None, exact_max: int = 0):
+    """Top-k of one shard for normalized queries, as (scores, global positions)
+
+    allowed optionally restricts results to sorted global positions; small
+    selections are scanned exactly, larger ones use an ID selector with an exact
+    fallback. Compressed indexes over-fetch and re-rank with the stored vectors.
+    """
+    import faiss
+    shard = _shards[key]
+    index, ids = shard["index"], shard["ids"]
+    empty = (np.zeros((len(queries), 0), dtype='float32'), np.zeros((len(queries), 0), dtype='int64'))
+    if index.ntotal == 0:
+        return empty
+
+    selector, local = None, None
+    if allowed is not None:
+        found = np.searchsorted(ids, allowed)
+        hit = found < len(ids)
+        hit[hit] = ids[found[hit]] == allowed[hit]
+        local = found[hit]
+        if len(local) == 0:
+            return empty
+        k = min(k, len(local))
+        if not isinstance(index, (faiss.IndexHNSW, faiss.IndexIVF)) or len(local) <= exact_max:
+            distances, indices = exact_top_k(_vectors(shard, local), local, queries, k)
+            return distances, ids[indices]
+        selector = faiss.IDSelectorBatch(local)
+
+    k = min(k, int(index.ntotal))
+    fetch = min(k * max(1, rerank_factor), int(index.ntotal)) if shard["compressed"] else k
+    params = search_parameters(index, nprobe, ef_search, selector)
+    if params is None:
+        distances, indices = index.search(queries, fetch)
+    else:
+        distances, indices = index.search(queries, fetch, params=params)
+    if shard["compressed"]:
+        distances, indices = rerank(lambda rows: _vectors(shard, rows), queries, indices, k)
+    if selector is not None and (indices >= 0).sum(axis=1).min() < k:
+        distances, indices = exact_top_k(_vectors(shard, local), local, queries, k)
+    return distances, np.where(indices >= 0, ids[np.maximum(indices, 0)], -1)
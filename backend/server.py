@@ -1,20 +1,42 @@
-from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form
+from fastapi import FastAPI, APIRouter, UploadFile, File, HTTPException, Form, Query, BackgroundTasks, Response, Request
+from fastapi.responses import StreamingResponse, JSONResponse
 from fastapi.staticfiles import StaticFiles
 from dotenv import load_dotenv
 from starlette.middleware.cors import CORSMiddleware
 from motor.motor_asyncio import AsyncIOMotorClient
+from pymongo.errors import OperationFailure
 import os
 import logging
 from pathlib import Path
 from pydantic import BaseModel, Field, ConfigDict
-from typing import List, Optional
+from typing import List, Optional, NamedTuple
 import uuid
 from datetime import datetime, timezone
 import numpy as np
 import shutil
 import asyncio
-from concurrent.futures import ThreadPoolExecutor
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+import multiprocessing
+from multiprocessing import shared_memory
 import json
+import base64
+import io
+import zipfile
+import tarfile
+import tempfile
+import hashlib
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+from email.utils import formatdate, parsedate_to_datetime
+
+import aiofiles
+
+import image_decode
+import feature_extractors
+import index_shards
+import metrics
 
 ROOT_DIR = Path(__file__).parent
 load_dotenv(ROOT_DIR / '.env')
@@ -51,7 +73,231 @@ feature_extractor = None
 faiss_index = None
 image_paths = []
 features_array = None
+# Incremented whenever the live index changes; part of every result cache key
+index_version = 0
+# True while faiss_index is a read-only memory-mapped view of faiss_index.bin
+index_mmapped = False
+# Snapshot directory the live index was loaded from; incremental appends go here
+live_dir = None
 executor = ThreadPoolExecutor(max_workers=2)
+# Background index builds get their own threads so they never queue ahead of searches
+build_executor = ThreadPoolExecutor(max_workers=2)
+decode_pool = None
+# One single-process executor per index shard, each serving its shard's index
+shard_workers = []
+# Progress of the startup phase reported by /api/ready
+startup_state = {"ready": False, "phase": "starting", "phases": {}, "error": None}
+startup_task = None
+# Task following other workers' index changes when SHARED_INDEX is set
+shared_index_watcher = None
+
+def env_choice(name: str, default: str, choices) -> str:
+    """Read a setting that must be one of choices, failing at startup instead of on first use"""
+    value = os.environ.get(name, default).lower()
+    if value not in choices:
+        raise ValueError(f"{name}={value!r} is not one of {sorted(choices)}")
+    return value
+
+# Number of images decoded and passed through ResNet50 per forward pass
+FEATURE_BATCH_SIZE = int(os.environ.get('FEATURE_BATCH_SIZE', '32'))
+
+# Each build writes a versioned snapshot directory; CURRENT names the live one
+SNAPSHOTS_DIR = DATA_DIR / "snapshots"
+CURRENT_SNAPSHOT_FILE = DATA_DIR / "CURRENT"
+SNAPSHOT_RETENTION = int(os.environ.get('SNAPSHOT_RETENTION', '2'))
+
+# Multi-worker mode: several uvicorn worker processes map one on-disk snapshot read-only, follow
+# snapshots and appends published by the others, and serialize builds and appends with file locks
+SHARED_INDEX = os.environ.get('SHARED_INDEX', 'false').lower() in ('1', 'true', 'yes')
+# Seconds between checks of CURRENT and the live path table for other workers' changes
+SHARED_POLL_INTERVAL = float(os.environ.get('SHARED_POLL_INTERVAL', '1.0'))
+# Rows appended to a shared snapshot are scanned exactly until this many build up and a new snapshot folds them in
+SHARED_CHECKPOINT_ROWS = int(os.environ.get('SHARED_CHECKPOINT_ROWS', '10000'))
+# Uploaded rows are scanned exactly until this many build up and are folded into a new index file
+APPEND_FOLD_ROWS = int(os.environ.get('APPEND_FOLD_ROWS', '10000'))
+
+# Map the index, features and path table from disk instead of reading them into private memory
+INDEX_MMAP = os.environ.get('INDEX_MMAP', 'false').lower() in ('1', 'true', 'yes') or SHARED_INDEX
+
+# Vector codes held by flat, IVF and HNSW indexes: "float32", or "float16"/"int8" scalar quantization.
+# Compact indexes keep features.npy memory-mapped and re-rank candidates with its full-precision rows.
+VECTOR_STORAGES = {"float32", "float16", "int8"}
+VECTOR_STORAGE = env_choice('VECTOR_STORAGE', 'float32', VECTOR_STORAGES)
+# Compact indexes fetch top_k * RERANK_FACTOR candidates for exact re-ranking
+RERANK_FACTOR = int(os.environ.get('RERANK_FACTOR', '4'))
+
+# Split new snapshots into this many index shards, each served by its own worker process.
+# Images are assigned by a hash of their path ("hash") or of their category ("category").
+INDEX_SHARDS = max(1, int(os.environ.get('INDEX_SHARDS', '1')))
+SHARD_BY = env_choice('SHARD_BY', 'hash', index_shards.SHARD_KEYS)
+# Sharded snapshots also keep the coordinator's copy of features.npy on disk
+MMAP_FEATURES = INDEX_MMAP or VECTOR_STORAGE != "float32" or INDEX_SHARDS > 1
+
+# Inference backend: "keras" (TensorFlow), "onnx" (ONNX Runtime) or "onnx-int8" (quantized ONNX)
+FEATURE_BACKEND = env_choice('FEATURE_BACKEND', 'keras', feature_extractors.FEATURE_BACKENDS)
+# Keras weights: "imagenet", "random" (seeded, for offline testing) or a local .weights.h5 file
+RESNET_WEIGHTS = os.environ.get('RESNET_WEIGHTS', 'imagenet')
+# Exported ONNX graphs (see extractor_tools.py)
+MODELS_DIR = Path(os.environ.get('MODELS_DIR', str(DATA_DIR / "models")))
+
+# Processes that decode and resize images into shared memory; 0 decodes on the executor threads
+DECODE_WORKERS = int(os.environ.get('DECODE_WORKERS', '0'))
+# Let libjpeg downscale large JPEGs while decoding
+JPEG_DRAFT = os.environ.get('JPEG_DRAFT', 'true').lower() in ('1', 'true', 'yes')
+
+# Identifies the network and the decoding feeding it; part of every embedding cache key
+MODEL_ID = (
+    f"{feature_extractors.model_identifier(FEATURE_BACKEND, RESNET_WEIGHTS, MODELS_DIR)}"
+    f"-{image_decode.decode_identifier(JPEG_DRAFT)}"
+)
+EMBEDDING_CACHE_PATH = Path(os.environ.get('EMBEDDING_CACHE_PATH', str(DATA_DIR / "embedding_cache.sqlite3")))
+
+# How uploads reach the index: "inline" (before responding), "deferred" (background task) or "off"
+UPLOAD_INDEX_MODES = {"inline", "deferred", "off"}
+UPLOAD_INDEX_MODE = env_choice('UPLOAD_INDEX_MODE', 'deferred', UPLOAD_INDEX_MODES)
+
+# Serialises index mutations (full builds and incremental appends)
+index_lock = asyncio.Lock()
+# Guards the live FAISS index against appends while a search thread is scanning it
+index_mutex = threading.Lock()
+# Keeps concurrent first requests from building the model twice
+extractor_lock = threading.Lock()
+
+# FAISS index type: "flat", "ivf", "hnsw", "ivfpq", or "auto" to choose from the collection size
+INDEX_TYPES = {"auto", "flat", "ivf", "hnsw", "ivfpq"}
+INDEX_TYPE = env_choice('INDEX_TYPE', 'auto', INDEX_TYPES)
+HNSW_M = int(os.environ.get('HNSW_M', '32'))
+HNSW_EF_CONSTRUCTION = int(os.environ.get('HNSW_EF_CONSTRUCTION', '200'))
+HNSW_EF_SEARCH = int(os.environ.get('HNSW_EF_SEARCH', '64'))
+IVF_NPROBE = int(os.environ.get('IVF_NPROBE', '16'))
+IVFPQ_M = int(os.environ.get('IVFPQ_M', '64'))
+
+# Activity logs are buffered and bulk-inserted when FLUSH_SIZE entries are queued or after FLUSH_INTERVAL seconds
+LOG_FLUSH_SIZE = int(os.environ.get('LOG_FLUSH_SIZE', '100'))
+LOG_FLUSH_INTERVAL = float(os.environ.get('LOG_FLUSH_INTERVAL', '1.0'))
+# Entries beyond LOG_QUEUE_SIZE are dropped ("drop") or make the caller wait ("block")
+LOG_QUEUE_SIZE = int(os.environ.get('LOG_QUEUE_SIZE', '10000'))
+LOG_OVERFLOWS = {"drop", "block"}
+LOG_OVERFLOW = env_choice('LOG_OVERFLOW', 'drop', LOG_OVERFLOWS)
+
+# Log retention: "ttl" expires entries after LOG_TTL_DAYS, "capped" bounds the collection
+# to LOG_CAPPED_BYTES, "none" keeps everything
+LOG_RETENTIONS = {"ttl", "capped", "none"}
+LOG_RETENTION = env_choice('LOG_RETENTION', 'ttl', LOG_RETENTIONS)
+LOG_TTL_DAYS = float(os.environ.get('LOG_TTL_DAYS', '30'))
+LOG_CAPPED_BYTES = int(os.environ.get('LOG_CAPPED_BYTES', str(256 * 1024 * 1024)))
+# Largest page /api/logs returns
+LOG_PAGE_MAX = 1000
+
+# Uploads are streamed to disk in chunks of this size; larger files are rejected with 413
+UPLOAD_CHUNK_SIZE = 1024 * 1024
+MAX_UPLOAD_BYTES = int(os.environ.get('MAX_UPLOAD_BYTES', str(25 * 1024 * 1024)))
+
+# Duplicate uploads: "reject" skips them, "link" records them against the existing file, "off" stores everything
+DEDUP_MODES = {"reject", "link", "off"}
+DEDUP_MODE = env_choice('DEDUP_MODE', 'reject', DEDUP_MODES)
+# Uploads are matched by perceptual hash (dHash) when they arrive. Stored hashes are looked up by
+# HASH_BANDS 16-bit bands, which finds every hash that differs in at most HASH_BANDS - 1 bits.
+HASH_BANDS = 4
+DEDUP_HASH_DISTANCE = int(os.environ.get('DEDUP_HASH_DISTANCE', '3'))
+if not 0 <= DEDUP_HASH_DISTANCE < HASH_BANDS:
+    raise ValueError(f"DEDUP_HASH_DISTANCE={DEDUP_HASH_DISTANCE} must be between 0 and {HASH_BANDS - 1}")
+# Cosine similarity to an indexed (or same-batch) image at which an upload counts as a near duplicate
+# when it is indexed incrementally
+DEDUP_THRESHOLD = float(os.environ.get('DEDUP_THRESHOLD', '0.97'))
+
+# Recent index build jobs, one JSON file each, readable by every worker process
+BUILD_JOBS_DIR = DATA_DIR / "build_jobs"
+
+# Incrementally maintained per-category image counts served by /api/dataset-stats
+DATASET_STATS_PATH = DATA_DIR / "dataset_stats.json"
+
+# Resized variants served by /api/images?size=..., longest side in pixels
+IMAGE_VARIANTS = {"thumb": 256, "preview": 1024}
+VARIANTS_DIR = DATA_DIR / "variants"
+VARIANT_CACHE_BYTES = int(os.environ.get('VARIANT_CACHE_BYTES', str(1024 * 1024 * 1024)))
+# Browser cache lifetime for served images; ETag / Last-Modified allow cheap revalidation after it
+IMAGE_CACHE_MAX_AGE = int(os.environ.get('IMAGE_CACHE_MAX_AGE', str(30 * 86400)))
+
+# Bounded LRU cache of complete search responses
+RESULT_CACHE_SIZE = int(os.environ.get('RESULT_CACHE_SIZE', '1024'))
+RESULT_CACHE_TTL = float(os.environ.get('RESULT_CACHE_TTL', '300'))
+# Bounded LRU of search query embeddings by content hash; survives index changes, unlike result_cache
+QUERY_EMBEDDING_CACHE_SIZE = int(os.environ.get('QUERY_EMBEDDING_CACHE_SIZE', '4096'))
+
+# Concurrent /api/search queries arriving within this window are embedded and searched together
+SEARCH_BATCH_WINDOW_MS = float(os.environ.get('SEARCH_BATCH_WINDOW_MS', '5'))
+SEARCH_MAX_BATCH = int(os.environ.get('SEARCH_MAX_BATCH', '32'))
+
+# Category-filtered searches scan categories up to this size exactly; larger ones use an
+# ID selector on ANN indexes
+CATEGORY_EXACT_MAX = int(os.environ.get('CATEGORY_EXACT_MAX', '20000'))
+
+# Load the model and run warm-up inferences at startup so the first search is not slow
+WARMUP_ON_STARTUP = os.environ.get('WARMUP_ON_STARTUP', 'true').lower() in ('1', 'true', 'yes')
+# Batch sizes to warm up; defaults to single queries plus the search and indexing batch sizes
+WARMUP_BATCH_SIZES = sorted({
+    int(size) for size in
+    os.environ.get('WARMUP_BATCH_SIZES', f"1,{SEARCH_MAX_BATCH},{FEATURE_BATCH_SIZE}").split(",")
+    if size.strip()
+})
+
+# Metrics served at /api/metrics in the Prometheus text format
+metrics_registry = metrics.Registry()
+# Operations are "search", "upload" (including indexing of uploaded images) and "build"
+stage_seconds = metrics_registry.histogram(
+    "imagesearch_stage_seconds",
+    "Time spent in each pipeline stage; decode, inference and index_search are per batch",
+    ("operation", "stage"),
+)
+operation_seconds = metrics_registry.histogram(
+    "imagesearch_operation_seconds", "End-to-end time of search requests, uploads and index builds", ("operation",)
+)
+log_flush_seconds = metrics_registry.histogram(
+    "imagesearch_log_flush_seconds", "Time of each bulk write of buffered activity log entries"
+)
+log_dropped_total = metrics_registry.counter(
+    "imagesearch_log_entries_dropped_total", "Activity log entries dropped because the log queue was full"
+)
+# Log categories -> operation label, so DB logging lines up with the other stages
+LOG_OPERATIONS = {"indexing": "build"}
+
+def queue_depths() -> dict:
+    """Work waiting to start in each executor and internal queue"""
+    depths = {
+        "search_executor": executor._work_queue.qsize(),
+        "build_executor": build_executor._work_queue.qsize(),
+        "search_batcher": search_batcher.pending(),
+        "log_writer": log_writer.pending(),
+    }
+    if decode_pool is not None:
+        depths["decode_pool"] = len(decode_pool._pending_work_items)
+    for shard, worker in enumerate(shard_workers):
+        depths[f"shard_{shard}"] = len(worker._pending_work_items)
+    return depths
+
+def resident_memory_bytes() -> Optional[int]:
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except (OSError, ValueError, AttributeError):
+        return None
+
+metrics_registry.gauge("imagesearch_queue_depth", "Tasks queued and not yet started", queue_depths, ("queue",))
+metrics_registry.gauge(
+    "imagesearch_index_vectors", "Vectors in the live index",
+    lambda: faiss_index.ntotal if faiss_index is not None else 0
+)
+metrics_registry.gauge(
+    "imagesearch_features_bytes", "Size of the stored feature matrix, memory-mapped or in memory",
+    lambda: features_array.nbytes if features_array is not None else 0
+)
+metrics_registry.gauge(
+    "imagesearch_index_unindexed_vectors", "Appended vectors not yet added to the index, searched exactly",
+    lambda: max(0, len(features_array) - faiss_index.ntotal) if faiss_index is not None and features_array is not None else 0
+)
+metrics_registry.gauge("imagesearch_index_version", "Live index version, bumped on every change", lambda: index_version)
+metrics_registry.gauge("process_resident_memory_bytes", "Resident memory size in bytes", resident_memory_bytes)
 
 # Models
 class ImageInfo(BaseModel):
@@ -61,6 +307,11 @@ class ImageInfo(BaseModel):
     filepath: str
     category: str = "unknown"
     uploaded_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    content_hash: Optional[str] = None
+    # 64-bit dHash as hex, for near-duplicate lookups
+    perceptual_hash: Optional[str] = None
+    # Filepath of the existing image this upload was linked to as a duplicate
+    duplicate_of: Optional[str] = None
 
 class SearchResult(BaseModel):
     image_id: str
@@ -83,184 +334,2472 @@ class LogEntry(BaseModel):
     message: str
     category: str = "general"
 
+class BuildJob(BaseModel):
+    id: str = Field(default_factory=lambda: str(uuid.uuid4()))
+    status: str = "queued"  # queued, running, succeeded, failed
+    stage: str = "queued"
+    processed: int = 0
+    total: int = 0
+    images_per_sec: float = 0.0
+    eta_seconds: Optional[float] = None
+    created_at: datetime = Field(default_factory=lambda: datetime.now(timezone.utc))
+    started_at: Optional[datetime] = None
+    finished_at: Optional[datetime] = None
+    snapshot: Optional[str] = None
+    message: Optional[str] = None
+
 class DatasetStats(BaseModel):
     total_images: int
     categories: dict
     index_built: bool
     index_size: int
 
+class EmbeddingCache:
+    """Persistent embedding store keyed by image content hash and model id"""
+    
+    def __init__(self, path: Path, model_id: str):
+        self.path = path
+        self.model_id = model_id
+        self.hits = 0
+        self.misses = 0
+        self._conn = None
+        self._lock = threading.Lock()
+    
+    def _connection(self):
+        if self._conn is None:
+            self._conn = sqlite3.connect(str(self.path), check_same_thread=False)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            # In WAL mode NORMAL still survives application crashes; only an OS crash can lose the
+            # newest entries, which are recomputed on the next miss
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS embeddings (key TEXT PRIMARY KEY, vector BLOB NOT NULL)"
+            )
+        return self._conn
+    
+    def _key(self, digest: str) -> str:
+        return f"{self.model_id}:{digest}"
+    
+    def get_many(self, digests) -> dict:
+        """Return {digest: vector} for the cached digests, counting hits and misses"""
+        digests = list(dict.fromkeys(digests))
+        found = {}
+        with self._lock:
+            conn = self._connection()
+            for i in range(0, len(digests), 500):
+                chunk = digests[i:i + 500]
+                keys = [self._key(d) for d in chunk]
+                rows = conn.execute(
+                    f"SELECT key, vector FROM embeddings WHERE key IN ({','.join('?' * len(keys))})", keys
+                ).fetchall()
+                by_key = dict(rows)
+                for digest, key in zip(chunk, keys):
+                    if key in by_key:
+                        found[digest] = np.frombuffer(by_key[key], dtype='float32')
+            self.hits += len(found)
+            self.misses += len(digests) - len(found)
+        return found
+    
+    def put_many(self, vectors: dict):
+        """Store {digest: vector} entries"""
+        if not vectors:
+            return
+        rows = [(self._key(d), np.asarray(v, dtype='float32').tobytes()) for d, v in vectors.items()]
+        with self._lock:
+            conn = self._connection()
+            conn.executemany("INSERT OR REPLACE INTO embeddings (key, vector) VALUES (?, ?)", rows)
+            conn.commit()
+    
+    def stats(self) -> dict:
+        with self._lock:
+            entries = self._connection().execute(
+                "SELECT COUNT(*) FROM embeddings WHERE key LIKE ?", (f"{self.model_id}:%",)
+            ).fetchone()[0]
+            hits, misses = self.hits, self.misses
+        lookups = hits + misses
+        return {
+            "model_id": self.model_id,
+            "path": str(self.path),
+            "entries": entries,
+            "hits": hits,
+            "misses": misses,
+            "hit_rate": hits / lookups if lookups else 0.0,
+        }
+
+embedding_cache = EmbeddingCache(EMBEDDING_CACHE_PATH, MODEL_ID)
+
+class ResultCache:
+    """In-memory LRU cache with per-entry TTL, for search responses and query embeddings"""
+    
+    def __init__(self, max_entries: int, ttl: float):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        # Index changes clear the cache from executor threads
+        self._lock = threading.Lock()
+    
+    def get(self, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and time.monotonic() - entry[0] <= self.ttl:
+                self._entries.move_to_end(key)
+                self.hits += 1
+                return entry[1]
+            if entry is not None:
+                del self._entries[key]
+            self.misses += 1
+            return None
+    
+    def put(self, key, value):
+        if self.max_entries <= 0:
+            return
+        with self._lock:
+            self._entries[key] = (time.monotonic(), value)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+    
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+    
+    def stats(self) -> dict:
+        lookups = self.hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "max_entries": self.max_entries,
+            "ttl_seconds": self.ttl,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / lookups if lookups else 0.0,
+            "index_version": index_version,
+        }
+
+result_cache = ResultCache(RESULT_CACHE_SIZE, RESULT_CACHE_TTL)
+query_embeddings = ResultCache(QUERY_EMBEDDING_CACHE_SIZE, float('inf'))
+
+class FileLock:
+    """Exclusive advisory lock on a file, held across every worker process on the host
+    
+    Not reentrant. As a context manager it blocks until the lock is acquired.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self._fd = None
+    
+    def acquire(self, blocking: bool = True) -> bool:
+        import fcntl
+        fd = os.open(self.path, os.O_RDWR | os.O_CREAT, 0o644)
+        try:
+            fcntl.flock(fd, fcntl.LOCK_EX | (0 if blocking else fcntl.LOCK_NB))
+        except BlockingIOError:
+            os.close(fd)
+            return False
+        self._fd = fd
+        return True
+    
+    def release(self):
+        import fcntl
+        fd, self._fd = self._fd, None
+        if fd is not None:
+            fcntl.flock(fd, fcntl.LOCK_UN)
+            os.close(fd)
+    
+    def __enter__(self):
+        self.acquire()
+        return self
+    
+    def __exit__(self, *exc):
+        self.release()
+
+# Held for the whole of an index build, so only one worker process builds at a time
+build_file_lock = FileLock(DATA_DIR / "build.lock")
+# Held while appending to or publishing the live snapshot
+index_file_lock = FileLock(DATA_DIR / "index.lock")
+
+class DatasetStatsStore:
+    """Per-category image counts kept up to date by uploads, clears and builds, persisted as JSON
+    
+    A recount (full directory scan) can run while uploads continue: uploads counted
+    after the scan started are added on top of the scanned totals. Updates re-read the
+    file under a file lock, so several worker processes can share it.
+    """
+    
+    def __init__(self, path: Path):
+        self.path = path
+        self.categories = None
+        self.reconciled_at = None
+        self._recount_delta = None
+        self._mtime = None
+        self._lock = FileLock(path.with_suffix(".lock"))
+        self.refresh()
+    
+    @property
+    def loaded(self) -> bool:
+        return self.categories is not None
+    
+    def refresh(self):
+        """Re-read the file if another process has replaced it"""
+        try:
+            mtime = self.path.stat().st_mtime_ns
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        try:
+            with open(self.path, "r") as f:
+                data = json.load(f)
+            self.categories = {c: int(n) for c, n in data["categories"].items()}
+            self.reconciled_at = data.get("reconciled_at")
+            self._mtime = mtime
+        except Exception as e:
+            logger.warning(f"Ignoring unreadable dataset stats file: {e}")
+    
+    def _save(self):
+        tmp = self.path.with_suffix(f".{os.getpid()}.tmp")
+        with open(tmp, "w") as f:
+            json.dump({"categories": self.categories, "reconciled_at": self.reconciled_at}, f)
+        os.replace(tmp, self.path)
+        self._mtime = self.path.stat().st_mtime_ns
+    
+    def add(self, category: str, count: int):
+        if self._recount_delta is not None:
+            self._recount_delta[category] = self._recount_delta.get(category, 0) + count
+        with self._lock:
+            self.refresh()
+            if self.categories is None:
+                return
+            self.categories[category] = self.categories.get(category, 0) + count
+            self._save()
+    
+    def begin_recount(self):
+        """Call just before scanning; uploads from here on are kept on top of the scan"""
+        self._recount_delta = {}
+    
+    def finish_recount(self, scanned: dict) -> dict:
+        """Replace the counts with a scan's, returning the per-category corrections"""
+        counts = dict(scanned)
+        for category, count in (self._recount_delta or {}).items():
+            counts[category] = counts.get(category, 0) + count
+        with self._lock:
+            self.refresh()
+            previous = self.categories or {}
+            corrections = {
+                c: counts.get(c, 0) - previous.get(c, 0)
+                for c in set(counts) | set(previous) if counts.get(c, 0) != previous.get(c, 0)
+            }
+            self.categories, self._recount_delta = counts, None
+            self.reconciled_at = datetime.now(timezone.utc).isoformat()
+            self._save()
+        return corrections
+    
+    def reset(self):
+        with self._lock:
+            self.categories, self._recount_delta = {}, None
+            self.reconciled_at = datetime.now(timezone.utc).isoformat()
+            self._save()
+
+dataset_stats = DatasetStatsStore(DATASET_STATS_PATH)
+
+class VariantCache:
+    """Resized image variants cached on disk, bounded in total size with least-recently-used eviction"""
+    
+    def __init__(self, directory: Path, max_bytes: int):
+        self.directory = directory
+        self.max_bytes = max_bytes
+        self._entries = None
+        self._bytes = 0
+        self._lock = threading.Lock()
+    
+    def _load(self):
+        # Files from earlier runs start in modification-time order
+        files = sorted(
+            (f.stat().st_mtime, str(f), f.stat().st_size) for f in self.directory.rglob("*.jpg")
+        ) if self.directory.exists() else []
+        self._entries = OrderedDict((path, size) for _, path, size in files)
+        self._bytes = sum(self._entries.values())
+    
+    def get(self, source: Path, stat: os.stat_result, variant: str) -> Path:
+        """Path of the variant for a source image, rendering it on first use"""
+        key = hashlib.sha1(f"{source}:{stat.st_mtime_ns}:{stat.st_size}:{variant}".encode()).hexdigest()
+        path = self.directory / variant / key[:2] / f"{key}.jpg"
+        with self._lock:
+            if self._entries is None:
+                self._load()
+            if str(path) in self._entries and path.exists():
+                self._entries.move_to_end(str(path))
+                return path
+        
+        path.parent.mkdir(parents=True, exist_ok=True)
+        tmp = path.with_suffix(f".{uuid.uuid4().hex}.tmp")
+        render_variant(source, tmp, IMAGE_VARIANTS[variant])
+        os.replace(tmp, path)
+        
+        with self._lock:
+            size = path.stat().st_size
+            self._bytes += size - self._entries.pop(str(path), 0)
+            self._entries[str(path)] = size
+            while self._bytes > self.max_bytes and len(self._entries) > 1:
+                evicted, evicted_size = self._entries.popitem(last=False)
+                self._bytes -= evicted_size
+                Path(evicted).unlink(missing_ok=True)
+        return path
+    
+    def clear(self):
+        with self._lock:
+            shutil.rmtree(self.directory, ignore_errors=True)
+            self._entries, self._bytes = OrderedDict(), 0
+
+def render_variant(source: Path, destination: Path, max_side: int):
+    """Downscale an image so its longest side is at most max_side and save it as JPEG"""
+    from PIL import Image
+    with Image.open(source) as img:
+        if img.format == 'JPEG':
+            # Decode at a reduced scale when the source is much larger than the variant
+            img.draft('RGB', (max_side, max_side))
+        img = img.convert('RGB')
+        img.thumbnail((max_side, max_side), Image.LANCZOS)
+        img.save(destination, format='JPEG', quality=85, optimize=True)
+
+variant_cache = VariantCache(VARIANTS_DIR, VARIANT_CACHE_BYTES)
+
+def count_dataset_images() -> dict:
+    """Scan DATASET_DIR for per-category image counts; categories without images count 0"""
+    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+    categories = {}
+    if DATASET_DIR.exists():
+        for cat_dir in DATASET_DIR.iterdir():
+            if cat_dir.is_dir():
+                categories[cat_dir.name] = sum(
+                    1 for f in os.scandir(cat_dir)
+                    if f.is_file() and Path(f.name).suffix.lower() in image_extensions
+                )
+    return categories
+
+async def reconcile_dataset_stats() -> dict:
+    """Recount the dataset directory and correct the stored counts"""
+    dataset_stats.begin_recount()
+    scanned = await asyncio.get_event_loop().run_in_executor(executor, count_dataset_images)
+    return dataset_stats.finish_recount(scanned)
+
+def bump_index_version(rows_appended: bool = False):
+    """Record that the live index changed, invalidating cached search results
+    
+    Appends leave existing positions in place, so the position maps are kept and
+    extended with the new rows on next use; any other change drops them.
+    """
+    global index_version, path_positions, category_positions, positions_rows
+    index_version += 1
+    if not rows_appended:
+        with positions_lock:
+            path_positions, category_positions, positions_rows = None, None, 0
+    result_cache.clear()
+
+# Lazily built filepath -> index position map for the live snapshot
+path_positions = None
+# Lazily built category -> sorted index positions map for the live snapshot
+category_positions = None
+# Rows of image_paths the maps cover
+positions_rows = 0
+positions_lock = threading.Lock()
+
+def update_position_maps():
+    """Build the position maps, or extend them with rows appended since they were last used; returns both"""
+    global path_positions, category_positions, positions_rows
+    with positions_lock:
+        paths = image_paths
+        if path_positions is None:
+            path_positions, category_positions, positions_rows = {}, {}, 0
+        count = len(paths)
+        if positions_rows >= count:
+            return path_positions, category_positions
+        grouped = {}
+        for i, p in enumerate(paths[positions_rows:count], start=positions_rows):
+            path_positions[p] = i
+            grouped.setdefault(os.path.basename(os.path.dirname(p)), []).append(i)
+        for category, ids in grouped.items():
+            ids = np.array(ids, dtype='int64')
+            previous = category_positions.get(category)
+            category_positions[category] = ids if previous is None else np.concatenate([previous, ids])
+        positions_rows = count
+        return path_positions, category_positions
+
+def position_of_path(filepath: str) -> Optional[int]:
+    """Index position of an indexed image given its stored filepath"""
+    by_path, _ = update_position_maps()
+    position = by_path.get(filepath)
+    if position is None:
+        position = by_path.get(str(UPLOADS_DIR / filepath))
+    return position
+
+def unindexed_rows(paths: List[str]) -> List[int]:
+    """Positions in paths of files the live index does not hold yet
+    
+    The first lookup after a snapshot swap builds the position map over every indexed
+    path, so call this off the event loop.
+    """
+    return [i for i, p in enumerate(paths) if position_of_path(p) is None]
+
+def positions_for_categories(categories) -> np.ndarray:
+    """Sorted index positions of the images in any of the given categories"""
+    _, by_category = update_position_maps()
+    arrays = [by_category[c] for c in categories if c in by_category]
+    return np.sort(np.concatenate(arrays)) if arrays else np.empty(0, dtype='int64')
+
+def hash_file(path: str) -> str:
+    """SHA-256 of a file's bytes"""
+    digest = hashlib.sha256()
+    with open(path, "rb") as f:
+        for chunk in iter(lambda: f.read(1 << 20), b""):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+def hash_source(source) -> str:
+    """SHA-256 of an image given as a file path or raw bytes"""
+    if isinstance(source, bytes):
+        return hashlib.sha256(source).hexdigest()
+    return hash_file(source)
+
+def hash_bands(perceptual_hash: str) -> List[str]:
+    """Lookup keys for a dHash; two hashes within HASH_BANDS - 1 bits share at least one"""
+    width = len(perceptual_hash) // HASH_BANDS
+    return [f"{i}:{perceptual_hash[i * width:(i + 1) * width]}" for i in range(HASH_BANDS)]
+
+def hash_distance(a: str, b: str) -> int:
+    return bin(int(a, 16) ^ int(b, 16)).count("1")
+
+def perceptual_hashes(sources: List) -> List[Optional[str]]:
+    """dHash of each image, or None for images that cannot be decoded"""
+    hashes = []
+    for source in sources:
+        try:
+            hashes.append(image_decode.difference_hash(source))
+        except Exception:
+            hashes.append(None)
+    return hashes
+
+class LogWriter:
+    """Queues activity log documents and writes them to Mongo in bulk, off the request path"""
+    
+    def __init__(self, flush_size: int, flush_interval: float, max_queue: int, overflow: str):
+        self.flush_size = max(1, flush_size)
+        self.flush_interval = flush_interval
+        self.max_queue = max_queue
+        self.overflow = overflow
+        self.dropped = 0
+        self._queue = None
+        self._task = None
+        self._batch = []
+    
+    async def write(self, doc: dict):
+        """Queue one document; when the queue is full it is dropped or waits, per the overflow policy"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue(maxsize=self.max_queue)
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        if self.overflow == "block":
+            await self._queue.put(doc)
+            return
+        try:
+            self._queue.put_nowait(doc)
+        except asyncio.QueueFull:
+            self.dropped += 1
+            log_dropped_total.inc()
+    
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+    
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            # Await before touching self._batch: flush() may swap it out while we wait
+            doc = await self._queue.get()
+            self._batch.append(doc)
+            deadline = loop.time() + self.flush_interval
+            while len(self._batch) < self.flush_size:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    doc = await asyncio.wait_for(self._queue.get(), timeout)
+                except asyncio.TimeoutError:
+                    break
+                self._batch.append(doc)
+            await self.flush()
+    
+    async def flush(self):
+        """Write the pending batch and everything queued behind it"""
+        docs, self._batch = self._batch, []
+        while self._queue is not None and not self._queue.empty():
+            docs.append(self._queue.get_nowait())
+        if self.dropped:
+            logger.warning(f"Dropped {self.dropped} activity log entries because the log queue was full")
+            self.dropped = 0
+        for start in range(0, len(docs), self.flush_size):
+            try:
+                with log_flush_seconds.time():
+                    await db.logs.insert_many(docs[start:start + self.flush_size], ordered=False)
+            except Exception as e:
+                logger.error(f"Failed to write {len(docs[start:start + self.flush_size])} activity log entries: {e}")
+    
+    async def close(self):
+        """Stop the background writer and flush what is left"""
+        while self._task is not None and not self._task.done():
+            # Before Python 3.12, wait_for can swallow a cancel that races an entry arriving; retry until it lands
+            self._task.cancel()
+            await asyncio.wait([self._task], timeout=0.1)
+        await self.flush()
+
+log_writer = LogWriter(LOG_FLUSH_SIZE, LOG_FLUSH_INTERVAL, LOG_QUEUE_SIZE, LOG_OVERFLOW)
+
 async def log_activity(message: str, level: str = "INFO", category: str = "general"):
     """Log activity to database"""
     log_entry = LogEntry(message=message, level=level, category=category)
     doc = log_entry.model_dump()
     doc['timestamp'] = doc['timestamp'].isoformat()
-    await db.logs.insert_one(doc)
+    # BSON date for the TTL index; timestamp stays an ISO string for clients
+    doc['created_at'] = log_entry.timestamp
+    with stage_seconds.time(operation=LOG_OPERATIONS.get(category, category), stage="db_log"):
+        await log_writer.write(doc)
     logger.info(f"[{category}] {message}")
 
+async def ensure_log_collection():
+    """Create the logs collection's query indexes and apply the retention policy"""
+    if LOG_RETENTION == "capped":
+        if "logs" not in await db.list_collection_names(filter={"name": "logs"}):
+            await db.create_collection("logs", capped=True, size=LOG_CAPPED_BYTES)
+        elif not (await db.logs.options()).get("capped"):
+            await db.command("convertToCapped", "logs", size=LOG_CAPPED_BYTES)
+    
+    # Serve category-filtered and unfiltered pages newest first without an in-memory sort
+    await db.logs.create_index([("category", 1), ("timestamp", -1), ("id", -1)])
+    await db.logs.create_index([("timestamp", -1), ("id", -1)])
+    
+    if LOG_RETENTION == "ttl":
+        expire_after = int(LOG_TTL_DAYS * 86400)
+        try:
+            await db.logs.create_index("created_at", expireAfterSeconds=expire_after)
+        except OperationFailure:
+            # The TTL index exists with another lifetime; change it in place
+            await db.command("collMod", "logs", index={"keyPattern": {"created_at": 1}, "expireAfterSeconds": expire_after})
+
+def encode_log_cursor(doc: dict) -> str:
+    """Opaque cursor pointing just past a log entry in (timestamp, id) descending order"""
+    return base64.urlsafe_b64encode(json.dumps([doc["timestamp"], doc["id"]]).encode()).decode()
+
+def decode_log_cursor(cursor: str):
+    try:
+        timestamp, entry_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), str(entry_id)
+    except Exception:
+        raise HTTPException(status_code=400, detail="Invalid cursor")
+
 def load_feature_extractor():
-    """Load ResNet50 model for feature extraction"""
+    """Load the ResNet50 feature extractor for the configured backend"""
     global feature_extractor
-    if feature_extractor is None:
+    with extractor_lock:
+        if feature_extractor is None:
+            try:
+                feature_extractor = feature_extractors.create_extractor(
+                    FEATURE_BACKEND, RESNET_WEIGHTS, MODELS_DIR
+                )
+                logger.info(f"ResNet50 feature extractor loaded ({FEATURE_BACKEND}, {MODEL_ID})")
+            except Exception as e:
+                logger.error(f"Failed to load feature extractor: {e}")
+                raise
+    return feature_extractor
+
+def load_image_array(image_path) -> np.ndarray:
+    """Decode an image (file path or raw bytes) and resize it to the 224x224 RGB network input"""
+    return image_decode.load_image_array(image_path, JPEG_DRAFT)
+
+def get_decode_pool() -> ProcessPoolExecutor:
+    """Lazily start the decode worker processes"""
+    global decode_pool
+    if decode_pool is None:
+        # Spawned workers import only image_decode, never TensorFlow or this module
+        decode_pool = ProcessPoolExecutor(
+            max_workers=DECODE_WORKERS, mp_context=multiprocessing.get_context('spawn')
+        )
+    return decode_pool
+
+def preprocess_batch_shared(image_paths: List):
+    """Decode a batch across the worker processes straight into a shared-memory tensor"""
+    count = len(image_paths)
+    shm = shared_memory.SharedMemory(
+        create=True, size=count * int(np.prod(image_decode.BATCH_ITEM_SHAPE)) * 4
+    )
+    try:
+        pool = get_decode_pool()
+        slots = list(enumerate(image_paths))
+        chunk = -(-count // DECODE_WORKERS)
+        futures = [
+            pool.submit(image_decode.decode_into_shared, shm.name, count, slots[i:i + chunk], JPEG_DRAFT)
+            for i in range(0, count, chunk)
+        ]
+        errors = dict(error for future in futures for error in future.result())
+        
+        ok = [i for i in range(count) if i not in errors]
+        batch = np.ndarray((count,) + image_decode.BATCH_ITEM_SHAPE, dtype='float32', buffer=shm.buf)
+        # Rows are copied out of the shared buffer before it is released
+        tensor = batch[ok] if ok else None
+        del batch
+    finally:
+        shm.close()
+        shm.unlink()
+    
+    kept = [image_paths[i] for i in ok]
+    failed = [(image_paths[i], error) for i, error in sorted(errors.items())]
+    return tensor, kept, failed
+
+def preprocess_batch(image_paths: List[str]):
+    """Decode and preprocess a batch of images, skipping files that fail to load"""
+    if DECODE_WORKERS > 0 and image_paths:
+        return preprocess_batch_shared(image_paths)
+    
+    arrays, kept, failed = [], [], []
+    for image_path in image_paths:
         try:
-            from tensorflow.keras.applications import ResNet50
-            from tensorflow.keras.models import Model
-            base_model = ResNet50(weights='imagenet', include_top=False, pooling='avg')
-            feature_extractor = base_model
-            logger.info("ResNet50 feature extractor loaded successfully")
+            arrays.append(load_image_array(image_path))
+            kept.append(image_path)
         except Exception as e:
-            logger.error(f"Failed to load feature extractor: {e}")
-            raise
-    return feature_extractor
+            failed.append((image_path, str(e)))
+    
+    if not arrays:
+        return None, kept, failed
+    return image_decode.preprocess_input(np.stack(arrays)), kept, failed
+
+def predict_batch(batch: np.ndarray, operation: Optional[str] = None) -> np.ndarray:
+    """Run ResNet50 once over a preprocessed batch, timed as an inference stage of operation if given"""
+    model = load_feature_extractor()
+    started = time.perf_counter()
+    features = model.predict(batch)
+    if operation is not None:
+        stage_seconds.observe(time.perf_counter() - started, operation=operation, stage="inference")
+    return features.reshape(len(batch), -1).astype('float32')
 
 def extract_features(image_path: str) -> np.ndarray:
     """Extract features from a single image"""
-    from tensorflow.keras.applications.resnet50 import preprocess_input
-    from tensorflow.keras.preprocessing import image as keras_image
+    img_array = np.expand_dims(load_image_array(image_path), axis=0)
+    return predict_batch(image_decode.preprocess_input(img_array))[0]
+
+def prepare_batch(image_paths: List, seed: Optional[dict] = None, operation: str = "build",
+                  memo: Optional[ResultCache] = None):
+    """Hash a batch of images, look them up in the embedding cache and preprocess only the misses
     
-    model = load_feature_extractor()
-    img = keras_image.load_img(image_path, target_size=(224, 224))
-    img_array = keras_image.img_to_array(img)
-    img_array = np.expand_dims(img_array, axis=0)
-    img_array = preprocess_input(img_array)
-    features = model.predict(img_array, verbose=0)
-    return features.flatten()
-
-def build_faiss_index_sync(features: np.ndarray):
+    Images are file paths or raw bytes.
+    seed optionally maps path -> previously computed vector for files known to be unchanged;
+    those are written to the cache instead of being re-extracted.
+    memo optionally is an in-memory digest -> vector cache checked before the embedding cache.
+    """
+    started = time.perf_counter()
+    digests, failed = {}, []
+    for image_path in image_paths:
+        try:
+            digests[image_path] = hash_source(image_path)
+        except Exception as e:
+            failed.append((image_path, str(e)))
+    
+    cached = {}
+    if memo is not None:
+        for digest in set(digests.values()):
+            vector = memo.get(digest)
+            if vector is not None:
+                cached[digest] = vector
+    cached.update(embedding_cache.get_many(d for d in digests.values() if d not in cached))
+    if seed:
+        seeded = {digests[p]: seed[p] for p in digests if p in seed and digests[p] not in cached}
+        embedding_cache.put_many(seeded)
+        cached.update(seeded)
+    
+    # Decode one file per distinct missing digest
+    to_decode = {}
+    for image_path, digest in digests.items():
+        if digest not in cached and digest not in to_decode:
+            to_decode[digest] = image_path
+    stage_seconds.observe(time.perf_counter() - started, operation=operation, stage="cache_lookup")
+    with stage_seconds.time(operation=operation, stage="decode"):
+        batch, decoded, decode_failed = preprocess_batch(list(to_decode.values()))
+    bad_digests = {digests[p] for p, _ in decode_failed}
+    failed.extend((p, error) for p, error in decode_failed)
+    failed.extend(
+        (p, "duplicate of an unreadable image") for p, d in digests.items()
+        if d in bad_digests and to_decode[d] != p
+    )
+    return batch, decoded, failed, digests, cached
+
+async def extract_features_pipelined(image_paths: List[str], batch_size: Optional[int] = None,
+                                     seed: Optional[dict] = None, stats: Optional[dict] = None,
+                                     pool: Optional[ThreadPoolExecutor] = None, operation: str = "build"):
+    """Extract features in fixed-size batches, decoding the next batch while the current one runs inference
+    
+    Images already in the embedding cache skip decoding and inference. Yields
+    (features, kept_paths, failed) per batch, where failed is a list of (path, error).
+    If stats is given, its "cache_hits" and "cache_misses" counters are incremented.
+    Work runs on pool, defaulting to the shared executor. Stage timings are recorded under operation.
+    """
+    batch_size = max(1, batch_size or FEATURE_BATCH_SIZE)
+    batches = [image_paths[i:i + batch_size] for i in range(0, len(image_paths), batch_size)]
+    if not batches:
+        return
+    
+    pool = pool or executor
+    loop = asyncio.get_event_loop()
+    pending = loop.run_in_executor(pool, prepare_batch, batches[0], seed, operation)
+    for i in range(len(batches)):
+        batch, decoded, failed, digests, cached = await pending
+        if i + 1 < len(batches):
+            pending = loop.run_in_executor(pool, prepare_batch, batches[i + 1], seed, operation)
+        
+        computed = {}
+        if batch is not None:
+            features = await loop.run_in_executor(pool, predict_batch, batch, operation)
+            computed = {digests[p]: vec for p, vec in zip(decoded, features)}
+            await loop.run_in_executor(pool, embedding_cache.put_many, computed)
+        
+        failed_paths = {p for p, _ in failed}
+        kept = [p for p in batches[i] if p not in failed_paths]
+        if stats is not None:
+            misses = sum(1 for p in kept if digests[p] in computed)
+            stats["cache_hits"] = stats.get("cache_hits", 0) + len(kept) - misses
+            stats["cache_misses"] = stats.get("cache_misses", 0) + misses
+        if kept:
+            vectors = [cached[digests[p]] if digests[p] in cached else computed[digests[p]] for p in kept]
+            yield np.stack(vectors).astype('float32'), kept, failed
+        else:
+            yield np.empty((0, 0), dtype='float32'), kept, failed
+
+class SearchOptions(NamedTuple):
+    """Per-query search knobs; queries with equal options share one index search"""
+    nprobe: Optional[int] = None
+    ef_search: Optional[int] = None
+    # Sorted category names to restrict results to; None searches everything
+    categories: Optional[tuple] = None
+
+def parse_categories(value: Optional[str]) -> Optional[tuple]:
+    """Comma-separated category filter -> sorted tuple, or None when empty"""
+    if not value:
+        return None
+    categories = sorted({c.strip() for c in value.split(",") if c.strip()})
+    return tuple(categories) or None
+
+def resolve_index_type(index_type: str, count: int, dimension: int) -> str:
+    """Pick a concrete index type, falling back when the collection is too small to train it"""
+    if index_type == "auto":
+        # Exact search is fast enough for small collections; HNSW for mid-size; compressed IVF-PQ beyond
+        if count < 50_000:
+            index_type = "flat"
+        elif count < 500_000:
+            index_type = "hnsw"
+        else:
+            index_type = "ivfpq"
+    if index_type == "ivfpq" and (count < 10_000 or dimension % IVFPQ_M != 0):
+        index_type = "ivf"
+    if index_type == "ivf" and count < 1_000:
+        index_type = "flat"
+    return index_type
+
+def index_type_name(index) -> str:
+    """Name of a FAISS index in INDEX_TYPES terms"""
+    import faiss
+    if isinstance(index, ShardedIndex):
+        return index.index_type
+    if isinstance(index, faiss.IndexHNSW):
+        return "hnsw"
+    if isinstance(index, faiss.IndexIVFPQ):
+        return "ivfpq"
+    if isinstance(index, faiss.IndexIVF):
+        return "ivf"
+    return "flat"
+
+def build_faiss_index_sync(features: np.ndarray, index_type: Optional[str] = None):
     """Build FAISS index synchronously"""
     import faiss
-    dimension = features.shape[1]
-    index = faiss.IndexFlatIP(dimension)  # Inner product (cosine similarity after normalization)
+    count, dimension = features.shape
+    index_type = resolve_index_type(index_type or INDEX_TYPE, count, dimension)
     # Normalize features for cosine similarity
     faiss.normalize_L2(features)
+    qtype = {
+        "float16": faiss.ScalarQuantizer.QT_fp16,
+        "int8": faiss.ScalarQuantizer.QT_8bit,
+    }.get(VECTOR_STORAGE)
+    
+    if index_type == "hnsw":
+        if qtype is None:
+            index = faiss.IndexHNSWFlat(dimension, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexHNSWSQ(dimension, qtype, HNSW_M, faiss.METRIC_INNER_PRODUCT)
+        index.hnsw.efConstruction = HNSW_EF_CONSTRUCTION
+        index.hnsw.efSearch = HNSW_EF_SEARCH
+    elif index_type in ("ivf", "ivfpq"):
+        nlist = int(max(1, min(4 * np.sqrt(count), count // 39)))
+        quantizer = faiss.IndexFlatIP(dimension)
+        if index_type == "ivfpq":
+            index = faiss.IndexIVFPQ(quantizer, dimension, nlist, IVFPQ_M, 8, faiss.METRIC_INNER_PRODUCT)
+        elif qtype is None:
+            index = faiss.IndexIVFFlat(quantizer, dimension, nlist, faiss.METRIC_INNER_PRODUCT)
+        else:
+            index = faiss.IndexIVFScalarQuantizer(quantizer, dimension, nlist, qtype, faiss.METRIC_INNER_PRODUCT)
+        index.nprobe = min(IVF_NPROBE, nlist)
+    elif qtype is None:
+        index = faiss.IndexFlatIP(dimension)  # Inner product (cosine similarity after normalization)
+    else:
+        index = faiss.IndexScalarQuantizer(dimension, qtype, faiss.METRIC_INNER_PRODUCT)
+    
+    if not index.is_trained:
+        index.train(features)
     index.add(features)
     return index
 
-async def build_index():
-    """Build FAISS index from all dataset images"""
-    global faiss_index, image_paths, features_array
+def index_storage(index) -> str:
+    """How an index stores vectors: "float32", "float16", "int8" or "pq" codes"""
+    if isinstance(index, ShardedIndex):
+        return index.vector_storage
+    return index_shards.vector_storage(index)
+
+def search_index(index, queries: np.ndarray, k: int, options: SearchOptions = SearchOptions(), selector=None):
+    """Search normalized query vectors, applying per-query options"""
+    params = index_shards.search_parameters(index, options.nprobe, options.ef_search, selector)
+    if params is None:
+        return index.search(queries, k)
+    return index.search(queries, k, params=params)
+
+def search_partition(features, positions: np.ndarray, queries: np.ndarray, k: int):
+    """Exact top-k over the stored vectors at the given positions"""
+    return index_shards.exact_top_k(index_shards.normalized_rows(features, positions), positions, queries, k)
+
+def rerank_exact(features, queries: np.ndarray, candidates: np.ndarray, k: int):
+    """Re-score candidate ids with the full-precision stored vectors and keep the best k per query"""
+    return index_shards.rerank(lambda ids: index_shards.normalized_rows(features, ids), queries, candidates, k)
+
+def search_live(index, features, queries: np.ndarray, k: int, options: SearchOptions):
+    """Search the live index, pushing any category filter down into the search
+    
+    Filtered queries scan only the selected categories, or for large categories in an
+    ANN index use an ID selector, falling back to an exact scan if it returns fewer than k hits.
+    Indexes holding compressed codes over-fetch candidates and re-rank them exactly.
+    Sharded indexes apply the same rules inside each shard worker.
+    """
+    import faiss
+    selector = None
+    if options.categories is not None:
+        positions = positions_for_categories(options.categories)
+        if len(positions) == 0:
+            return np.zeros((len(queries), 0), dtype='float32'), np.zeros((len(queries), 0), dtype='int64')
+        k = min(k, len(positions))
+        if not isinstance(index, ShardedIndex):
+            if index_type_name(index) == "flat" or len(positions) <= CATEGORY_EXACT_MAX:
+                return search_partition(features, positions, queries, k)
+            selector = faiss.IDSelectorBatch(positions)
+    
+    if isinstance(index, ShardedIndex):
+        allowed = positions if options.categories is not None else None
+        distances, indices = index.search(queries, k, options, allowed)
+    else:
+        compressed = index_storage(index) != "float32"
+        fetch = min(k * max(1, RERANK_FACTOR), index.ntotal) if compressed else k
+        distances, indices = search_index(index, queries, fetch, options, selector)
+        if compressed:
+            distances, indices = rerank_exact(features, queries, indices, k)
+        if selector is not None and (indices >= 0).sum(axis=1).min() < k:
+            return search_partition(features, positions, queries, k)
+    if features is not None and len(features) > index.ntotal:
+        # Appended rows not yet folded into the index (or, with SHARED_INDEX, checkpointed) are scanned exactly
+        tail = np.arange(index.ntotal, len(features), dtype='int64')
+        if options.categories is not None:
+            tail = np.intersect1d(tail, positions)
+        if len(tail):
+            distances, indices = merge_top_k([(distances, indices), search_partition(features, tail, queries, k)], k)
+    return distances, indices
+
+def index_recall_report(index, features: np.ndarray, k: int = 10, sample_size: int = 200,
+                        chunk_rows: int = 65536) -> dict:
+    """Measure recall@k and per-query latency of an index against exact flat search
+    
+    features are the vectors the index was built from; a sample of them is used as queries.
+    Ground truth is scored chunk_rows rows at a time, without copying them into a flat index.
+    Sharded indexes re-rank inside their workers, so their recall is measured as served.
+    """
+    rng = np.random.default_rng(0)
+    sample = rng.choice(len(features), size=min(sample_size, len(features)), replace=False)
+    queries = index_shards.normalized_rows(features, sample)
+    k = min(k, len(features))
+    
+    start = time.perf_counter()
+    truth = None
+    for first in range(0, len(features), chunk_rows):
+        rows = np.arange(first, min(first + chunk_rows, len(features)), dtype='int64')
+        found = index_shards.exact_top_k(index_shards.normalized_rows(features, rows), rows, queries, k)
+        truth = found if truth is None else merge_top_k([truth, found], k)
+    truth = truth[1]
+    flat_ms = (time.perf_counter() - start) * 1000 / len(queries)
+    
+    index_type = index_type_name(index)
+    if index_type in ("ivf", "ivfpq"):
+        # Shards size their own lists; FAISS caps nprobe at each shard's nlist
+        sweep = [SearchOptions(nprobe=n) for n in (1, 4, 16, 64, 256) if n <= getattr(index, "nlist", n)]
+    elif index_type == "hnsw":
+        sweep = [SearchOptions(ef_search=ef) for ef in (16, 32, 64, 128, 256)]
+    else:
+        sweep = [SearchOptions()]
+    
+    def recall(found):
+        return sum(len(set(f) & set(t)) for f, t in zip(found, truth)) / truth.size
+    
+    storage = index_storage(index)
+    points = []
+    for options in sweep:
+        start = time.perf_counter()
+        if isinstance(index, ShardedIndex):
+            _, found = index.search(queries, k, options)
+        else:
+            _, found = search_index(index, queries, k, options)
+        latency_ms = (time.perf_counter() - start) * 1000 / len(queries)
+        point = {
+            **{name: value for name, value in options._asdict().items() if value is not None},
+            "recall": recall(found),
+            "latency_ms": latency_ms,
+        }
+        if storage != "float32" and not isinstance(index, ShardedIndex):
+            # Quality as served: first pass over compressed codes, then exact re-ranking
+            start = time.perf_counter()
+            _, found = search_live(index, features, queries, k, options)
+            point["reranked_recall"] = recall(found)
+            point["reranked_latency_ms"] = (time.perf_counter() - start) * 1000 / len(queries)
+        points.append(point)
+    
+    return {
+        "index_type": index_type,
+        "vector_storage": storage,
+        "ntotal": int(index.ntotal),
+        "k": k,
+        "queries": len(queries),
+        "flat_latency_ms": flat_ms,
+        "results": points,
+    }
+
+class PathTable:
+    """Image paths stored as concatenated UTF-8 (image_paths.dat) plus uint64 end offsets (image_paths.idx)
+    
+    Both files are memory-mapped, so opening a table is O(1) and entries are decoded on access.
+    """
+    
+    OFFSETS_FILE = "image_paths.idx"
+    DATA_FILE = "image_paths.dat"
+    
+    def __init__(self, directory: Path):
+        offsets_path = directory / self.OFFSETS_FILE
+        data_path = directory / self.DATA_FILE
+        # Only whole offset entries count; a torn trailing write is ignored
+        count = offsets_path.stat().st_size // 8
+        self._offsets = np.memmap(offsets_path, dtype='<u8', mode='r', shape=(count,)) if count else np.zeros(0, dtype='<u8')
+        size = data_path.stat().st_size
+        self._data = np.memmap(data_path, dtype=np.uint8, mode='r') if size else np.zeros(0, dtype=np.uint8)
+    
+    def __len__(self):
+        return len(self._offsets)
+    
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self[j] for j in range(*i.indices(len(self)))]
+        i = int(i)
+        if i < 0:
+            i += len(self)
+        if not 0 <= i < len(self):
+            raise IndexError("path table index out of range")
+        start = int(self._offsets[i - 1]) if i else 0
+        return self._data[start:int(self._offsets[i])].tobytes().decode('utf-8')
+    
+    def __iter__(self):
+        for i in range(len(self)):
+            yield self[i]
+    
+    @classmethod
+    def exists(cls, directory: Path) -> bool:
+        return (directory / cls.OFFSETS_FILE).exists() and (directory / cls.DATA_FILE).exists()
+    
+    @classmethod
+    def write(cls, directory: Path, paths):
+        encoded = [p.encode('utf-8') for p in paths]
+        offsets = np.cumsum([len(e) for e in encoded], dtype='<u8')
+        with open(directory / cls.DATA_FILE, "wb") as f:
+            f.write(b"".join(encoded))
+        with open(directory / cls.OFFSETS_FILE, "wb") as f:
+            f.write(offsets.tobytes())
+    
+    @classmethod
+    def append(cls, directory: Path, paths: List[str]):
+        """Append entries; data is written before the offsets that make it visible"""
+        encoded = [p.encode('utf-8') for p in paths]
+        offsets_path = directory / cls.OFFSETS_FILE
+        count = offsets_path.stat().st_size // 8
+        end = 0
+        if count:
+            with open(offsets_path, "rb") as f:
+                f.seek((count - 1) * 8)
+                end = int(np.frombuffer(f.read(8), dtype='<u8')[0])
+        with open(directory / cls.DATA_FILE, "r+b") as f:
+            f.seek(end)
+            f.truncate()
+            f.write(b"".join(encoded))
+        offsets = end + np.cumsum([len(e) for e in encoded], dtype='<u8')
+        with open(offsets_path, "r+b") as f:
+            f.seek(count * 8)
+            f.truncate()
+            f.write(offsets.astype('<u8').tobytes())
+
+def get_shard_workers(count: int) -> list:
+    """Lazily start at least count shard worker processes"""
+    context = multiprocessing.get_context('spawn')
+    while len(shard_workers) < count:
+        # Spawned workers import only index_shards, never TensorFlow or this module
+        shard_workers.append(ProcessPoolExecutor(max_workers=1, mp_context=context))
+    return shard_workers[:count]
+
+def merge_top_k(results: list, k: int):
+    """Merge per-shard (scores, positions) into the overall top k by score"""
+    distances = np.concatenate([d for d, _ in results], axis=1)
+    indices = np.concatenate([i for _, i in results], axis=1)
+    distances = np.where(indices >= 0, distances, np.finfo('float32').min)
+    top = np.argsort(-distances, axis=1, kind='stable')[:, :k]
+    return np.take_along_axis(distances, top, axis=1), np.take_along_axis(indices, top, axis=1)
+
+class ShardedIndex:
+    """Live index split across shard worker processes
+    
+    Searches scatter the query vectors to every shard (or only the shards holding the
+    requested categories when sharded by category) and merge the per-shard top k by score.
+    Ids are global positions, so results line up with image_paths and features_array.
+    With SHARED_INDEX the shards are never appended to, so each worker's shard processes
+    keep mapping the published files; search_live scans the rows past ntotal exactly
+    until a checkpoint writes them into new shard files.
+    """
+    
+    def __init__(self, directory: Path, manifest: dict):
+        self.directory = directory
+        self.key = directory.name
+        self.by = manifest["by"]
+        self.shards = manifest["shards"]
+        # Rows covered by the shard files; rows appended later are replayed from features.npy
+        self.built = manifest["built"]
+        self.ntotal = self.built
+        self.d = manifest["dimension"]
+        self.opened = False
+    
+    @property
+    def index_type(self) -> str:
+        """Type of the largest shard; small shards may fall back to simpler indexes"""
+        return max(self.shards, key=lambda shard: shard["vectors"])["index_type"]
+    
+    @property
+    def vector_storage(self) -> str:
+        return max(self.shards, key=lambda shard: shard["vectors"])["vector_storage"]
+    
+    def manifest(self) -> dict:
+        return {"by": self.by, "built": self.built, "dimension": self.d, "shards": self.shards}
+    
+    def workers(self) -> list:
+        return get_shard_workers(len(self.shards))
+    
+    def open(self):
+        """Load every shard into its worker; a no-op once open"""
+        if self.opened:
+            return
+        futures = [
+            worker.submit(index_shards.open_shard, self.key, str(index_shards.shard_dir(self.directory, i)), INDEX_MMAP)
+            for i, worker in enumerate(self.workers())
+        ]
+        for future in futures:
+            future.result()
+        self.opened = True
+    
+    def close(self):
+        """Release the shards in their workers, after any searches already queued there"""
+        if self.opened:
+            for worker in self.workers():
+                worker.submit(index_shards.close_shard, self.key)
+            self.opened = False
+    
+    def add_images(self, start: int, paths, features: np.ndarray) -> int:
+        """Route rows at global positions start.. to their shards by path"""
+        assignment = np.array([index_shards.shard_of(p, len(self.shards), self.by) for p in paths], dtype='int64')
+        positions = np.arange(start, start + len(paths), dtype='int64')
+        futures = []
+        for shard, worker in enumerate(self.workers()):
+            rows = np.flatnonzero(assignment == shard)
+            if len(rows):
+                futures.append(worker.submit(index_shards.add_to_shard, self.key, positions[rows], features[rows]))
+        for future in futures:
+            future.result()
+        self.ntotal = max(self.ntotal, start + len(paths))
+        return len(paths)
+    
+    def checkpoint(self, directory: Path, features, paths) -> "ShardedIndex":
+        """Write shard files under directory that also hold the rows appended since these were built
+        
+        Shards are copied one at a time in this process; the unopened index is returned.
+        """
+        start = self.built
+        assignment = np.array(
+            [index_shards.shard_of(p, len(self.shards), self.by) for p in paths[start:]], dtype='int64'
+        )
+        shards = []
+        for shard, info in enumerate(self.shards):
+            rows = start + np.flatnonzero(assignment == shard)
+            vectors = index_shards.extend_shard(
+                index_shards.shard_dir(self.directory, shard), index_shards.shard_dir(directory, shard),
+                rows, features[rows]
+            )
+            shards.append({**info, "vectors": vectors})
+        return ShardedIndex(directory, {"by": self.by, "built": len(paths), "dimension": self.d, "shards": shards})
+    
+    def replay(self, features, paths) -> int:
+        """Add feature rows appended after the shards were built"""
+        if self.ntotal >= len(features):
+            return 0
+        start = self.ntotal
+        return self.add_images(start, paths[start:len(features)], np.array(features[start:], dtype='float32'))
+    
+    def search(self, queries: np.ndarray, k: int, options: SearchOptions, allowed=None):
+        workers = list(enumerate(self.workers()))
+        if self.by == "category" and options.categories is not None:
+            targets = {index_shards.bucket(c, len(self.shards)) for c in options.categories}
+            workers = [(shard, worker) for shard, worker in workers if shard in targets]
+        futures = [
+            worker.submit(
+                index_shards.search_shard, self.key, queries, k, options.nprobe, options.ef_search,
+                RERANK_FACTOR, allowed, CATEGORY_EXACT_MAX
+            )
+            for _, worker in workers
+        ]
+        return merge_top_k([future.result() for future in futures], k)
+
+def build_shard_sync(directory: Path, shard: int, features: np.ndarray, rows: np.ndarray,
+                     index_type: Optional[str], threads: int) -> dict:
+    """Build and write one shard's index from the given feature rows"""
+    import faiss
+    # Per-thread OpenMP setting, so parallel shard builds share the cores instead of oversubscribing
+    faiss.omp_set_num_threads(threads)
+    vectors = np.array(features[rows], dtype='float32')
+    if len(rows):
+        index = build_faiss_index_sync(vectors.copy(), index_type)
+    else:
+        # Nothing to train on; an exact index can still take appended images
+        index = faiss.IndexFlatIP(features.shape[1])
+    index_shards.write_shard(index_shards.shard_dir(directory, shard), index, rows, vectors)
+    return {"vectors": len(rows), "index_type": index_type_name(index), "vector_storage": index_storage(index)}
+
+def build_sharded_index_sync(directory: Path, features: np.ndarray, paths, index_type: Optional[str] = None):
+    """Split vectors into INDEX_SHARDS shards by SHARD_BY and build the shard indexes in parallel
+    
+    FAISS releases the GIL while training and adding, so the builds run on threads.
+    Each shard picks its index type for its own size. Returns an unopened ShardedIndex.
+    """
+    assignment = np.array([index_shards.shard_of(p, INDEX_SHARDS, SHARD_BY) for p in paths], dtype='int64')
+    threads = max(1, (os.cpu_count() or 1) // INDEX_SHARDS)
+    with ThreadPoolExecutor(max_workers=INDEX_SHARDS) as pool:
+        futures = [
+            pool.submit(build_shard_sync, directory, shard, features, np.flatnonzero(assignment == shard), index_type, threads)
+            for shard in range(INDEX_SHARDS)
+        ]
+        shards = [future.result() for future in futures]
+    return ShardedIndex(directory, {"by": SHARD_BY, "built": len(paths), "dimension": features.shape[1], "shards": shards})
+
+def save_index_artifacts(directory: Path, index, features: np.ndarray, paths):
+    """Write an index with its raw features and paths to a directory
+    
+    Sharded indexes write their shard directories when they are built; only features and paths are written here.
+    """
+    import faiss
+    directory.mkdir(parents=True, exist_ok=True)
+    if not isinstance(index, ShardedIndex):
+        faiss.write_index(index, str(directory / "faiss_index.bin"))
+    np.save(str(directory / "features.npy"), features)
+    PathTable.write(directory, paths)
+
+def current_snapshot_dir() -> Path:
+    """Directory of the published index: the snapshot named by CURRENT, or DATA_DIR for older layouts"""
+    if CURRENT_SNAPSHOT_FILE.exists():
+        name = CURRENT_SNAPSHOT_FILE.read_text().strip()
+        if name:
+            return SNAPSHOTS_DIR / name
+    return DATA_DIR
+
+def new_snapshot_dir() -> Path:
+    """Fresh, time-ordered snapshot directory name under SNAPSHOTS_DIR"""
+    stamp = datetime.now(timezone.utc).strftime('%Y%m%dT%H%M%S')
+    return SNAPSHOTS_DIR / f"{stamp}-{uuid.uuid4().hex[:8]}"
+
+def publish_snapshot(directory: Path, manifest: dict):
+    """Atomically make a complete snapshot the current one, then prune old snapshots"""
+    with open(directory / "manifest.json", "w") as f:
+        json.dump(manifest, f, indent=2)
+    
+    pointer_tmp = CURRENT_SNAPSHOT_FILE.with_suffix(".tmp")
+    with open(pointer_tmp, "w") as f:
+        f.write(directory.name)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(pointer_tmp, CURRENT_SNAPSHOT_FILE)
+    
+    snapshots = sorted(d for d in SNAPSHOTS_DIR.iterdir() if d.is_dir() and d.name != directory.name)
+    for old in snapshots[:max(0, len(snapshots) - (SNAPSHOT_RETENTION - 1))]:
+        shutil.rmtree(old, ignore_errors=True)
+
+def snapshot_manifest(directory: Path, index, count: int) -> dict:
+    manifest = {
+        "version": directory.name,
+        "created_at": datetime.now(timezone.utc).isoformat(),
+        "count": count,
+        "index_type": index_type_name(index),
+        "vector_storage": index_storage(index),
+        "model_id": MODEL_ID,
+    }
+    if isinstance(index, ShardedIndex):
+        manifest["shards"] = index.manifest()
+    return manifest
+
+def read_snapshot_manifest(directory: Path) -> dict:
+    manifest_path = directory / "manifest.json"
+    if not manifest_path.exists():
+        return {}
+    with open(manifest_path, "r") as f:
+        return json.load(f)
+
+def replay_pending_vectors(index, features: np.ndarray) -> int:
+    """Add feature rows appended after the index checkpoint was written"""
+    import faiss
+    if index.ntotal >= len(features):
+        return 0
+    pending = np.array(features[index.ntotal:], dtype='float32')
+    faiss.normalize_L2(pending)
+    index.add(pending)
+    return len(pending)
+
+def open_index_artifacts(directory: Path):
+    """Point the live globals at the artifacts in a directory, mapped or in memory per INDEX_MMAP"""
+    global faiss_index, image_paths, features_array, index_mmapped, live_dir
+    paths = PathTable(directory)
+    sharded = read_snapshot_manifest(directory).get("shards")
+    if sharded:
+        index = ShardedIndex(directory, sharded)
+        index.open()
+        features = np.load(str(directory / "features.npy"), mmap_mode='r')
+        mmapped = False
+    else:
+        index = index_shards.read_index(directory / "faiss_index.bin", INDEX_MMAP)
+        features = np.load(str(directory / "features.npy"), mmap_mode='r' if MMAP_FEATURES else None)
+        mmapped = INDEX_MMAP
+    if SHARED_INDEX:
+        # Another worker may be between writing an appended row's features and its path
+        features = features[:len(paths)]
+    with index_mutex:
+        previous = faiss_index
+        faiss_index, features_array, index_mmapped, live_dir = index, features, mmapped, directory
+        image_paths = paths if INDEX_MMAP else list(paths)
+    release_shards(previous, index)
+
+def release_shards(previous, current):
+    """Close a replaced sharded index unless the same shards were just reopened under its key"""
+    if isinstance(previous, ShardedIndex) and previous is not current:
+        if not (isinstance(current, ShardedIndex) and current.key == previous.key):
+            previous.close()
+
+def swap_live_index(directory: Path, index, features: np.ndarray, paths):
+    """Make a freshly built index live in one step, so searches see either the old or the new state"""
+    global faiss_index, image_paths, features_array, index_mmapped, live_dir
+    if INDEX_MMAP and not isinstance(index, ShardedIndex):
+        open_index_artifacts(directory)
+    else:
+        if isinstance(index, ShardedIndex):
+            index.open()
+        if MMAP_FEATURES or isinstance(index, ShardedIndex):
+            # Full-precision vectors are only read for re-ranking; leave them on disk
+            features = np.load(str(directory / "features.npy"), mmap_mode='r')
+        with index_mutex:
+            previous = faiss_index
+            faiss_index, features_array = index, features
+            image_paths = PathTable(directory) if INDEX_MMAP else list(paths)
+            index_mmapped, live_dir = False, directory
+        release_shards(previous, index)
+    bump_index_version()
+
+def ensure_writable_index():
+    """Replace a memory-mapped index with a private in-memory copy that can take appends"""
+    global faiss_index, index_mmapped
+    if not index_mmapped:
+        return
+    index = index_shards.read_index(live_dir / "faiss_index.bin", mmap=False)
+    replay_pending_vectors(index, features_array)
+    with index_mutex:
+        faiss_index, index_mmapped = index, False
+    logger.warning("Copied the memory-mapped index into private memory to append vectors")
+
+def clear_live_index():
+    """Drop the live index, e.g. after the dataset was cleared"""
+    global faiss_index, image_paths, features_array, index_mmapped, live_dir
+    with index_mutex:
+        previous = faiss_index
+        faiss_index, image_paths, features_array, index_mmapped, live_dir = None, [], None, False, None
+    release_shards(previous, None)
+    bump_index_version()
+
+def refresh_live_rows():
+    """Re-map the live snapshot's features and paths to pick up rows appended by another worker"""
+    global image_paths, features_array
+    paths = PathTable(live_dir)
+    features = np.load(str(live_dir / "features.npy"), mmap_mode='r')[:len(paths)]
+    with index_mutex:
+        features_array, image_paths = features, paths
+    bump_index_version(rows_appended=True)
+
+def trim_features_file(path: Path, count: int):
+    """Drop rows past count left by an interrupted append, replacing the file so mapped views stay valid"""
+    features = np.load(str(path), mmap_mode='r')
+    if len(features) <= count:
+        return
+    logger.warning(f"Dropping {len(features) - count} feature rows without a path from {path}")
+    tmp = path.with_suffix(f".{os.getpid()}.tmp.npy")
+    np.save(str(tmp), features[:count])
+    del features
+    os.replace(tmp, path)
+
+def checkpoint_shared_index():
+    """Publish a snapshot whose index includes the rows appended to the shared one, so workers stop scanning them"""
+    features = np.array(features_array)
+    paths = list(image_paths)
+    directory = new_snapshot_dir()
+    if isinstance(faiss_index, ShardedIndex):
+        index = faiss_index.checkpoint(directory, features, paths)
+        replayed = len(paths) - faiss_index.ntotal
+    else:
+        index = index_shards.read_index(live_dir / "faiss_index.bin", mmap=False)
+        replayed = replay_pending_vectors(index, features)
+    save_index_artifacts(directory, index, features, paths)
+    publish_snapshot(directory, snapshot_manifest(directory, index, len(paths)))
+    open_index_artifacts(directory)
+    # Same paths in the same order, so the position maps stay valid
+    bump_index_version(rows_appended=True)
+    logger.info(f"Checkpointed {replayed} appended vectors into snapshot {directory.name}")
+
+def append_features_file(path: Path, rows: np.ndarray):
+    """Append rows to a 2-D .npy file in place, rewriting only its header"""
+    from io import BytesIO
+    fmt = np.lib.format
+    
+    with open(path, "r+b") as f:
+        version = fmt.read_magic(f)
+        if version == (1, 0):
+            shape, fortran_order, dtype = fmt.read_array_header_1_0(f)
+        else:
+            shape, fortran_order, dtype = fmt.read_array_header_2_0(f)
+        header_len = f.tell()
+        if fortran_order or len(shape) != 2 or shape[1] != rows.shape[1]:
+            raise ValueError(f"Cannot append {rows.shape} rows to {path} with shape {shape}")
+        
+        header = BytesIO()
+        header_data = {'descr': fmt.dtype_to_descr(dtype), 'fortran_order': False,
+                       'shape': (shape[0] + rows.shape[0], shape[1])}
+        if version == (1, 0):
+            fmt.write_array_header_1_0(header, header_data)
+        else:
+            fmt.write_array_header_2_0(header, header_data)
+        if len(header.getvalue()) != header_len:
+            raise ValueError(f"Header of {path} cannot grow in place")
+        
+        f.seek(0, os.SEEK_END)
+        f.write(np.ascontiguousarray(rows, dtype=dtype).tobytes())
+        f.seek(0)
+        f.write(header.getvalue())
+
+def grow_features(current: Optional[np.ndarray], rows: np.ndarray) -> np.ndarray:
+    """Append rows to the feature matrix, over-allocating so repeated appends stay cheap"""
+    if current is None or len(current) == 0:
+        return rows.copy()
+    
+    n, m = len(current), len(rows)
+    base = current.base
+    is_prefix = (
+        isinstance(base, np.ndarray) and base.ndim == 2 and base.shape[1] == current.shape[1]
+        and base.dtype == current.dtype
+        and base.__array_interface__['data'][0] == current.__array_interface__['data'][0]
+    )
+    if not is_prefix or base.shape[0] < n + m:
+        base = np.empty((max(2 * n, n + m), current.shape[1]), dtype=current.dtype)
+        base[:n] = current
+    base[n:n + m] = rows
+    return base[:n + m]
+
+def start_live_index(features: np.ndarray, paths: List[str]):
+    """Build the first snapshot from uploaded images and make it live"""
+    directory = new_snapshot_dir()
+    if INDEX_SHARDS > 1:
+        index = build_sharded_index_sync(directory, features, paths)
+    else:
+        index = build_faiss_index_sync(features.copy())
+    save_index_artifacts(directory, index, features, paths)
+    publish_snapshot(directory, snapshot_manifest(directory, index, len(paths)))
+    swap_live_index(directory, index, features, paths)
+
+def append_to_live_index(new_features: np.ndarray, added: List[str]):
+    """Append embedded images to the live snapshot and make them searchable
+    
+    Runs off the event loop. The live index itself is never modified in place: new rows
+    are scanned exactly by search_live until APPEND_FOLD_ROWS of them are folded into a
+    new index file, so searches only wait for reference swaps.
+    """
+    global image_paths, features_array
+    features_path = live_dir / "features.npy"
+    # Features go to disk before paths; load_index trims to the shorter of the two
+    if SHARED_INDEX:
+        trim_features_file(features_path, len(image_paths))
+    append_features_file(features_path, new_features)
+    PathTable.append(live_dir, added)
+    
+    if SHARED_INDEX:
+        # The mapped index file stays as published; every worker scans the new rows exactly
+        refresh_live_rows()
+        if len(image_paths) - faiss_index.ntotal >= SHARED_CHECKPOINT_ROWS:
+            checkpoint_shared_index()
+        return
+    
+    start = len(image_paths)
+    if isinstance(features_array, np.memmap):
+        features = np.load(str(features_path), mmap_mode='r')
+    else:
+        features = grow_features(features_array, new_features)
+    paths = PathTable(live_dir) if isinstance(image_paths, PathTable) else image_paths + added
+    with index_mutex:
+        features_array, image_paths = features, paths
+    if isinstance(faiss_index, ShardedIndex):
+        # Shard workers apply the rows between their own searches
+        faiss_index.add_images(start, added, new_features)
+    elif len(features) - faiss_index.ntotal >= APPEND_FOLD_ROWS:
+        fold_pending_vectors()
+    bump_index_version(rows_appended=True)
+
+def fold_pending_vectors():
+    """Write the live index plus the rows search_live scans exactly to a new index file, then swap it in
+    
+    The file is replaced rather than rewritten, so views still mapping the old one stay valid.
+    With INDEX_MMAP the new file is mapped, and the copy built to write it is released.
+    """
+    global faiss_index, index_mmapped
+    import faiss
+    index_path = live_dir / "faiss_index.bin"
+    index = index_shards.read_index(index_path, mmap=False)
+    replayed = replay_pending_vectors(index, features_array)
+    tmp_path = index_path.with_suffix(".tmp")
+    faiss.write_index(index, str(tmp_path))
+    os.replace(tmp_path, index_path)
+    if INDEX_MMAP:
+        del index
+        index = index_shards.read_index(index_path, mmap=True)
+    with index_mutex:
+        faiss_index, index_mmapped = index, INDEX_MMAP
+    logger.info(f"Folded {replayed} appended vectors into the index")
+
+async def add_images_to_index(new_paths: List[str], dedup: str = "off"):
+    """Embed new dataset images and append them to the live index and on-disk artifacts
+    
+    Unless dedup is "off", images whose embedding is within DEDUP_THRESHOLD of an indexed image
+    (or of another image in new_paths) are left out and rejected or linked per dedup.
+    Returns the number of images added and the near duplicates as (filepath, original, similarity).
+    """
+    features_list, added = [], []
+    try:
+        async for features, kept, failed in extract_features_pipelined(new_paths, operation="upload"):
+            for img_path, error in failed:
+                await log_activity(f"Failed to process {img_path}: {error}", level="ERROR", category="indexing")
+            if kept:
+                features_list.append(features)
+                added.extend(kept)
+    except Exception as e:
+        await log_activity(f"Incremental indexing failed: {e}", level="ERROR", category="indexing")
+        return 0, []
+    
+    if not added:
+        return 0, []
+    new_features = np.concatenate(features_list).astype('float32')
+    
+    index_started = time.perf_counter()
+    loop = asyncio.get_event_loop()
+    duplicates = []
+    async with index_lock:
+        if SHARED_INDEX:
+            # Appends and publishes by other workers are serialized with this one
+            await loop.run_in_executor(None, index_file_lock.acquire)
+        try:
+            if SHARED_INDEX:
+                await sync_shared_index()
+            if faiss_index is None:
+                await load_index()
+            
+            if faiss_index is not None:
+                # A full build may already have picked some of these files up; filtered before the
+                # dedup check, which would otherwise match them against their own indexed copies
+                keep = await loop.run_in_executor(build_executor, unindexed_rows, added)
+                added, new_features = [added[i] for i in keep], new_features[keep]
+            if added and dedup != "off" and DEDUP_THRESHOLD <= 1.0:
+                # Checked under the lock so concurrent uploads of the same image cannot both get in
+                with stage_seconds.time(operation="upload", stage="dedup"):
+                    matches = await loop.run_in_executor(
+                        build_executor, find_near_duplicates, new_features, DEDUP_THRESHOLD
+                    )
+                duplicates = [
+                    (added[i], added[m[0]] if isinstance(m[0], int) else m[0], m[1])
+                    for i, m in enumerate(matches) if m is not None
+                ]
+                keep = [i for i, m in enumerate(matches) if m is None]
+                added, new_features = [added[i] for i in keep], new_features[keep]
+            
+            if added and faiss_index is None:
+                # Nothing indexed yet: these images start a new snapshot
+                await loop.run_in_executor(build_executor, start_live_index, new_features, added)
+            elif added:
+                await loop.run_in_executor(build_executor, append_to_live_index, new_features, added)
+        finally:
+            if SHARED_INDEX:
+                index_file_lock.release()
+    if duplicates:
+        await resolve_near_duplicates(duplicates, dedup)
+    if not added:
+        return 0, duplicates
+    stage_seconds.observe(time.perf_counter() - index_started, operation="upload", stage="index_add")
+    
+    await log_activity(f"Added {len(added)} images to index ({len(image_paths)} total)", category="indexing")
+    return len(added), duplicates
+
+def previous_index_vectors() -> dict:
+    """Map path -> stored vector for files not modified since features.npy was last written"""
+    migrate_legacy_snapshot()
+    directory = current_snapshot_dir()
+    features_path = directory / "features.npy"
+    if not features_path.exists() or not PathTable.exists(directory):
+        return {}
+    try:
+        manifest_path = directory / "manifest.json"
+        if manifest_path.exists():
+            with open(manifest_path, "r") as f:
+                if json.load(f).get("model_id") != MODEL_ID:
+                    return {}
+        written_at = features_path.stat().st_mtime
+        previous = np.load(str(features_path), mmap_mode='r')
+        previous_paths = PathTable(directory)
+    except Exception as e:
+        logger.warning(f"Could not read previous index vectors: {e}")
+        return {}
+    
+    seed = {}
+    for row, path in enumerate(previous_paths[:len(previous)]):
+        try:
+            if os.stat(path).st_mtime <= written_at:
+                seed[path] = previous[row]
+        except OSError:
+            continue
+    return seed
+
+async def build_index(batch_size: Optional[int] = None, index_type: Optional[str] = None,
+                      job: Optional[BuildJob] = None):
+    """Build FAISS index from all dataset images into a new snapshot and swap it in when complete
+    
+    Searches keep using the previous index until the swap. If job is given, its
+    stage, progress and ETA are kept up to date.
+    """
+    loop = asyncio.get_event_loop()
+    
+    async def fail(message: str, level: str = "ERROR"):
+        await log_activity(message, level=level, category="indexing")
+        if job is not None:
+            job.message = message
+            build_job_store.save(job)
+        return False
+    
+    def set_stage(stage: str):
+        if job is not None:
+            job.stage = stage
+            build_job_store.save(job)
     
     await log_activity("Starting index building process...", category="indexing")
+    set_stage("scanning")
+    # Uploads appended to the live snapshot after this point are carried over at swap time
+    start_dir, start_count = live_dir, len(image_paths)
     
     # Get all images from dataset directory
     image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
-    all_images = []
     
-    for root, dirs, files in os.walk(DATASET_DIR):
-        for file in files:
-            if Path(file).suffix.lower() in image_extensions:
-                all_images.append(Path(root) / file)
+    def scan():
+        found = []
+        for root, dirs, files in os.walk(DATASET_DIR):
+            for file in files:
+                if Path(file).suffix.lower() in image_extensions:
+                    found.append(str(Path(root) / file))
+        return found
+    
+    dataset_stats.begin_recount()
+    with stage_seconds.time(operation="build", stage="scan"):
+        all_images = await loop.run_in_executor(build_executor, scan)
+    # The scan doubles as a recount of the maintained dataset stats
+    scanned = {d.name: 0 for d in DATASET_DIR.iterdir() if d.is_dir()}
+    for image_path in all_images:
+        parent = Path(image_path).parent
+        if parent.parent == DATASET_DIR:
+            scanned[parent.name] = scanned.get(parent.name, 0) + 1
+    dataset_stats.finish_recount(scanned)
     
     if not all_images:
-        await log_activity("No images found in dataset", level="WARNING", category="indexing")
-        return False
+        return await fail("No images found in dataset", level="WARNING")
+    
+    batch_size = max(1, batch_size or FEATURE_BATCH_SIZE)
+    await log_activity(
+        f"Found {len(all_images)} images to index (batch size {batch_size})", category="indexing"
+    )
     
-    await log_activity(f"Found {len(all_images)} images to index", category="indexing")
+    # Vectors from the previous build are reused for files untouched since it was written
+    seed = await loop.run_in_executor(build_executor, previous_index_vectors)
     
-    # Extract features
+    # Extract features in batches
+    set_stage("extracting")
+    if job is not None:
+        job.total = len(all_images)
+        build_job_store.save(job)
     features_list = []
-    image_paths = []
+    paths = []
+    processed = 0
+    cache_stats = {}
+    start_time = time.time()
     
-    for i, img_path in enumerate(all_images):
-        try:
-            features = await asyncio.get_event_loop().run_in_executor(
-                executor, extract_features, str(img_path)
+    try:
+        async for features, kept, failed in extract_features_pipelined(
+            all_images, batch_size, seed, cache_stats, pool=build_executor
+        ):
+            for img_path, error in failed:
+                await log_activity(f"Failed to process {img_path}: {error}", level="ERROR", category="indexing")
+            if kept:
+                features_list.append(features)
+                paths.extend(kept)
+            processed += len(kept) + len(failed)
+            elapsed = time.time() - start_time
+            rate = processed / elapsed if elapsed > 0 else 0.0
+            if job is not None:
+                job.processed = processed
+                job.images_per_sec = rate
+                job.eta_seconds = (len(all_images) - processed) / rate if rate > 0 else None
+                build_job_store.save(job)
+            await log_activity(
+                f"Processed {processed}/{len(all_images)} images ({rate:.1f} images/sec)",
+                category="indexing"
             )
-            features_list.append(features)
-            image_paths.append(str(img_path))
-            
-            if (i + 1) % 10 == 0:
-                await log_activity(f"Processed {i + 1}/{len(all_images)} images", category="indexing")
-        except Exception as e:
-            await log_activity(f"Failed to process {img_path}: {e}", level="ERROR", category="indexing")
+    except Exception as e:
+        return await fail(f"Feature extraction failed: {e}")
     
     if not features_list:
-        await log_activity("No features extracted", level="ERROR", category="indexing")
-        return False
+        return await fail("No features extracted")
+    
+    elapsed = time.time() - start_time
+    await log_activity(
+        f"Extracted features for {len(paths)} images in {elapsed:.1f}s "
+        f"({len(paths) / max(elapsed, 1e-9):.1f} images/sec); embedding cache "
+        f"{cache_stats.get('cache_hits', 0)} hits, {cache_stats.get('cache_misses', 0)} misses",
+        category="indexing"
+    )
     
-    features_array = np.array(features_list).astype('float32')
+    features = np.concatenate(features_list).astype('float32')
     
     # Build FAISS index
-    faiss_index = await asyncio.get_event_loop().run_in_executor(
-        executor, build_faiss_index_sync, features_array.copy()
-    )
+    set_stage("indexing")
+    directory = new_snapshot_dir()
+    normalized = None
+    with stage_seconds.time(operation="build", stage="index_build"):
+        if INDEX_SHARDS > 1:
+            index = await loop.run_in_executor(
+                build_executor, build_sharded_index_sync, directory, features, paths, index_type
+            )
+        else:
+            normalized = features.copy()
+            index = await loop.run_in_executor(build_executor, build_faiss_index_sync, normalized, index_type)
+    directory.mkdir(parents=True, exist_ok=True)
+    if isinstance(index, ShardedIndex):
+        await log_activity(
+            f"Built {len(index.shards)} {SHARD_BY} shards in parallel: "
+            + ", ".join(f"{shard['vectors']} ({shard['index_type']})" for shard in index.shards),
+            category="indexing"
+        )
+    
+    # Approximate or compressed indexes get a recall-vs-latency comparison against exact float32 search
+    if index_type_name(index) != "flat" or index_storage(index) != "float32":
+        set_stage("evaluating")
+        with stage_seconds.time(operation="build", stage="evaluate"):
+            if isinstance(index, ShardedIndex):
+                # The shard files are already written; searching them needs the workers loaded
+                await loop.run_in_executor(build_executor, index.open)
+            report = await loop.run_in_executor(build_executor, index_recall_report, index, features)
+        with open(directory / "index_report.json", "w") as f:
+            json.dump(report, f, indent=2)
+        report_keys = ('recall', 'latency_ms', 'reranked_recall', 'reranked_latency_ms')
+        summary = ", ".join(
+            f"{'/'.join(f'{k}={v}' for k, v in point.items() if k not in report_keys) or 'exhaustive'}: "
+            f"recall {point['recall']:.3f} @ {point['latency_ms']:.2f}ms"
+            + (f", re-ranked {point['reranked_recall']:.3f} @ {point['reranked_latency_ms']:.2f}ms"
+               if 'reranked_recall' in point else "")
+            for point in report["results"]
+        )
+        await log_activity(
+            f"{report['index_type']} ({report['vector_storage']}) index recall@{report['k']} vs flat "
+            f"({report['flat_latency_ms']:.2f}ms/query): {summary}",
+            category="indexing"
+        )
+    
+    # Save index and paths into the new snapshot
+    set_stage("saving")
+    del normalized
+    with stage_seconds.time(operation="build", stage="save"):
+        await loop.run_in_executor(build_executor, save_index_artifacts, directory, index, features, paths)
+    if isinstance(index, ShardedIndex):
+        # Shard workers load the new snapshot next to the old one, so the swap itself is instant
+        await loop.run_in_executor(build_executor, index.open)
+    
+    set_stage("publishing")
+    publish_started = time.perf_counter()
+    async with index_lock:
+        if SHARED_INDEX:
+            await loop.run_in_executor(None, index_file_lock.acquire)
+        try:
+            if SHARED_INDEX:
+                # Includes images other workers appended while this build ran in the carry-over
+                await sync_shared_index()
+            # Images indexed incrementally while this build ran went to the old snapshot
+            if faiss_index is not None:
+                carried = image_paths[start_count:] if live_dir == start_dir else list(image_paths)
+                known = set(paths)
+                carried = [p for p in carried if p not in known and os.path.exists(p)]
+                if carried:
+                    extra_list, extra_paths = [], []
+                    async for extra, kept, _ in extract_features_pipelined(carried, batch_size, pool=build_executor):
+                        if kept:
+                            extra_list.append(extra)
+                            extra_paths.extend(kept)
+                    if extra_paths:
+                        extra = np.concatenate(extra_list).astype('float32')
+                        await loop.run_in_executor(
+                            build_executor, carry_over_rows, directory, index, len(paths), extra, extra_paths
+                        )
+                        features = np.concatenate([features, extra])
+                        paths.extend(extra_paths)
+                        logger.info(f"Carried {len(extra_paths)} concurrently uploaded images into the new index")
+            
+            publish_snapshot(directory, snapshot_manifest(directory, index, len(paths)))
+            swap_live_index(directory, index, features, paths)
+        finally:
+            if SHARED_INDEX:
+                index_file_lock.release()
+    stage_seconds.observe(time.perf_counter() - publish_started, operation="build", stage="publish")
     
-    # Save index and paths
+    if job is not None:
+        job.snapshot = directory.name
+        build_job_store.save(job)
+    await log_activity(
+        f"Index built successfully with {len(paths)} images ({index_type_name(index)}, snapshot {directory.name})",
+        category="indexing"
+    )
+    return True
+
+def carry_over_rows(directory: Path, index, start: int, features: np.ndarray, paths: List[str]):
+    """Append rows uploaded during a build to its unpublished snapshot"""
     import faiss
-    faiss.write_index(faiss_index, str(DATA_DIR / "faiss_index.bin"))
-    np.save(str(DATA_DIR / "features.npy"), features_array)
-    with open(DATA_DIR / "image_paths.json", "w") as f:
-        json.dump(image_paths, f)
+    append_features_file(directory / "features.npy", features)
+    PathTable.append(directory, paths)
+    if isinstance(index, ShardedIndex):
+        # Replayed from features.npy whenever the snapshot is reopened; shared shards are scanned exactly instead
+        if not SHARED_INDEX:
+            index.add_images(start, paths, features)
+    else:
+        normalized = features.copy()
+        faiss.normalize_L2(normalized)
+        index.add(normalized)
+        faiss.write_index(index, str(directory / "faiss_index.bin"))
+
+class BuildJobStore:
+    """Recent build jobs persisted as JSON, so any worker process can report on a build
+    
+    The process running a build keeps its job in memory and writes it on every update.
+    A queued or running job whose builder is gone (an earlier run of the server, or no
+    worker holds the build lock any more) is reported as failed.
+    """
+    
+    def __init__(self, directory: Path, keep: int = 20):
+        self.directory = directory
+        self.keep = keep
+        # Jobs started by this process, updated in place by build_index
+        self.running = {}
+    
+    def _path(self, job_id: str) -> Path:
+        return self.directory / f"{job_id}.json"
+    
+    def save(self, job: BuildJob):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        tmp = self.directory / f".{job.id}.{os.getpid()}.tmp"
+        tmp.write_text(job.model_dump_json())
+        os.replace(tmp, self._path(job.id))
     
-    await log_activity(f"Index built successfully with {len(image_paths)} images", category="indexing")
+    def add(self, job: BuildJob):
+        self.running[job.id] = job
+        self.save(job)
+        files = sorted(self.directory.glob("*.json"), key=lambda f: f.stat().st_mtime)
+        for old in files[:max(0, len(files) - self.keep)]:
+            old.unlink(missing_ok=True)
+    
+    def finish(self, job: BuildJob):
+        self.save(job)
+        self.running.pop(job.id, None)
+    
+    def _read(self, path: Path) -> Optional[BuildJob]:
+        try:
+            job = BuildJob.model_validate_json(path.read_text())
+        except (OSError, ValueError):
+            return None
+        if job.status in ("queued", "running") and job.id not in self.running and not build_lock_held():
+            job.status, job.stage = "failed", "done"
+            job.message = job.message or "Interrupted: the process running this build stopped"
+        return job
+    
+    def get(self, job_id: str) -> Optional[BuildJob]:
+        if job_id in self.running:
+            return self.running[job_id]
+        try:
+            uuid.UUID(job_id)
+        except ValueError:
+            return None
+        return self._read(self._path(job_id))
+    
+    def list(self) -> List[BuildJob]:
+        """Jobs newest first"""
+        if not self.directory.exists():
+            return []
+        jobs = (self.running.get(f.stem) or self._read(f) for f in self.directory.glob("*.json"))
+        return sorted((j for j in jobs if j is not None), key=lambda j: j.created_at, reverse=True)
+    
+    def active(self) -> Optional[BuildJob]:
+        job = next((j for j in self.running.values() if j.status in ("queued", "running")), None)
+        if job is None and SHARED_INDEX:
+            job = next((j for j in self.list() if j.status in ("queued", "running")), None)
+        return job
+
+def build_lock_held() -> bool:
+    """Whether a worker process is building; without SHARED_INDEX only this process builds"""
+    if not SHARED_INDEX:
+        return False
+    probe = FileLock(build_file_lock.path)
+    if probe.acquire(blocking=False):
+        probe.release()
+        return False
     return True
 
+build_job_store = BuildJobStore(BUILD_JOBS_DIR)
+build_tasks = set()
+
+async def run_build_job(job: BuildJob, batch_size: Optional[int], index_type: Optional[str]):
+    """Run build_index in the background, recording the outcome on the job"""
+    job.status = "running"
+    job.started_at = datetime.now(timezone.utc)
+    build_job_store.save(job)
+    try:
+        with operation_seconds.time(operation="build"):
+            success = await build_index(batch_size=batch_size, index_type=index_type, job=job)
+        job.status = "succeeded" if success else "failed"
+    except Exception as e:
+        logger.exception("Index build failed")
+        job.status = "failed"
+        job.message = str(e)
+    job.stage = "done"
+    job.eta_seconds = 0.0
+    job.finished_at = datetime.now(timezone.utc)
+    build_job_store.finish(job)
+    if SHARED_INDEX:
+        build_file_lock.release()
+
+def active_build_job() -> Optional[BuildJob]:
+    """The build in progress in this process, or with SHARED_INDEX in any worker"""
+    return build_job_store.active()
+
+def migrate_legacy_snapshot():
+    """Copy an index that older builds wrote straight into DATA_DIR into a published snapshot
+    
+    The legacy files are left untouched; appends, checkpoints and rebuilds only write the
+    snapshot. Older builds did not record their model, so a rebuild re-extracts their images.
+    """
+    legacy_paths = DATA_DIR / "image_paths.json"
+    files = ["faiss_index.bin", "features.npy"]
+    if (CURRENT_SNAPSHOT_FILE.exists() or not all((DATA_DIR / f).exists() for f in files)
+            or not (legacy_paths.exists() or PathTable.exists(DATA_DIR))):
+        return
+    directory = new_snapshot_dir()
+    directory.mkdir(parents=True)
+    for f in files:
+        shutil.copyfile(DATA_DIR / f, directory / f)
+    if PathTable.exists(DATA_DIR):
+        paths = list(PathTable(DATA_DIR))
+    else:
+        with open(legacy_paths, "r") as f:
+            paths = json.load(f)
+    PathTable.write(directory, paths)
+    manifest = snapshot_manifest(directory, index_shards.read_index(directory / "faiss_index.bin", mmap=True), len(paths))
+    manifest["model_id"] = None
+    publish_snapshot(directory, manifest)
+    logger.info(f"Copied the index in {DATA_DIR} into snapshot {directory.name}")
+
 async def load_index():
     """Load existing FAISS index"""
-    global faiss_index, image_paths, features_array
+    global faiss_index, image_paths, features_array, index_mmapped
+    
+    migrate_legacy_snapshot()
+    directory = current_snapshot_dir()
+    index_path = directory / "faiss_index.bin"
+    features_path = directory / "features.npy"
+    manifest = read_snapshot_manifest(directory)
     
-    index_path = DATA_DIR / "faiss_index.bin"
-    features_path = DATA_DIR / "features.npy"
-    paths_file = DATA_DIR / "image_paths.json"
-    
-    if index_path.exists() and features_path.exists() and paths_file.exists():
-        import faiss
-        faiss_index = faiss.read_index(str(index_path))
-        features_array = np.load(str(features_path))
-        with open(paths_file, "r") as f:
-            image_paths = json.load(f)
-        logger.info(f"Loaded existing index with {len(image_paths)} images")
+    if (index_path.exists() or manifest.get("shards")) and features_path.exists() and PathTable.exists(directory):
+        open_index_artifacts(directory)
+        
+        count = min(len(image_paths), len(features_array))
+        if isinstance(faiss_index, ShardedIndex):
+            if count != len(image_paths) or count != len(features_array):
+                # Shard files are never appended to; only features and paths need trimming
+                logger.warning(f"Index artifacts were out of sync, truncating to {count} images")
+                features, paths = np.array(features_array[:count]), list(image_paths[:count])
+                np.save(str(features_path), features)
+                PathTable.write(directory, paths)
+                open_index_artifacts(directory)
+            if SHARED_INDEX:
+                logger.info(f"{len(image_paths) - faiss_index.ntotal} appended vectors are searched exactly "
+                            f"until the next checkpoint")
+            else:
+                replayed = faiss_index.replay(features_array, image_paths)
+                if replayed:
+                    logger.info(f"Replayed {replayed} appended vectors into the index shards")
+            if len(faiss_index.shards) != INDEX_SHARDS or faiss_index.by != SHARD_BY:
+                logger.warning(
+                    f"Index has {len(faiss_index.shards)} {faiss_index.by} shards but INDEX_SHARDS={INDEX_SHARDS}, "
+                    f"SHARD_BY={SHARD_BY}; rebuild it to reshard"
+                )
+        elif count != len(image_paths) or count != len(features_array):
+            # An interrupted append left the files out of step; rewrite them consistently
+            logger.warning(f"Index artifacts were out of sync, truncating to {count} images")
+            index = index_shards.read_index(index_path, mmap=False)
+            features = np.array(features_array[:count])
+            replay_pending_vectors(index, features)
+            with index_mutex:
+                faiss_index, features_array, index_mmapped = index, features, False
+                image_paths = image_paths[:count]
+            save_index_artifacts(directory, faiss_index, features_array, image_paths)
+            if MMAP_FEATURES:
+                open_index_artifacts(directory)
+        elif SHARED_INDEX and faiss_index.ntotal < count:
+            # Other workers map the same index file, so it is never rewritten in place; search_live
+            # scans the appended rows until a checkpoint publishes a new snapshot
+            logger.info(f"{count - faiss_index.ntotal} appended vectors are searched exactly until the next checkpoint")
+        elif faiss_index.ntotal < count:
+            # Rows appended by incremental indexing are not in the index file yet; replay them
+            ensure_writable_index()
+            replayed = replay_pending_vectors(faiss_index, features_array)
+            logger.info(f"Replayed {replayed} appended vectors into the index")
+            if INDEX_MMAP:
+                # Checkpoint so every process can map the complete index. Write a new file and swap it
+                # in, so views still mapping the old one never see a half-written index
+                import faiss
+                tmp_path = index_path.with_suffix(".tmp")
+                faiss.write_index(faiss_index, str(tmp_path))
+                os.replace(tmp_path, index_path)
+                open_index_artifacts(directory)
+        
+        if manifest:
+            built_with = manifest.get("model_id")
+            if built_with != MODEL_ID:
+                logger.warning(
+                    f"Index was built with {built_with} but queries use {MODEL_ID}; rebuild it for consistent results"
+                )
+        
+        bump_index_version()
+        logger.info(f"Loaded existing index with {len(image_paths)} images (mmap={index_mmapped})")
         return True
     return False
 
+async def sync_shared_index():
+    """Follow snapshots published and rows appended by other workers; call while holding index_lock"""
+    directory = current_snapshot_dir()
+    if directory != live_dir:
+        if not await load_index() and faiss_index is not None:
+            # Another worker cleared the dataset
+            clear_live_index()
+        return
+    if (live_dir / PathTable.OFFSETS_FILE).stat().st_size // 8 != len(image_paths):
+        refresh_live_rows()
+
+async def watch_shared_index():
+    """Poll for index changes made by other worker processes"""
+    while True:
+        await asyncio.sleep(SHARED_POLL_INTERVAL)
+        if not startup_state["ready"]:
+            # prepare_service is still loading the index
+            continue
+        try:
+            async with index_lock:
+                await sync_shared_index()
+        except Exception as e:
+            logger.warning(f"Could not follow the shared index: {e}")
+
+def embed_queries(query_paths: List, operation: str = "search"):
+    """Embed query images (paths or bytes) in one forward pass, returning (vectors, errors) aligned with the input
+    
+    Rows of vectors for images that failed are zero and their error is set.
+    """
+    memo = query_embeddings if operation == "search" else None
+    batch, decoded, failed, digests, cached = prepare_batch(query_paths, operation=operation, memo=memo)
+    if batch is not None:
+        computed = {digests[p]: vec for p, vec in zip(decoded, predict_batch(batch, operation))}
+        if memo is None:
+            embedding_cache.put_many(computed)
+        else:
+            # Search queries go to the bounded in-memory LRU; the on-disk cache would grow without bound
+            for digest, vector in computed.items():
+                memo.put(digest, vector)
+        cached = {**cached, **computed}
+    
+    failed_errors = dict(failed)
+    errors = [failed_errors.get(p) for p in query_paths]
+    vectors = None
+    for i, query_path in enumerate(query_paths):
+        if errors[i] is None:
+            vector = cached[digests[query_path]]
+            if vectors is None:
+                vectors = np.zeros((len(query_paths), len(vector)), dtype='float32')
+            vectors[i] = vector
+    return vectors, errors
+
+def embed_and_search(sources: List, ks: List[int], options: List[SearchOptions]) -> list:
+    """Embed queries in one forward pass and search them against the live index
+    
+    Returns one outcome per query: (scores, ids, paths) or an exception. Queries
+    sharing the same options are answered by a single multi-query index search.
+    """
+    import faiss
+    vectors, errors = embed_queries(sources)
+    outcomes = [ValueError(error) if error else None for error in errors]
+    
+    groups = {}
+    for i, error in enumerate(errors):
+        if error is None:
+            groups.setdefault(options[i], []).append(i)
+    
+    for group_options, rows in groups.items():
+        queries = vectors[rows]
+        faiss.normalize_L2(queries)
+        with index_mutex:
+            index, paths = faiss_index, image_paths
+            k = min(max(ks[i] for i in rows), len(paths))
+            with stage_seconds.time(operation="search", stage="index_search"):
+                distances, indices = search_live(index, features_array, queries, k, group_options)
+        for row, i in enumerate(rows):
+            k_i = min(ks[i], k)
+            outcomes[i] = (distances[row, :k_i], indices[row, :k_i], paths)
+    return outcomes
+
+def search_by_position(position: int, k: int, options: SearchOptions):
+    """Search with the stored vector of an indexed image, excluding the image itself"""
+    import faiss
+    with index_mutex:
+        index, paths, features = faiss_index, image_paths, features_array
+        if index is None or not 0 <= position < len(paths):
+            raise KeyError(position)
+        query = np.array(features[position], dtype='float32').reshape(1, -1)
+        faiss.normalize_L2(query)
+        with stage_seconds.time(operation="search", stage="index_search"):
+            distances, indices = search_live(index, features, query, min(k + 1, len(paths)), options)
+    
+    keep = indices[0] != position
+    return distances[0][keep][:k], indices[0][keep][:k], paths
+
+def build_search_results(distances, indices, paths, threshold: float) -> List[SearchResult]:
+    """Turn one query's scores and ids into SearchResult entries above the threshold"""
+    results = []
+    for idx, score in zip(indices, distances):
+        if idx < 0 or score < threshold:
+            continue
+        
+        img_path = paths[idx]
+        category = Path(img_path).parent.name
+        
+        results.append(SearchResult(
+            image_id=str(idx),
+            filename=Path(img_path).name,
+            filepath=img_path,
+            category=category,
+            similarity_score=float(score)
+        ))
+    return results
+
+class SearchBatcher:
+    """Coalesces concurrent search queries into one forward pass and one index search"""
+    
+    def __init__(self, window_ms: float, max_batch: int):
+        self.window = window_ms / 1000.0
+        self.max_batch = max(1, max_batch)
+        self._queue = None
+        self._task = None
+    
+    async def search(self, query_path: str, k: int, options: SearchOptions = SearchOptions()):
+        """Return (scores, ids, paths) for one query; paths is the table the ids refer to"""
+        if self._task is None or self._task.done():
+            self._queue = asyncio.Queue()
+            self._task = asyncio.get_event_loop().create_task(self._run())
+        future = asyncio.get_event_loop().create_future()
+        await self._queue.put((query_path, k, options, future, time.perf_counter()))
+        return await future
+    
+    def pending(self) -> int:
+        return self._queue.qsize() if self._queue is not None else 0
+    
+    async def _run(self):
+        loop = asyncio.get_event_loop()
+        while True:
+            items = [await self._queue.get()]
+            deadline = loop.time() + self.window
+            while len(items) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    items.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            
+            try:
+                outcomes = await loop.run_in_executor(executor, self._process, items)
+            except Exception as e:
+                outcomes = [e] * len(items)
+            for (_, _, _, future, _), outcome in zip(items, outcomes):
+                if future.done():
+                    continue
+                if isinstance(outcome, Exception):
+                    future.set_exception(outcome)
+                else:
+                    future.set_result(outcome)
+    
+    def _process(self, items):
+        # Time from arriving at the batcher until the batch reaches an executor thread
+        started = time.perf_counter()
+        for *_, enqueued in items:
+            stage_seconds.observe(started - enqueued, operation="search", stage="queue_wait")
+        return embed_and_search(
+            [query_path for query_path, _, _, _, _ in items],
+            [k for _, k, _, _, _ in items],
+            [options for _, _, options, _, _ in items]
+        )
+
+search_batcher = SearchBatcher(SEARCH_BATCH_WINDOW_MS, SEARCH_MAX_BATCH)
+
+def find_near_duplicates(vectors: np.ndarray, threshold: float) -> list:
+    """Best match at or above threshold for each feature row: (filepath or batch position, score) or None
+    
+    Rows are compared against the live index and against earlier unmatched rows in the same batch.
+    """
+    import faiss
+    vectors = vectors.copy()
+    faiss.normalize_L2(vectors)
+    matches = [None] * len(vectors)
+    with index_mutex:
+        if faiss_index is not None and faiss_index.ntotal > 0:
+            with stage_seconds.time(operation="upload", stage="index_search"):
+                scores, ids = search_live(faiss_index, features_array, vectors, 1, SearchOptions())
+            for i in range(len(vectors)):
+                if ids[i, 0] >= 0 and scores[i, 0] >= threshold:
+                    matches[i] = (image_paths[int(ids[i, 0])], float(scores[i, 0]))
+    
+    kept = []
+    for i in range(len(vectors)):
+        if matches[i] is None and kept:
+            scores = vectors[kept] @ vectors[i]
+            best = int(np.argmax(scores))
+            if scores[best] >= threshold:
+                matches[i] = (kept[best], float(scores[best]))
+        if matches[i] is None:
+            kept.append(i)
+    return matches
+
+async def find_duplicates(digests: List[str], hashes: List[Optional[str]]) -> list:
+    """Classify uploads as exact (same bytes) or near (perceptual hash within DEDUP_HASH_DISTANCE bits) duplicates
+    
+    Returns per upload None or (kind, existing filepath or earlier batch position, similarity).
+    Embedding neighbours are checked later, when the uploads are indexed.
+    """
+    matches = [None] * len(digests)
+    known = await db.images.find(
+        {"content_hash": {"$in": list(set(digests))}, "duplicate_of": None}, {"_id": 0, "content_hash": 1, "filepath": 1}
+    ).to_list(None)
+    stored = {doc["content_hash"]: doc["filepath"] for doc in known}
+    first_seen = {}
+    for i, digest in enumerate(digests):
+        if digest in stored:
+            matches[i] = ("exact", stored[digest], 1.0)
+        elif digest in first_seen:
+            matches[i] = ("exact", first_seen[digest], 1.0)
+        else:
+            first_seen[digest] = i
+    
+    pending = [i for i in range(len(digests)) if matches[i] is None and hashes[i] is not None]
+    if not pending:
+        return matches
+    bands = {band for i in pending for band in hash_bands(hashes[i])}
+    candidates = await db.images.find(
+        {"hash_bands": {"$in": list(bands)}, "duplicate_of": None}, {"_id": 0, "perceptual_hash": 1, "filepath": 1}
+    ).to_list(None)
+    known_hashes = [(doc["filepath"], doc["perceptual_hash"]) for doc in candidates]
+    kept = []
+    for i in pending:
+        # Closest stored image or earlier unmatched upload in this request
+        distances = [(hash_distance(hashes[i], other), target)
+                     for target, other in known_hashes + [(j, hashes[j]) for j in kept]]
+        distance, target = min(distances, key=lambda d: d[0], default=(None, None))
+        if distance is not None and distance <= DEDUP_HASH_DISTANCE:
+            matches[i] = ("near", target, 1.0 - distance / 64)
+        else:
+            kept.append(i)
+    return matches
+
+async def resolve_near_duplicates(duplicates: list, dedup: str):
+    """Reject or link uploads that indexing found to be near duplicates of (filepath, original, similarity)"""
+    if dedup == "reject":
+        await db.images.delete_many({"filepath": {"$in": [filepath for filepath, _, _ in duplicates]}})
+    else:
+        for filepath, original, _ in duplicates:
+            await db.images.update_one(
+                {"filepath": filepath}, {"$set": {"filepath": original, "duplicate_of": original}}
+            )
+    for filepath, _, _ in duplicates:
+        Path(filepath).unlink(missing_ok=True)
+        dataset_stats.add(Path(filepath).parent.name, -1)
+    await log_activity(
+        f"{'Linked' if dedup == 'link' else 'Rejected'} {len(duplicates)} near-duplicate uploads while indexing them",
+        category="upload"
+    )
+
+async def save_upload(file: UploadFile, destination: Path, max_bytes: int = MAX_UPLOAD_BYTES,
+                      operation: str = "upload", hash_contents: bool = True) -> Optional[str]:
+    """Stream an upload to disk in chunks without blocking the event loop, returning its SHA-256
+    
+    Raises 413, after removing the partial file, once the upload exceeds max_bytes.
+    Reading, hashing and writing are timed per file as stages of operation. With
+    hash_contents=False (the caller already hashed it) nothing is hashed and None is returned.
+    """
+    loop = asyncio.get_event_loop()
+    digest = hashlib.sha256()
+    size = 0
+    read_s = hash_s = write_s = 0.0
+    try:
+        async with aiofiles.open(destination, "wb") as out:
+            while True:
+                t0 = time.perf_counter()
+                chunk = await file.read(UPLOAD_CHUNK_SIZE)
+                t1 = time.perf_counter()
+                read_s += t1 - t0
+                if not chunk:
+                    break
+                size += len(chunk)
+                if size > max_bytes:
+                    raise HTTPException(
+                        status_code=413, detail=f"{file.filename} exceeds the {max_bytes} byte upload limit"
+                    )
+                if hash_contents:
+                    # hashlib releases the GIL on large buffers, so hashing overlaps with other requests
+                    await loop.run_in_executor(None, digest.update, chunk)
+                t2 = time.perf_counter()
+                await out.write(chunk)
+                hash_s += t2 - t1
+                write_s += time.perf_counter() - t2
+    except BaseException:
+        destination.unlink(missing_ok=True)
+        raise
+    stage_seconds.observe(read_s, operation=operation, stage="upload_read")
+    if hash_contents:
+        stage_seconds.observe(hash_s, operation=operation, stage="hash")
+    stage_seconds.observe(write_s, operation=operation, stage="disk_write")
+    return digest.hexdigest() if hash_contents else None
+
+async def hash_upload(file: UploadFile, max_bytes: int = MAX_UPLOAD_BYTES, operation: str = "search") -> str:
+    """SHA-256 of an upload already spooled by the form parser, rewinding it for a later save_upload
+    
+    Raises 413 once the upload exceeds max_bytes. Queries are small, so they are hashed
+    on the event loop rather than through executor hops.
+    """
+    started = time.perf_counter()
+    digest = hashlib.sha256()
+    size = 0
+    while True:
+        chunk = await file.read(UPLOAD_CHUNK_SIZE)
+        if not chunk:
+            break
+        size += len(chunk)
+        if size > max_bytes:
+            raise HTTPException(status_code=413, detail=f"{file.filename} exceeds the {max_bytes} byte upload limit")
+        digest.update(chunk)
+    await file.seek(0)
+    stage_seconds.observe(time.perf_counter() - started, operation=operation, stage="hash")
+    return digest.hexdigest()
+
 # Routes
 @api_router.get("/")
 async def root():
     return {"message": "Animal Image Similarity Search API"}
 
+@api_router.get("/ready")
+async def readiness():
+    """Readiness probe: 503 until the model is loaded, the index is open and warm-up has run"""
+    return JSONResponse(status_code=200 if startup_state["ready"] else 503, content=startup_state)
+
+@api_router.get("/metrics")
+async def get_metrics():
+    """Per-stage latency histograms, queue depths, index size and memory in the Prometheus text format"""
+    return Response(content=metrics_registry.render(), media_type=metrics.CONTENT_TYPE)
+
 @api_router.post("/upload-dataset")
 async def upload_dataset_images(
+    background_tasks: BackgroundTasks,
     files: List[UploadFile] = File(...),
-    category: str = Form(default="unknown")
+    category: str = Form(default="unknown"),
+    index_mode: str = Form(default=UPLOAD_INDEX_MODE),
+    dedup: str = Form(default=DEDUP_MODE)
 ):
-    """Upload images to the dataset"""
-    uploaded = []
+    """Upload images to the dataset, rejecting or linking exact and near duplicates"""
+    if index_mode not in UPLOAD_INDEX_MODES:
+        raise HTTPException(status_code=400, detail=f"index_mode must be one of {sorted(UPLOAD_INDEX_MODES)}")
+    if dedup not in DEDUP_MODES:
+        raise HTTPException(status_code=400, detail=f"dedup must be one of {sorted(DEDUP_MODES)}")
+    
+    started = time.perf_counter()
+    uploaded, deduplicated, docs = [], [], []
     category_dir = DATASET_DIR / category
     category_dir.mkdir(parents=True, exist_ok=True)
     
-    for file in files:
-        if not file.content_type.startswith('image/'):
-            continue
-        
-        file_id = str(uuid.uuid4())
-        ext = Path(file.filename).suffix or '.jpg'
-        new_filename = f"{file_id}{ext}"
-        filepath = category_dir / new_filename
+    # Each file streams to its final location; nothing holds a whole upload in memory
+    saved = []
+    try:
+        for file in files:
+            if not file.content_type.startswith('image/'):
+                continue
+            file_id = str(uuid.uuid4())
+            ext = Path(file.filename).suffix or '.jpg'
+            filepath = category_dir / f"{file_id}{ext}"
+            saved.append((file_id, file, str(filepath), await save_upload(file, filepath)))
+    except HTTPException:
+        for _, _, filepath, _ in saved:
+            Path(filepath).unlink(missing_ok=True)
+        raise
+    
+    digests = [digest for _, _, _, digest in saved]
+    # Hashes are stored even with dedup off, so later uploads can be matched against these
+    with stage_seconds.time(operation="upload", stage="perceptual_hash"):
+        hashes = await asyncio.get_event_loop().run_in_executor(
+            executor, perceptual_hashes, [filepath for _, _, filepath, _ in saved]
+        )
+    if dedup != "off" and saved:
+        with stage_seconds.time(operation="upload", stage="dedup"):
+            matches = await find_duplicates(digests, hashes)
+    else:
+        matches = [None] * len(saved)
+    
+    # Position in this request -> the file it ended up as, for matches against earlier uploads
+    resolved_paths = {}
+    for i, ((file_id, file, filepath, digest), perceptual_hash, match) in enumerate(zip(saved, hashes, matches)):
+        duplicate_of = None
+        if match is not None:
+            kind, target, score = match
+            duplicate_of = resolved_paths.get(target) if isinstance(target, int) else target
         
-        with open(filepath, "wb") as buffer:
-            shutil.copyfileobj(file.file, buffer)
+        if duplicate_of is not None:
+            deduplicated.append({
+                "filename": file.filename,
+                "duplicate_of": duplicate_of,
+                "match": kind,
+                "similarity": score,
+                "action": "linked" if dedup == "link" else "rejected",
+            })
+            resolved_paths[i] = duplicate_of
+            Path(filepath).unlink(missing_ok=True)
+            if dedup == "reject":
+                continue
+            filepath = duplicate_of
+        else:
+            resolved_paths[i] = filepath
         
         # Save to database
         image_info = ImageInfo(
             id=file_id,
             filename=file.filename,
-            filepath=str(filepath),
-            category=category
+            filepath=filepath,
+            category=category,
+            content_hash=digest,
+            perceptual_hash=perceptual_hash,
+            duplicate_of=duplicate_of
         )
         doc = image_info.model_dump()
         doc['uploaded_at'] = doc['uploaded_at'].isoformat()
-        await db.images.insert_one(doc)
-        uploaded.append(image_info.model_dump())
+        if perceptual_hash is not None:
+            doc['hash_bands'] = hash_bands(perceptual_hash)
+        docs.append(doc)
+        if duplicate_of is None:
+            uploaded.append(image_info.model_dump())
     
+    if docs:
+        with stage_seconds.time(operation="upload", stage="db_write"):
+            await db.images.insert_many(docs)
+    dataset_stats.add(category, len(uploaded))
     await log_activity(f"Uploaded {len(uploaded)} images to category '{category}'", category="upload")
-    return {"uploaded": len(uploaded), "images": uploaded}
+    if deduplicated:
+        await log_activity(
+            f"{'Linked' if dedup == 'link' else 'Rejected'} {len(deduplicated)} duplicate uploads in category '{category}'",
+            category="upload"
+        )
+    
+    # Make the new images searchable without a full rebuild; indexing also drops embedding near duplicates
+    new_paths = [img["filepath"] for img in uploaded]
+    indexed = 0
+    if new_paths and index_mode == "inline":
+        indexed, near = await add_images_to_index(new_paths, dedup)
+        near_paths = {filepath: (original, score) for filepath, original, score in near}
+        for img in [img for img in uploaded if img["filepath"] in near_paths]:
+            original, score = near_paths[img["filepath"]]
+            deduplicated.append({
+                "filename": img["filename"],
+                "duplicate_of": original,
+                "match": "near",
+                "similarity": score,
+                "action": "linked" if dedup == "link" else "rejected",
+            })
+            uploaded.remove(img)
+    elif new_paths and index_mode == "deferred":
+        background_tasks.add_task(add_images_to_index, new_paths, dedup)
+    
+    operation_seconds.observe(time.perf_counter() - started, operation="upload")
+    return {
+        "uploaded": len(uploaded),
+        "images": uploaded,
+        "deduplicated": deduplicated,
+        "index_mode": index_mode,
+        "indexed": indexed,
+    }
 
 @api_router.post("/search")
 async def search_similar_images(
     file: UploadFile = File(...),
-    top_k: int = Form(default=10),
-    threshold: float = Form(default=0.0)
+    top_k: int = Form(default=10, ge=1),
+    threshold: float = Form(default=0.0),
+    nprobe: Optional[int] = Form(default=None),
+    ef_search: Optional[int] = Form(default=None),
+    category: Optional[str] = Form(default=None)
 ):
-    """Search for similar images"""
+    """Search for similar images, optionally only within one or more comma-separated categories"""
     global faiss_index, image_paths, features_array
     
     if faiss_index is None:
@@ -268,96 +2807,317 @@ async def search_similar_images(
         if not loaded:
             raise HTTPException(status_code=400, detail="Index not built. Please build the index first.")
     
+    start_time = time.time()
+    started = time.perf_counter()
+    
+    # Repeated queries against the same index version are answered from memory, before the
+    # query is written to disk or sent to the executor
+    digest = await hash_upload(file)
+    options = SearchOptions(nprobe=nprobe, ef_search=ef_search, categories=parse_categories(category))
+    cache_key = (digest, top_k, threshold, options, index_version)
+    cached = result_cache.get(cache_key)
+    if cached is not None:
+        operation_seconds.observe(time.perf_counter() - started, operation="search")
+        return cached.model_copy(update={"search_time_ms": (time.time() - start_time) * 1000})
+    
     # Save query image
     query_id = str(uuid.uuid4())
     ext = Path(file.filename).suffix or '.jpg'
     query_path = QUERIES_DIR / f"{query_id}{ext}"
-    
-    with open(query_path, "wb") as buffer:
-        shutil.copyfileobj(file.file, buffer)
+    await save_upload(file, query_path, operation="search", hash_contents=False)
     
     await log_activity(f"Processing search query: {file.filename}", category="search")
     
-    import time
-    start_time = time.time()
-    
-    # Extract features from query image
+    # Extract features and search, batched with concurrent queries
     try:
-        query_features = await asyncio.get_event_loop().run_in_executor(
-            executor, extract_features, str(query_path)
-        )
+        distances, indices, paths = await search_batcher.search(str(query_path), top_k, options)
     except Exception as e:
         await log_activity(f"Failed to extract features: {e}", level="ERROR", category="search")
         raise HTTPException(status_code=400, detail=f"Failed to process image: {e}")
     
-    # Normalize query features
-    import faiss
-    query_features = query_features.reshape(1, -1).astype('float32')
-    faiss.normalize_L2(query_features)
-    
-    # Search
-    k = min(top_k, len(image_paths))
-    distances, indices = faiss_index.search(query_features, k)
-    
     search_time = (time.time() - start_time) * 1000
     
     # Build results
-    results = []
-    for i, (idx, score) in enumerate(zip(indices[0], distances[0])):
-        if idx < 0 or score < threshold:
-            continue
-        
-        img_path = image_paths[idx]
-        category = Path(img_path).parent.name
-        
-        results.append(SearchResult(
-            image_id=str(idx),
-            filename=Path(img_path).name,
-            filepath=img_path,
-            category=category,
-            similarity_score=float(score)
-        ))
+    with stage_seconds.time(operation="search", stage="result_assembly"):
+        results = build_search_results(distances, indices, paths, threshold)
+        response = SearchResponse(
+            query_image=str(query_path),
+            results=results,
+            search_time_ms=search_time,
+            total_indexed=len(paths)
+        )
     
     await log_activity(
         f"Search completed: found {len(results)} results in {search_time:.2f}ms",
         category="search"
     )
     
+    # Only cache results computed against the version the key was taken for
+    if cache_key[-1] == index_version:
+        result_cache.put(cache_key, response)
+    operation_seconds.observe(time.perf_counter() - started, operation="search")
+    return response
+
+@api_router.get("/search/similar")
+async def search_similar_to_indexed(
+    image_id: Optional[int] = None,
+    filepath: Optional[str] = None,
+    top_k: int = Query(default=10, ge=1),
+    threshold: float = 0.0,
+    nprobe: Optional[int] = None,
+    ef_search: Optional[int] = None,
+    category: Optional[str] = None
+):
+    """Find images similar to an already indexed image using its stored vector"""
+    if faiss_index is None:
+        loaded = await load_index()
+        if not loaded:
+            raise HTTPException(status_code=400, detail="Index not built. Please build the index first.")
+    
+    if image_id is None and filepath is None:
+        raise HTTPException(status_code=400, detail="Provide image_id or filepath")
+    if image_id is not None:
+        position = image_id
+    else:
+        # The first lookup after a snapshot swap builds the path map, so it runs off the event loop
+        position = await asyncio.get_event_loop().run_in_executor(executor, position_of_path, filepath)
+    if position is None:
+        raise HTTPException(status_code=404, detail="Image is not indexed")
+    
+    start_time = time.time()
+    options = SearchOptions(nprobe=nprobe, ef_search=ef_search, categories=parse_categories(category))
+    try:
+        distances, indices, paths = await asyncio.get_event_loop().run_in_executor(
+            executor, search_by_position, position, top_k, options
+        )
+    except KeyError:
+        raise HTTPException(status_code=404, detail="Image is not indexed")
+    search_time = (time.time() - start_time) * 1000
+    
     return SearchResponse(
-        query_image=str(query_path),
-        results=results,
+        query_image=paths[position],
+        results=build_search_results(distances, indices, paths, threshold),
         search_time_ms=search_time,
-        total_indexed=len(image_paths)
+        total_indexed=len(paths)
     )
 
-@api_router.post("/build-index")
-async def trigger_build_index():
-    """Trigger index building"""
-    success = await build_index()
-    if success:
-        return {"status": "success", "message": "Index built successfully"}
+def read_archive_images(archive_path: str, max_bytes: int = MAX_UPLOAD_BYTES):
+    """Yield (name, bytes, error) for every image member of a zip or tar archive
+    
+    Members larger than max_bytes are not read; they are yielded with no bytes and an error.
+    """
+    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+    too_large = f"exceeds the {max_bytes} byte upload limit"
+    if zipfile.is_zipfile(archive_path):
+        with zipfile.ZipFile(archive_path) as archive:
+            for member in archive.infolist():
+                if not member.is_dir() and Path(member.filename).suffix.lower() in image_extensions:
+                    # Reads stop at the declared file_size, so a member cannot inflate past it
+                    if member.file_size > max_bytes:
+                        yield member.filename, None, too_large
+                    else:
+                        yield member.filename, archive.read(member), None
+    elif tarfile.is_tarfile(archive_path):
+        with tarfile.open(archive_path) as archive:
+            for member in archive:
+                if member.isfile() and Path(member.name).suffix.lower() in image_extensions:
+                    if member.size > max_bytes:
+                        yield member.name, None, too_large
+                    else:
+                        yield member.name, archive.extractfile(member).read(), None
     else:
-        raise HTTPException(status_code=400, detail="Failed to build index")
+        raise ValueError("archive must be a zip or tar file")
 
-@api_router.get("/dataset-stats")
-async def get_dataset_stats():
-    """Get dataset statistics"""
-    # Count images by category
-    categories = {}
-    total = 0
+@api_router.post("/search-batch")
+async def search_batch(
+    files: List[UploadFile] = File(default=[]),
+    archive: Optional[UploadFile] = File(default=None),
+    top_k: int = Form(default=10, ge=1),
+    threshold: float = Form(default=0.0),
+    nprobe: Optional[int] = Form(default=None),
+    ef_search: Optional[int] = Form(default=None),
+    category: Optional[str] = Form(default=None)
+):
+    """Search for many query images at once, streaming NDJSON results per query as each batch completes"""
+    if faiss_index is None:
+        loaded = await load_index()
+        if not loaded:
+            raise HTTPException(status_code=400, detail="Index not built. Please build the index first.")
+    if not files and archive is None:
+        raise HTTPException(status_code=400, detail="Provide query images as files or an archive")
     
-    image_extensions = {'.jpg', '.jpeg', '.png', '.gif', '.bmp', '.webp'}
+    # Uploads are closed once this handler returns, so spool what the stream needs to disk now;
+    # each query is capped at MAX_UPLOAD_BYTES and read back only when its batch runs
+    spool_dir = Path(tempfile.mkdtemp(prefix="search-batch-"))
+    queries, archive_path = [], None
+    try:
+        for i, f in enumerate(files):
+            if not (f.content_type or "").startswith('image/'):
+                queries.append((f.filename, None, "not an image"))
+                continue
+            query_path = spool_dir / f"{i}{Path(f.filename or '').suffix}"
+            await save_upload(f, query_path, operation="search", hash_contents=False)
+            queries.append((f.filename, str(query_path), None))
+        if archive is not None:
+            archive_path = str(spool_dir / f"archive{Path(archive.filename or '').suffix}")
+            with open(archive_path, "wb") as archive_copy:
+                await asyncio.get_event_loop().run_in_executor(
+                    executor, shutil.copyfileobj, archive.file, archive_copy
+                )
+            if not zipfile.is_zipfile(archive_path) and not tarfile.is_tarfile(archive_path):
+                raise HTTPException(status_code=400, detail="archive must be a zip or tar file")
+    except BaseException:
+        shutil.rmtree(spool_dir, ignore_errors=True)
+        raise
     
-    if DATASET_DIR.exists():
-        for cat_dir in DATASET_DIR.iterdir():
-            if cat_dir.is_dir():
-                count = sum(1 for f in cat_dir.iterdir() 
-                           if f.is_file() and f.suffix.lower() in image_extensions)
-                if count > 0:
-                    categories[cat_dir.name] = count
-                    total += count
+    options = SearchOptions(nprobe=nprobe, ef_search=ef_search, categories=parse_categories(category))
+    batch_size = max(1, FEATURE_BATCH_SIZE)
+    loop = asyncio.get_event_loop()
+    
+    def batches():
+        batch = []
+        sources = [iter(queries)]
+        if archive_path is not None:
+            sources.append(read_archive_images(archive_path))
+        for source in sources:
+            for query in source:
+                batch.append(query)
+                if len(batch) == batch_size:
+                    yield batch
+                    batch = []
+        if batch:
+            yield batch
+    
+    async def stream():
+        start_time = time.time()
+        total, failed = 0, 0
+        pending = batches()
+        try:
+            while True:
+                try:
+                    batch = await loop.run_in_executor(executor, next, pending, None)
+                except Exception as e:
+                    # A damaged archive ends the stream, but says why
+                    yield json.dumps({"error": f"Failed to read archive: {e}"}) + "\n"
+                    break
+                if batch is None:
+                    break
+                outcomes = [ValueError(error) if error else None for _, _, error in batch]
+                rows = [i for i, outcome in enumerate(outcomes) if outcome is None]
+                if rows:
+                    try:
+                        searched = await loop.run_in_executor(
+                            executor, embed_and_search,
+                            [batch[i][1] for i in rows], [top_k] * len(rows), [options] * len(rows)
+                        )
+                    except Exception as e:
+                        searched = [e] * len(rows)
+                    for i, outcome in zip(rows, searched):
+                        outcomes[i] = outcome
+                lines = []
+                for (name, _, _), outcome in zip(batch, outcomes):
+                    entry = {"position": total, "query": name}
+                    if isinstance(outcome, Exception):
+                        entry["error"] = str(outcome)
+                        failed += 1
+                    else:
+                        distances, indices, paths = outcome
+                        entry["results"] = [
+                            r.model_dump() for r in build_search_results(distances, indices, paths, threshold)
+                        ]
+                    lines.append(json.dumps(entry) + "\n")
+                    total += 1
+                yield "".join(lines)
+        finally:
+            shutil.rmtree(spool_dir, ignore_errors=True)
+        
+        await log_activity(
+            f"Batch search completed: {total} queries ({failed} failed) in {(time.time() - start_time) * 1000:.2f}ms",
+            category="search"
+        )
+    
+    return StreamingResponse(stream(), media_type="application/x-ndjson")
+
+@api_router.get("/embedding-cache")
+async def get_embedding_cache_stats():
+    """Get embedding cache hit/miss counters"""
+    return await asyncio.get_event_loop().run_in_executor(executor, embedding_cache.stats)
+
+@api_router.get("/result-cache")
+async def get_result_cache_stats():
+    """Get search result cache counters"""
+    return result_cache.stats()
+
+@api_router.get("/index-info")
+async def get_index_info():
+    """Get the live index type, size and latest recall report"""
+    report_path = (live_dir or current_snapshot_dir()) / "index_report.json"
+    report = None
+    if report_path.exists():
+        with open(report_path, "r") as f:
+            report = json.load(f)
+    if faiss_index is None:
+        return {"index_type": None, "ntotal": 0, "model_id": MODEL_ID, "report": report}
+    
+    info = {
+        "index_type": index_type_name(faiss_index),
+        "ntotal": int(faiss_index.ntotal),
+        "vector_storage": index_storage(faiss_index),
+        "model_id": MODEL_ID,
+        "snapshot": live_dir.name if live_dir is not None and live_dir != DATA_DIR else None,
+        "report": report,
+    }
+    if isinstance(faiss_index, ShardedIndex):
+        info.update(shard_by=faiss_index.by, shards=faiss_index.shards)
+    elif info["index_type"] in ("ivf", "ivfpq"):
+        info.update(nlist=int(faiss_index.nlist), nprobe=int(faiss_index.nprobe))
+    elif info["index_type"] == "hnsw":
+        info.update(ef_search=int(faiss_index.hnsw.efSearch))
+    return info
+
+@api_router.post("/build-index", status_code=202)
+async def trigger_build_index(batch_size: Optional[int] = None, index_type: Optional[str] = None):
+    """Start a background index build and return its job; a build already in progress is returned instead"""
+    if index_type is not None and index_type not in INDEX_TYPES:
+        raise HTTPException(status_code=400, detail=f"index_type must be one of {sorted(INDEX_TYPES)}")
+    
+    job = active_build_job()
+    if job is not None:
+        return job
+    if SHARED_INDEX and not build_file_lock.acquire(blocking=False):
+        # Another worker took the lock but has not written its job yet
+        raise HTTPException(status_code=409, detail="An index build is running in another worker")
+    
+    job = BuildJob()
+    build_job_store.add(job)
+    task = asyncio.get_event_loop().create_task(run_build_job(job, batch_size, index_type))
+    build_tasks.add(task)
+    task.add_done_callback(build_tasks.discard)
+    return job
+
+@api_router.get("/build-index/{job_id}")
+async def get_build_job(job_id: str):
+    """Get progress of an index build job"""
+    job = build_job_store.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail="Build job not found")
+    return job
+
+@api_router.get("/build-jobs")
+async def list_build_jobs():
+    """List recent index build jobs, newest first"""
+    return build_job_store.list()
+
+@api_router.get("/dataset-stats")
+async def get_dataset_stats():
+    """Get dataset statistics from the maintained per-category counts"""
+    dataset_stats.refresh()
+    if not dataset_stats.loaded:
+        await reconcile_dataset_stats()
+    categories = {c: n for c, n in dataset_stats.categories.items() if n > 0}
+    total = sum(categories.values())
     
-    index_exists = (DATA_DIR / "faiss_index.bin").exists()
+    index_exists = faiss_index is not None or (current_snapshot_dir() / "faiss_index.bin").exists()
     index_size = len(image_paths) if image_paths else 0
     
     return DatasetStats(
@@ -368,54 +3128,98 @@ async def get_dataset_stats():
     )
 
 @api_router.get("/logs")
-async def get_logs(limit: int = 100, category: Optional[str] = None):
-    """Get activity logs"""
+async def get_logs(response: Response, limit: int = 100, category: Optional[str] = None, cursor: Optional[str] = None):
+    """Get activity logs, newest first; pass the X-Next-Cursor response header as cursor for the next page"""
+    limit = max(1, min(limit, LOG_PAGE_MAX))
     query = {}
     if category:
         query["category"] = category
+    if cursor:
+        timestamp, entry_id = decode_log_cursor(cursor)
+        query["$or"] = [
+            {"timestamp": {"$lt": timestamp}},
+            {"timestamp": timestamp, "id": {"$lt": entry_id}},
+        ]
+    else:
+        # Include entries still waiting in the write buffer
+        await log_writer.flush()
     
-    logs = await db.logs.find(query, {"_id": 0}).sort("timestamp", -1).to_list(limit)
+    logs = await db.logs.find(query, {"_id": 0, "created_at": 0}).sort(
+        [("timestamp", -1), ("id", -1)]
+    ).limit(limit).to_list(limit)
+    if len(logs) == limit:
+        response.headers["X-Next-Cursor"] = encode_log_cursor(logs[-1])
     return logs
 
 @api_router.delete("/clear-logs")
 async def clear_logs():
     """Clear all logs"""
-    await db.logs.delete_many({})
+    await log_writer.flush()
+    if LOG_RETENTION == "capped":
+        # Capped collections may not support deletes; recreate it empty instead
+        await db.logs.drop()
+        await ensure_log_collection()
+    else:
+        await db.logs.delete_many({})
     return {"status": "success", "message": "Logs cleared"}
 
+@api_router.post("/dataset-stats/reconcile")
+async def reconcile_stats():
+    """Recount the dataset directory, correcting drift in the maintained counts"""
+    corrections = await reconcile_dataset_stats()
+    await log_activity(
+        f"Dataset stats reconciled ({len(corrections)} categories corrected)", category="system"
+    )
+    return {"corrections": corrections, "stats": await get_dataset_stats()}
+
 @api_router.get("/categories")
 async def get_categories():
     """Get all categories in the dataset"""
-    categories = []
-    if DATASET_DIR.exists():
-        for cat_dir in DATASET_DIR.iterdir():
-            if cat_dir.is_dir():
-                categories.append(cat_dir.name)
-    return {"categories": sorted(categories)}
+    dataset_stats.refresh()
+    if not dataset_stats.loaded:
+        await reconcile_dataset_stats()
+    return {"categories": sorted(dataset_stats.categories)}
 
 @api_router.delete("/clear-dataset")
 async def clear_dataset():
     """Clear all dataset images and index"""
-    global faiss_index, image_paths, features_array
-    
-    # Clear dataset directory
-    if DATASET_DIR.exists():
-        shutil.rmtree(DATASET_DIR)
-        DATASET_DIR.mkdir(parents=True, exist_ok=True)
-    
-    # Clear index files
-    for f in ["faiss_index.bin", "features.npy", "image_paths.json"]:
-        path = DATA_DIR / f
-        if path.exists():
-            path.unlink()
-    
-    # Clear database
-    await db.images.delete_many({})
-    
-    # Reset globals
-    faiss_index = None
-    image_paths = []
-    features_array = None
+    if active_build_job() is not None:
+        raise HTTPException(status_code=409, detail="An index build is in progress")
+    # Holding the build lock keeps other workers from building while files are removed; they
+    # notice the missing snapshot on their next poll and drop their index
+    if SHARED_INDEX and not build_file_lock.acquire(blocking=False):
+        raise HTTPException(status_code=409, detail="An index build is running in another worker")
+    try:
+        # Appends and snapshot publishes in this worker hold the same lock, so none interleaves with the removal
+        async with index_lock:
+            if SHARED_INDEX:
+                # Wait for an append in progress in another worker
+                await asyncio.get_event_loop().run_in_executor(None, index_file_lock.acquire)
+            
+            # Clear dataset directory
+            if DATASET_DIR.exists():
+                shutil.rmtree(DATASET_DIR)
+                DATASET_DIR.mkdir(parents=True, exist_ok=True)
+            
+            # Clear index files
+            for f in ["faiss_index.bin", "features.npy", "image_paths.json", PathTable.OFFSETS_FILE,
+                      PathTable.DATA_FILE, "index_report.json", CURRENT_SNAPSHOT_FILE.name]:
+                path = DATA_DIR / f
+                if path.exists():
+                    path.unlink()
+            if SNAPSHOTS_DIR.exists():
+                shutil.rmtree(SNAPSHOTS_DIR)
+            
+            # Clear database
+            await db.images.delete_many({})
+            dataset_stats.reset()
+            variant_cache.clear()
+            
+            clear_live_index()
+    finally:
+        if SHARED_INDEX:
+            index_file_lock.release()
+            build_file_lock.release()
     
     await log_activity("Dataset cleared", category="system")
     return {"status": "success", "message": "Dataset cleared"}
@@ -433,21 +3237,63 @@ async def get_sample_categories():
     ]
     return {"categories": categories}
 
+def is_not_modified(request: Request, etag: str, mtime: float) -> bool:
+    """Whether a conditional GET's validators still match the current representation"""
+    if_none_match = request.headers.get("if-none-match")
+    if if_none_match is not None:
+        tags = [tag.strip() for tag in if_none_match.split(",")]
+        return "*" in tags or etag in tags or f"W/{etag}" in tags
+    if_modified_since = request.headers.get("if-modified-since")
+    if if_modified_since:
+        try:
+            return int(mtime) <= parsedate_to_datetime(if_modified_since).timestamp()
+        except (TypeError, ValueError):
+            return False
+    return False
+
 @api_router.get("/images/{image_type}/{category}/{filename}")
-async def serve_image(image_type: str, category: str, filename: str):
-    """Serve images through API endpoint for Kubernetes compatibility"""
+async def serve_image(request: Request, image_type: str, category: str, filename: str, size: Optional[str] = None):
+    """Serve images through API endpoint for Kubernetes compatibility
+    
+    size selects a cached resized variant ("thumb" or "preview") instead of the original.
+    """
     from fastapi.responses import FileResponse
     
     if image_type == "dataset":
+        base_dir = DATASET_DIR
         file_path = DATASET_DIR / category / filename
     elif image_type == "queries":
+        base_dir = QUERIES_DIR
         file_path = QUERIES_DIR / filename
     else:
         raise HTTPException(status_code=404, detail="Invalid image type")
+    if size is not None and size not in IMAGE_VARIANTS:
+        raise HTTPException(status_code=400, detail=f"size must be one of {sorted(IMAGE_VARIANTS)}")
     
-    if not file_path.exists():
+    if base_dir.resolve() not in file_path.resolve().parents or not file_path.is_file():
         raise HTTPException(status_code=404, detail="Image not found")
     
+    # Validators come from the original, so revalidation never needs the variant
+    stat = file_path.stat()
+    etag = f'"{stat.st_mtime_ns:x}-{stat.st_size:x}{"-" + size if size else ""}"'
+    cache_headers = {
+        "ETag": etag,
+        "Last-Modified": formatdate(stat.st_mtime, usegmt=True),
+        "Cache-Control": f"public, max-age={IMAGE_CACHE_MAX_AGE}",
+    }
+    if is_not_modified(request, etag, stat.st_mtime):
+        return Response(status_code=304, headers=cache_headers)
+    
+    if size is not None:
+        try:
+            # Default thread pool, so resizing never queues behind inference on the executor
+            variant_path = await asyncio.get_event_loop().run_in_executor(
+                None, variant_cache.get, file_path, stat, size
+            )
+        except Exception as e:
+            raise HTTPException(status_code=415, detail=f"Cannot resize image: {e}")
+        return FileResponse(variant_path, media_type='image/jpeg', headers=cache_headers)
+    
     # Determine content type
     suffix = file_path.suffix.lower()
     content_types = {
@@ -460,7 +3306,7 @@ async def serve_image(image_type: str, category: str, filename: str):
     }
     content_type = content_types.get(suffix, 'application/octet-stream')
     
-    return FileResponse(file_path, media_type=content_type)
+    return FileResponse(file_path, media_type=content_type, headers=cache_headers)
 
 # Include the router in the main app
 app.include_router(api_router)
@@ -474,14 +3320,83 @@ app.add_middleware(
     allow_origins=os.environ.get('CORS_ORIGINS', '*').split(','),
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Next-Cursor"],
 )
 
+def import_inference_runtime():
+    """Import the inference framework and FAISS so their one-off cost is paid up front"""
+    if FEATURE_BACKEND == "keras":
+        import tensorflow  # noqa: F401
+    else:
+        import onnxruntime  # noqa: F401
+    import faiss  # noqa: F401
+
+def warm_up_model(batch_sizes: List[int]):
+    """Run dummy batches through decoding and the model so tracing and allocation happen before real traffic"""
+    from PIL import Image
+    buffer = io.BytesIO()
+    Image.new('RGB', (448, 448)).save(buffer, format='JPEG')
+    preprocess_batch([buffer.getvalue()] * max(1, DECODE_WORKERS))
+    
+    for size in batch_sizes:
+        predict_batch(np.zeros((size,) + image_decode.BATCH_ITEM_SHAPE, dtype='float32'))
+    
+    with index_mutex:
+        if faiss_index is not None and faiss_index.ntotal > 0:
+            search_live(faiss_index, features_array, np.array(features_array[:1], dtype='float32'), 1, SearchOptions())
+
+async def prepare_service():
+    """Startup phase: import, model build, index load and warm-up, each timed; marks the service ready"""
+    loop = asyncio.get_event_loop()
+    started = time.perf_counter()
+    phases = [
+        ("import", lambda: loop.run_in_executor(executor, import_inference_runtime)),
+        ("model_build", lambda: loop.run_in_executor(executor, load_feature_extractor)),
+        ("index_load", load_index),
+        ("warmup", lambda: loop.run_in_executor(executor, warm_up_model, WARMUP_BATCH_SIZES)),
+    ]
+    if not WARMUP_ON_STARTUP:
+        phases = [phase for phase in phases if phase[0] == "index_load"]
+    
+    try:
+        for name, run in phases:
+            startup_state["phase"] = name
+            phase_started = time.perf_counter()
+            await run()
+            startup_state["phases"][name] = round(time.perf_counter() - phase_started, 3)
+    except Exception as e:
+        startup_state.update(phase="failed", error=f"{startup_state['phase']}: {e}")
+        await log_activity(f"Startup failed during {startup_state['error']}", level="ERROR", category="system")
+        return
+    
+    total = time.perf_counter() - started
+    startup_state.update(ready=True, phase="ready", total_seconds=round(total, 3))
+    timings = ", ".join(f"{name} {seconds:.1f}s" for name, seconds in startup_state["phases"].items())
+    await log_activity(f"Application ready in {total:.1f}s ({timings})", category="system")
+
 @app.on_event("startup")
 async def startup_event():
-    """Load index on startup if available"""
-    await load_index()
+    """Start loading the model and index; /api/ready reports when they are warm"""
+    global startup_task, shared_index_watcher
+    await db.images.create_index("content_hash")
+    await db.images.create_index("hash_bands")
+    await ensure_log_collection()
     await log_activity("Application started", category="system")
+    startup_task = asyncio.create_task(prepare_service())
+    if SHARED_INDEX:
+        shared_index_watcher = asyncio.create_task(watch_shared_index())
+    if not dataset_stats.loaded:
+        # First start with this data directory: count the dataset once, off the request path
+        asyncio.create_task(reconcile_dataset_stats())
 
 @app.on_event("shutdown")
 async def shutdown_db_client():
+    if shared_index_watcher is not None:
+        shared_index_watcher.cancel()
+    await log_writer.close()
     client.close()
+    if decode_pool is not None:
+        decode_pool.shutdown(wait=False, cancel_futures=True)
+    for worker in shard_workers:
+        worker.shutdown(wait=False, cancel_futures=True)
+    shard_workers.clear()
@@ -121,12 +121,20 @@ function App() {
   const handleBuildIndex = async () => {
     setIsBuilding(true);
     try {
-      await axios.post(`${API}/build-index`);
+      // Builds run in the background; poll the job until it finishes
+      let { data: job } = await axios.post(`${API}/build-index`);
+      while (job.status === "queued" || job.status === "running") {
+        await new Promise((resolve) => setTimeout(resolve, 1000));
+        ({ data: job } = await axios.get(`${API}/build-index/${job.id}`));
+      }
+      if (job.status !== "succeeded") {
+        throw new Error(job.message || "Failed to build index");
+      }
       toast.success("Index built successfully!");
       fetchDatasetStats();
       fetchLogs();
     } catch (error) {
-      toast.error(error.response?.data?.detail || "Failed to build index");
+      toast.error(error.response?.data?.detail || error.message || "Failed to build index");
     } finally {
       setIsBuilding(false);
     }
@@ -145,7 +153,14 @@ function App() {
 
     try {
       const response = await axios.post(`${API}/upload-dataset`, formData);
-      toast.success(`Uploaded ${response.data.uploaded} images`);
+      const deduplicated = response.data.deduplicated || [];
+      const linked = deduplicated.filter(d => d.action === "linked").length;
+      const skipped = deduplicated.length - linked;
+      toast.success(
+        `Uploaded ${response.data.uploaded} images` +
+        (skipped ? `, skipped ${skipped} duplicates` : "") +
+        (linked ? `, linked ${linked} duplicates to existing images` : "")
+      );
       setUploadFiles([]);
       fetchDatasetStats();
       fetchLogs();
@@ -179,7 +194,7 @@ function App() {
     }
   };
 
-  const getImageUrl = (filepath) => {
+  const getImageUrl = (filepath, size) => {
     // Parse filepath like /app/backend/uploads/dataset/dog/dog1.jpg
     // or /app/backend/uploads/queries/abc.jpg
     const parts = filepath.split('/uploads/');
@@ -187,13 +202,15 @@ function App() {
     
     const relativePath = parts[1]; // dataset/dog/dog1.jpg or queries/abc.jpg
     const pathParts = relativePath.split('/');
+    // Resized variant ("thumb" or "preview") instead of the full-resolution original
+    const variant = size ? `?size=${size}` : "";
     
     if (pathParts[0] === 'dataset' && pathParts.length >= 3) {
       // dataset/category/filename -> /api/images/dataset/category/filename
-      return `${API}/images/dataset/${pathParts[1]}/${pathParts.slice(2).join('/')}`;
+      return `${API}/images/dataset/${pathParts[1]}/${pathParts.slice(2).join('/')}${variant}`;
     } else if (pathParts[0] === 'queries' && pathParts.length >= 2) {
       // queries/filename -> /api/images/queries/_/filename
-      return `${API}/images/queries/_/${pathParts.slice(1).join('/')}`;
+      return `${API}/images/queries/_/${pathParts.slice(1).join('/')}${variant}`;
     }
     
     return `${BACKEND_URL}/uploads/${relativePath}`;
@@ -371,7 +388,7 @@ function App() {
                           >
                             <div className="result-rank">#{idx + 1}</div>
                             <img
-                              src={getImageUrl(result.filepath)}
+                              src={getImageUrl(result.filepath, "thumb")}
                               alt={result.filename}
                               className="result-thumbnail"
                             />
@@ -679,7 +696,7 @@ function App() {
           {selectedImage && (
             <div className="preview-content">
               <img
-                src={getImageUrl(selectedImage.filepath)}
+                src={getImageUrl(selectedImage.filepath, "preview")}
                 alt={selectedImage.filename}
                 className="preview-image"
               />
@@ -0,0 +1,94 @@
+import asyncio
+import io
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+from PIL import Image
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent / "backend"))
+
+import server  # noqa: E402
+
+
+@pytest.fixture
+def live(tmp_path, monkeypatch):
+    """The server module with its data directory, dataset and live index state pointed at tmp_path"""
+    data_dir = tmp_path / "data"
+    dataset_dir = tmp_path / "dataset"
+    data_dir.mkdir()
+    dataset_dir.mkdir()
+    monkeypatch.setattr(server, "DATA_DIR", data_dir)
+    monkeypatch.setattr(server, "DATASET_DIR", dataset_dir)
+    monkeypatch.setattr(server, "SNAPSHOTS_DIR", data_dir / "snapshots")
+    monkeypatch.setattr(server, "CURRENT_SNAPSHOT_FILE", data_dir / "CURRENT")
+    monkeypatch.setattr(server, "embedding_cache",
+                        server.EmbeddingCache(data_dir / "embedding_cache.sqlite3", server.MODEL_ID))
+    monkeypatch.setattr(server, "dataset_stats", server.DatasetStatsStore(data_dir / "dataset_stats.json"))
+    monkeypatch.setattr(server, "build_job_store", server.BuildJobStore(data_dir / "build_jobs"))
+    monkeypatch.setattr(server, "log_writer", server.LogWriter(100, 1.0, 1000, "drop"))
+    monkeypatch.setattr(server, "query_embeddings", server.ResultCache(16, float('inf')))
+    for name, value in (("faiss_index", None), ("image_paths", []), ("features_array", None),
+                        ("index_mmapped", False), ("live_dir", None)):
+        monkeypatch.setattr(server, name, value)
+    server.bump_index_version()
+    yield server
+    server.bump_index_version()
+
+
+@pytest.fixture
+def mongo(monkeypatch):
+    """An in-memory Mongo database in place of the server's"""
+    mongomock_motor = pytest.importorskip("mongomock_motor")
+    db = mongomock_motor.AsyncMongoMockClient()["tests"]
+    monkeypatch.setattr(server, "db", db)
+    return db
+
+
+@pytest.fixture
+def predictions(live, monkeypatch):
+    """Sizes of the batches run through the model, which returns each image's mean pixel as its vector"""
+    calls = []
+
+    def predict_batch(batch, operation=None):
+        calls.append(len(batch))
+        return batch.reshape(len(batch), -1, 3).mean(axis=1).astype('float32')
+
+    monkeypatch.setattr(live, "predict_batch", predict_batch)
+    return calls
+
+
+def write_images(dataset_dir: Path, category: str, vectors: np.ndarray, embedding_cache) -> list:
+    """Files whose embeddings are already cached, so indexing them needs no model"""
+    directory = dataset_dir / category
+    directory.mkdir(parents=True, exist_ok=True)
+    paths, cached = [], {}
+    for i, vector in enumerate(vectors):
+        path = directory / f"{category}{i}.jpg"
+        path.write_bytes(f"{category}/{i}".encode())
+        paths.append(str(path))
+        cached[server.hash_file(str(path))] = vector
+    embedding_cache.put_many(cached)
+    return paths
+
+
+def unit_rows(vectors: np.ndarray) -> np.ndarray:
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def run(coroutine):
+    """Run a coroutine on a fresh event loop, then stop the log writer it started"""
+    async def main():
+        try:
+            return await coroutine
+        finally:
+            await server.log_writer.close()
+    return asyncio.run(main())
+
+
+def jpeg(seed: int) -> bytes:
+    pixels = np.random.default_rng(seed).integers(0, 255, (32, 32, 3), dtype='uint8')
+    buffer = io.BytesIO()
+    Image.fromarray(pixels).save(buffer, format='JPEG')
+    return buffer.getvalue()
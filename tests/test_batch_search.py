@@ -0,0 +1,92 @@
+import io
+import json
+import zipfile
+
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import jpeg
+
+
+@pytest.fixture
+def client(live, mongo, predictions):
+    """A client for the app with three query images indexed under their own embeddings"""
+    images = [jpeg(seed) for seed in range(3)]
+    vectors, _ = live.embed_queries(images)
+    live.features_array = vectors
+    live.faiss_index = live.build_faiss_index_sync(vectors.copy(), "flat")
+    live.image_paths = [f"/d/cats/{i}.jpg" for i in range(3)]
+    # Without a context manager the startup handlers (Mongo, model warm-up) do not run
+    return TestClient(live.app), images
+
+
+def lines(response):
+    return [json.loads(line) for line in response.text.splitlines()]
+
+
+def test_streams_one_line_per_query(client):
+    client, images = client
+    response = client.post("/api/search-batch", data={"top_k": "2"}, files=[
+        ("files", ("a.jpg", images[0], "image/jpeg")),
+        ("files", ("notes.txt", b"hello", "text/plain")),
+        ("files", ("c.jpg", images[2], "image/jpeg")),
+    ])
+
+    assert response.status_code == 200
+    entries = lines(response)
+    assert [entry["query"] for entry in entries] == ["a.jpg", "notes.txt", "c.jpg"]
+    assert [len(entry.get("results", [])) for entry in entries] == [2, 0, 2]
+    assert entries[1]["error"] == "not an image"
+    assert entries[2]["results"][0]["filepath"] == "/d/cats/2.jpg"
+
+
+def test_rejects_top_k_below_one(client):
+    client, images = client
+    response = client.post("/api/search-batch", data={"top_k": "0"},
+                           files=[("files", ("a.jpg", images[0], "image/jpeg"))])
+    assert response.status_code == 422
+
+
+def test_failed_batches_become_error_lines(client, live, monkeypatch):
+    client, images = client
+
+    def predict_batch(batch, operation=None):
+        raise RuntimeError("inference failed")
+
+    monkeypatch.setattr(live, "query_embeddings", live.ResultCache(16, float('inf')))
+    monkeypatch.setattr(live, "predict_batch", predict_batch)
+    response = client.post("/api/search-batch", files=[
+        ("files", ("a.jpg", images[0], "image/jpeg")),
+        ("files", ("b.jpg", images[1], "image/jpeg")),
+    ])
+
+    assert response.status_code == 200
+    assert [entry["error"] for entry in lines(response)] == ["inference failed"] * 2
+
+
+def test_archive_members_over_the_limit_are_not_read(tmp_path, live):
+    path = tmp_path / "queries.zip"
+    with zipfile.ZipFile(path, "w") as archive:
+        archive.writestr("small.jpg", b"x" * 10)
+        archive.writestr("large.jpg", b"x" * 100)
+        archive.writestr("notes.txt", b"x")
+
+    members = list(live.read_archive_images(str(path), max_bytes=50))
+
+    assert members == [("small.jpg", b"x" * 10, None),
+                       ("large.jpg", None, "exceeds the 50 byte upload limit")]
+
+
+def test_archive_queries_are_searched(client):
+    client, images = client
+    buffer = io.BytesIO()
+    with zipfile.ZipFile(buffer, "w") as archive:
+        archive.writestr("x/1.jpg", images[1])
+    response = client.post("/api/search-batch", data={"top_k": "1"},
+                           files=[("archive", ("queries.zip", buffer.getvalue(), "application/zip"))])
+
+    entries = lines(response)
+    assert [entry["query"] for entry in entries] == ["x/1.jpg"]
+    assert entries[0]["results"][0]["filepath"] == "/d/cats/1.jpg"
+    np.testing.assert_allclose(entries[0]["results"][0]["similarity_score"], 1.0, rtol=1e-5)
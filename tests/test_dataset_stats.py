@@ -0,0 +1,49 @@
+from server import DatasetStatsStore
+
+
+def test_counts_persist_across_instances(tmp_path):
+    stats = DatasetStatsStore(tmp_path / "stats.json")
+    assert not stats.loaded
+    stats.reset()
+    stats.add("cats", 3)
+    stats.add("dogs", 2)
+    stats.add("cats", -1)
+
+    assert DatasetStatsStore(tmp_path / "stats.json").categories == {"cats": 2, "dogs": 2}
+
+
+def test_add_before_the_first_count_is_ignored(tmp_path):
+    stats = DatasetStatsStore(tmp_path / "stats.json")
+    stats.add("cats", 1)
+    assert not stats.loaded
+    assert not (tmp_path / "stats.json").exists()
+
+
+def test_recount_returns_corrections(tmp_path):
+    stats = DatasetStatsStore(tmp_path / "stats.json")
+    stats.reset()
+    stats.add("cats", 5)
+    stats.add("birds", 1)
+
+    stats.begin_recount()
+    corrections = stats.finish_recount({"cats": 4, "dogs": 2})
+
+    assert corrections == {"cats": -1, "dogs": 2, "birds": -1}
+    assert stats.categories == {"cats": 4, "dogs": 2}
+    assert stats.reconciled_at is not None
+
+
+def test_uploads_during_a_recount_are_kept(tmp_path):
+    stats = DatasetStatsStore(tmp_path / "stats.json")
+    stats.reset()
+    stats.add("cats", 5)
+
+    stats.begin_recount()
+    # Uploaded while the scan ran, after it had already passed their directories
+    stats.add("cats", 2)
+    stats.add("dogs", 1)
+    corrections = stats.finish_recount({"cats": 5})
+
+    assert stats.categories == {"cats": 7, "dogs": 1}
+    assert corrections == {}
+
@@ -0,0 +1,98 @@
+import io
+
+import numpy as np
+from PIL import Image
+
+from server import hash_bands, hash_distance
+from tests.conftest import run
+
+BASE = "f0f0f0f0f0f0f0f0"
+
+
+def flip(perceptual_hash: str, *bits) -> str:
+    value = int(perceptual_hash, 16)
+    for bit in bits:
+        value ^= 1 << bit
+    return f"{value:016x}"
+
+
+async def store(db, filepath, content_hash, perceptual_hash, duplicate_of=None):
+    await db.images.insert_one({
+        "filepath": filepath, "content_hash": content_hash, "perceptual_hash": perceptual_hash,
+        "hash_bands": hash_bands(perceptual_hash), "duplicate_of": duplicate_of,
+    })
+
+
+def test_hashes_within_the_distance_share_a_band():
+    near = flip(BASE, 1, 20, 40)
+    assert hash_distance(BASE, near) == 3
+    assert set(hash_bands(BASE)) & set(hash_bands(near))
+
+
+def test_difference_hash_survives_resizing():
+    from image_decode import difference_hash
+    gradient = np.tile(np.linspace(0, 255, 256, dtype='uint8'), (256, 1))
+    gradient[64:192, 64:192] = 255 - gradient[64:192, 64:192]
+    image = Image.fromarray(gradient).convert('RGB')
+    encoded = []
+    for size in ((256, 256), (120, 120)):
+        buffer = io.BytesIO()
+        image.resize(size).save(buffer, format='JPEG', quality=70)
+        encoded.append(buffer.getvalue())
+    assert hash_distance(difference_hash(encoded[0]), difference_hash(encoded[1])) <= 3
+
+
+def test_find_duplicates_classifies_uploads(live, mongo):
+    async def scenario():
+        await store(mongo, "/d/cats/a.jpg", "sha-a", BASE)
+        await store(mongo, "/d/cats/b.jpg", "sha-b", flip(BASE, 1))
+        # Linked copies are never matched against; their originals are
+        await store(mongo, "/d/cats/a.jpg", "sha-c", "0123456789abcdef", duplicate_of="/d/cats/a.jpg")
+        return await live.find_duplicates(
+            ["sha-a", "sha-x", "sha-y", "sha-y", "sha-z", "sha-c", "sha-w"],
+            [BASE, flip(BASE, 1, 2), "0f0f0f0f0f0f0f0f", "0f0f0f0f0f0f0f0f", flip("0f0f0f0f0f0f0f0f", 63),
+             "0123456789abcdef", None],
+        )
+
+    matches = run(scenario())
+    assert matches[0] == ("exact", "/d/cats/a.jpg", 1.0)
+    # Closest stored hash wins: one bit from b, two from a
+    assert matches[1] == ("near", "/d/cats/b.jpg", 1.0 - 1 / 64)
+    assert matches[2] is None
+    # Same bytes earlier in the request
+    assert matches[3] == ("exact", 2, 1.0)
+    # Near an earlier upload in the request
+    assert matches[4] == ("near", 2, 1.0 - 1 / 64)
+    assert matches[5] is None
+    assert matches[6] is None
+
+
+def test_find_duplicates_respects_the_distance(live, mongo, monkeypatch):
+    monkeypatch.setattr(live, "DEDUP_HASH_DISTANCE", 0)
+
+    async def scenario():
+        await store(mongo, "/d/cats/a.jpg", "sha-a", BASE)
+        return await live.find_duplicates(["sha-x", "sha-y"], [BASE, flip(BASE, 5)])
+
+    assert run(scenario()) == [("near", "/d/cats/a.jpg", 1.0), None]
+
+
+def test_find_near_duplicates_checks_the_index_and_the_batch(live, mongo):
+    rng = np.random.default_rng(3)
+    vectors = rng.normal(size=(10, 16)).astype('float32')
+    paths = [f"/d/cats/{i}.jpg" for i in range(10)]
+    live.features_array = vectors.copy()
+    live.faiss_index = live.build_faiss_index_sync(vectors.copy(), "flat")
+    live.image_paths = paths
+
+    fresh = rng.normal(size=16).astype('float32')
+    uploads = np.stack([vectors[4] * 2, fresh, fresh + 1e-3, -vectors[4]])
+    matches = live.find_near_duplicates(uploads, 0.99)
+
+    assert matches[0][0] == paths[4]
+    assert matches[0][1] > 0.99
+    assert matches[1] is None
+    assert matches[2][0] == 1
+    assert matches[3] is None
+    # The caller's vectors are left unnormalized
+    np.testing.assert_array_equal(uploads[0], vectors[4] * 2)
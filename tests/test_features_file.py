@@ -0,0 +1,52 @@
+import numpy as np
+import pytest
+
+from server import append_features_file, trim_features_file
+
+
+def test_append_rewrites_header_in_place(tmp_path):
+    path = tmp_path / "features.npy"
+    rows = np.arange(12, dtype='float32').reshape(3, 4)
+    np.save(str(path), rows)
+
+    extra = np.ones((2, 4), dtype='float64')
+    append_features_file(path, extra)
+    append_features_file(path, extra[:1])
+
+    stored = np.load(str(path))
+    assert stored.dtype == np.float32
+    assert stored.shape == (6, 4)
+    np.testing.assert_array_equal(stored[:3], rows)
+    np.testing.assert_array_equal(stored[3:], np.ones((3, 4)))
+
+
+def test_append_rejects_other_widths(tmp_path):
+    path = tmp_path / "features.npy"
+    np.save(str(path), np.zeros((2, 4), dtype='float32'))
+    with pytest.raises(ValueError):
+        append_features_file(path, np.zeros((1, 3), dtype='float32'))
+
+
+def test_trim_drops_rows_past_count(tmp_path):
+    path = tmp_path / "features.npy"
+    rows = np.arange(20, dtype='float32').reshape(5, 4)
+    np.save(str(path), rows)
+    mapped = np.load(str(path), mmap_mode='r')
+
+    trim_features_file(path, 3)
+
+    np.testing.assert_array_equal(np.load(str(path)), rows[:3])
+    # The file is replaced rather than truncated, so an existing mapping still reads its rows
+    np.testing.assert_array_equal(mapped, rows)
+    assert [p.name for p in tmp_path.iterdir()] == ["features.npy"]
+
+
+def test_trim_leaves_short_files_alone(tmp_path):
+    path = tmp_path / "features.npy"
+    np.save(str(path), np.zeros((2, 4), dtype='float32'))
+    mtime = path.stat().st_mtime_ns
+
+    trim_features_file(path, 2)
+    trim_features_file(path, 5)
+
+    assert path.stat().st_mtime_ns == mtime
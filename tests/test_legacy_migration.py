@@ -0,0 +1,52 @@
+import json
+
+import faiss
+import numpy as np
+
+from server import PathTable, SearchOptions
+from tests.conftest import run, unit_rows
+
+
+def write_legacy_index(data_dir, vectors, paths):
+    """The layout older builds wrote straight into DATA_DIR"""
+    index = faiss.IndexFlatIP(vectors.shape[1])
+    index.add(unit_rows(vectors))
+    faiss.write_index(index, str(data_dir / "faiss_index.bin"))
+    np.save(str(data_dir / "features.npy"), vectors)
+    (data_dir / "image_paths.json").write_text(json.dumps(paths))
+
+
+def test_legacy_index_is_copied_into_a_snapshot(live, mongo):
+    vectors = np.random.default_rng(9).random((6, 8), dtype='float32')
+    paths = [f"/d/cats/{i}.jpg" for i in range(6)]
+    write_legacy_index(live.DATA_DIR, vectors, paths)
+    legacy = {f.name: f.read_bytes() for f in live.DATA_DIR.iterdir()}
+
+    assert run(live.load_index())
+
+    directory = live.SNAPSHOTS_DIR / live.CURRENT_SNAPSHOT_FILE.read_text()
+    assert live.live_dir == directory
+    assert list(PathTable(directory)) == paths
+    assert json.loads((directory / "manifest.json").read_text())["model_id"] is None
+    assert live.previous_index_vectors() == {}
+
+    extra = np.random.default_rng(10).random((2, 8), dtype='float32')
+    live.append_to_live_index(extra, ["/d/dogs/0.jpg", "/d/dogs/1.jpg"])
+    _, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(extra), 1, SearchOptions())
+    assert ids[:, 0].tolist() == [6, 7]
+
+    # The legacy files are neither rewritten nor joined by new ones
+    data_files = {f.name for f in live.DATA_DIR.iterdir() if f.is_file() and f.suffix != ".lock"}
+    assert data_files - {"embedding_cache.sqlite3"} == set(legacy) | {"CURRENT"}
+    assert all((live.DATA_DIR / name).read_bytes() == data for name, data in legacy.items())
+
+
+def test_published_snapshots_are_not_replaced(live, mongo):
+    write_legacy_index(live.DATA_DIR, np.ones((2, 4), dtype='float32'), ["/d/a/0.jpg", "/d/a/1.jpg"])
+    assert run(live.load_index())
+    current = live.CURRENT_SNAPSHOT_FILE.read_text()
+
+    live.migrate_legacy_snapshot()
+
+    assert live.CURRENT_SNAPSHOT_FILE.read_text() == current
+    assert [d.name for d in live.SNAPSHOTS_DIR.iterdir()] == [current]
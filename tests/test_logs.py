@@ -0,0 +1,80 @@
+import pytest
+from fastapi import HTTPException, Response
+
+from tests.conftest import run
+
+
+def test_writer_flushes_in_batches(live, mongo):
+    async def scenario():
+        for i in range(250):
+            await live.log_activity(f"entry {i}", category="upload")
+        await live.log_writer.flush()
+        return await mongo.logs.count_documents({})
+
+    assert run(scenario()) == 250
+    assert live.log_writer.pending() == 0
+
+
+def test_writer_drops_entries_when_the_queue_is_full(live, mongo, monkeypatch):
+    monkeypatch.setattr(live, "log_writer", live.LogWriter(100, 1.0, 5, "drop"))
+
+    async def scenario():
+        for i in range(20):
+            await live.log_activity(f"entry {i}")
+        return live.log_writer.dropped
+
+    assert run(scenario()) == 15
+    assert run(mongo.logs.count_documents({})) == 5
+
+
+def test_close_writes_what_is_queued(live, mongo):
+    async def scenario():
+        for i in range(3):
+            await live.log_activity(f"entry {i}")
+        await live.log_writer.close()
+        return await mongo.logs.count_documents({})
+
+    assert run(scenario()) == 3
+
+
+def test_pages_follow_the_cursor(live, mongo):
+    async def scenario():
+        for i in range(25):
+            await live.log_activity(f"entry {i}", category="upload" if i % 2 else "search")
+        pages, cursor = [], None
+        while True:
+            response = Response()
+            # Unflushed entries are included in the first page
+            pages.append(await live.get_logs(response, limit=10, cursor=cursor))
+            cursor = response.headers.get("X-Next-Cursor")
+            if cursor is None:
+                return pages
+
+    pages = run(scenario())
+    assert [len(page) for page in pages] == [10, 10, 5]
+    entries = [entry for page in pages for entry in page]
+    assert len({entry["id"] for entry in entries}) == 25
+    keys = [(entry["timestamp"], entry["id"]) for entry in entries]
+    assert keys == sorted(keys, reverse=True)
+    assert all("_id" not in entry and "created_at" not in entry for entry in entries)
+
+
+def test_pages_filter_by_category(live, mongo):
+    async def scenario():
+        for i in range(12):
+            await live.log_activity(f"entry {i}", category="upload" if i % 3 == 0 else "search")
+        response = Response()
+        first = await live.get_logs(response, limit=3, category="upload")
+        second = await live.get_logs(Response(), limit=3, category="upload",
+                                     cursor=response.headers["X-Next-Cursor"])
+        return first, second
+
+    first, second = run(scenario())
+    assert [len(first), len(second)] == [3, 1]
+    assert {entry["category"] for entry in first + second} == {"upload"}
+
+
+def test_bad_cursor_is_rejected(live, mongo):
+    with pytest.raises(HTTPException) as error:
+        run(live.get_logs(Response(), cursor="not a cursor"))
+    assert error.value.status_code == 400
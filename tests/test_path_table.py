@@ -0,0 +1,38 @@
+import numpy as np
+
+from server import PathTable
+
+
+def test_append_and_reopen(tmp_path):
+    PathTable.write(tmp_path, ["a/1.jpg", "b/2.jpg"])
+    PathTable.append(tmp_path, ["c/ünïcode.jpg"])
+    PathTable.append(tmp_path, ["d/4.jpg", "d/5.jpg"])
+
+    table = PathTable(tmp_path)
+    assert len(table) == 5
+    assert list(table) == ["a/1.jpg", "b/2.jpg", "c/ünïcode.jpg", "d/4.jpg", "d/5.jpg"]
+    assert table[-1] == "d/5.jpg"
+    assert table[1:3] == ["b/2.jpg", "c/ünïcode.jpg"]
+
+
+def test_append_to_empty_table(tmp_path):
+    PathTable.write(tmp_path, [])
+    assert len(PathTable(tmp_path)) == 0
+
+    PathTable.append(tmp_path, ["a/1.jpg"])
+    assert list(PathTable(tmp_path)) == ["a/1.jpg"]
+
+
+def test_torn_tail_is_ignored_and_overwritten(tmp_path):
+    PathTable.write(tmp_path, ["a/1.jpg", "b/2.jpg"])
+    # An append interrupted after its data and half an offset entry were written
+    with open(tmp_path / PathTable.DATA_FILE, "ab") as f:
+        f.write(b"c/torn.jpg")
+    with open(tmp_path / PathTable.OFFSETS_FILE, "ab") as f:
+        f.write(np.array([100], dtype='<u8').tobytes()[:5])
+
+    assert list(PathTable(tmp_path)) == ["a/1.jpg", "b/2.jpg"]
+
+    PathTable.append(tmp_path, ["c/3.jpg"])
+    assert list(PathTable(tmp_path)) == ["a/1.jpg", "b/2.jpg", "c/3.jpg"]
+    assert (tmp_path / PathTable.OFFSETS_FILE).stat().st_size == 3 * 8
@@ -0,0 +1,28 @@
+import numpy as np
+
+from tests.conftest import jpeg
+
+
+def test_repeated_queries_skip_inference(live, predictions):
+    queries = [jpeg(0), jpeg(1)]
+
+    first, errors = live.embed_queries(queries)
+    assert errors == [None, None]
+    live.bump_index_version()
+    second, _ = live.embed_queries(queries + [b"not an image"])
+
+    assert predictions == [2]
+    np.testing.assert_array_equal(second[:2], first)
+    # Queries stay out of the on-disk cache
+    assert live.embedding_cache.get_many(live.hash_source(q) for q in queries) == {}
+
+
+def test_query_embeddings_are_bounded(live, predictions, monkeypatch):
+    monkeypatch.setattr(live, "query_embeddings", live.ResultCache(2, float('inf')))
+
+    for seed in (0, 1, 2, 0):
+        live.embed_queries([jpeg(seed)])
+
+    # The first query was evicted by the third, so it ran through the model again
+    assert predictions == [1, 1, 1, 1]
+    assert live.query_embeddings.stats()["entries"] == 2
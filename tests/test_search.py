@@ -0,0 +1,88 @@
+import numpy as np
+import pytest
+
+from server import SearchOptions
+from tests.conftest import unit_rows
+
+CATEGORIES = ("birds", "cats", "dogs")
+
+
+@pytest.fixture
+def indexed(live):
+    """600 random vectors as the live features, 200 per category"""
+    vectors = np.random.default_rng(4).normal(size=(600, 32)).astype('float32')
+    live.image_paths = [f"/d/{CATEGORIES[i % 3]}/{i}.jpg" for i in range(600)]
+    live.features_array = vectors
+    return vectors
+
+
+def exact(vectors, queries, k, rows=None):
+    rows = np.arange(len(vectors)) if rows is None else rows
+    scores = queries @ unit_rows(vectors[rows]).T
+    return rows[np.argsort(-scores, axis=1, kind='stable')[:, :k]]
+
+
+def test_rows_past_the_index_are_merged_in(live, indexed):
+    live.faiss_index = live.build_faiss_index_sync(indexed[:500].copy(), "flat")
+    queries = unit_rows(indexed[[10, 550, 599]])
+
+    _, ids = live.search_live(live.faiss_index, indexed, queries, 10, SearchOptions())
+
+    np.testing.assert_array_equal(ids, exact(indexed, queries, 10))
+
+
+def test_category_filter_scans_the_category(live, indexed):
+    live.faiss_index = live.build_faiss_index_sync(indexed.copy(), "flat")
+    queries = unit_rows(indexed[:5])
+    dogs = np.arange(2, 600, 3)
+
+    scores, ids = live.search_live(live.faiss_index, indexed, queries, 10, SearchOptions(categories=("dogs",)))
+
+    np.testing.assert_array_equal(ids, exact(indexed, queries, 10, dogs))
+    assert all(live.image_paths[i].startswith("/d/dogs/") for i in ids.ravel())
+    assert np.all(np.diff(scores, axis=1) <= 1e-6)
+
+
+def test_category_filter_uses_a_selector_on_ann_indexes(live, indexed, monkeypatch):
+    monkeypatch.setattr(live, "CATEGORY_EXACT_MAX", 0)
+    live.faiss_index = live.build_faiss_index_sync(indexed.copy(), "hnsw")
+    queries = unit_rows(indexed[:5])
+
+    _, ids = live.search_live(live.faiss_index, indexed, queries, 5, SearchOptions(categories=("birds", "cats")))
+
+    assert ids.shape == (5, 5)
+    assert np.all(ids % 3 != 2)
+    # Each query vector is itself in a selected category and is found first
+    np.testing.assert_array_equal(ids[[0, 1, 3, 4], 0], [0, 1, 3, 4])
+
+
+def test_unknown_category_returns_nothing(live, indexed):
+    live.faiss_index = live.build_faiss_index_sync(indexed.copy(), "flat")
+    scores, ids = live.search_live(live.faiss_index, indexed, unit_rows(indexed[:2]), 10,
+                                   SearchOptions(categories=("fish",)))
+    assert scores.shape == ids.shape == (2, 0)
+
+
+def test_category_filter_includes_appended_rows(live, indexed):
+    live.faiss_index = live.build_faiss_index_sync(indexed[:500].copy(), "flat")
+    queries = unit_rows(indexed[[10, 550, 599]])
+
+    _, ids = live.search_live(live.faiss_index, indexed, queries, 10, SearchOptions(categories=("cats",)))
+
+    np.testing.assert_array_equal(ids, exact(indexed, queries, 10, np.arange(1, 600, 3)))
+
+
+def test_compressed_index_is_reranked_exactly(live, indexed, monkeypatch):
+    monkeypatch.setattr(live, "VECTOR_STORAGE", "int8")
+    live.faiss_index = live.build_faiss_index_sync(indexed.copy(), "flat")
+    assert live.index_storage(live.faiss_index) == "int8"
+    queries = unit_rows(indexed[:20])
+
+    scores, ids = live.search_live(live.faiss_index, indexed, queries, 10, SearchOptions())
+
+    truth = exact(indexed, queries, 10)
+    np.testing.assert_array_equal(ids[:, 0], np.arange(20))
+    assert np.mean([len(set(a) & set(b)) for a, b in zip(ids, truth)]) >= 9
+    # Scores come from the float32 rows, not the int8 codes
+    expected = np.take_along_axis(queries @ unit_rows(indexed).T, ids, axis=1)
+    np.testing.assert_allclose(scores, expected, rtol=1e-5)
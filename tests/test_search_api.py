@@ -0,0 +1,34 @@
+import pytest
+from fastapi.testclient import TestClient
+
+from tests.conftest import jpeg
+
+
+@pytest.fixture
+def client(live, mongo, predictions, tmp_path, monkeypatch):
+    """A client for the app with three query images indexed under their own embeddings"""
+    monkeypatch.setattr(live, "QUERIES_DIR", tmp_path)
+    images = [jpeg(seed) for seed in range(3)]
+    vectors, _ = live.embed_queries(images)
+    live.features_array = vectors
+    live.faiss_index = live.build_faiss_index_sync(vectors.copy(), "flat")
+    live.image_paths = [f"/d/cats/{i}.jpg" for i in range(3)]
+    # Without a context manager the startup handlers (Mongo, model warm-up) do not run
+    return TestClient(live.app), images
+
+
+def test_search_returns_top_k(client):
+    client, images = client
+    response = client.post("/api/search", data={"top_k": "2"}, files={"file": ("q.jpg", images[1], "image/jpeg")})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 2
+    assert results[0]["filepath"] == "/d/cats/1.jpg"
+
+
+@pytest.mark.parametrize("top_k", ["0", "-3"])
+def test_search_rejects_top_k_below_one(client, top_k):
+    client, images = client
+    response = client.post("/api/search", data={"top_k": top_k}, files={"file": ("q.jpg", images[1], "image/jpeg")})
+    assert response.status_code == 422
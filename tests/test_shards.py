@@ -0,0 +1,132 @@
+import json
+
+import numpy as np
+import pytest
+
+import index_shards
+from server import SearchOptions, merge_top_k
+from tests.conftest import run, unit_rows, write_images
+
+
+def test_merge_keeps_the_best_scores_in_order():
+    first = (np.array([[0.9, 0.5, 0.1]], dtype='float32'), np.array([[3, 7, 1]]))
+    second = (np.array([[0.8, 0.6, 0.0]], dtype='float32'), np.array([[4, 2, -1]]))
+
+    distances, indices = merge_top_k([first, second], 4)
+
+    np.testing.assert_array_equal(indices, [[3, 4, 2, 7]])
+    np.testing.assert_allclose(distances, [[0.9, 0.8, 0.6, 0.5]])
+
+
+def test_merge_ranks_missing_hits_last():
+    first = (np.array([[5.0, 0.0]], dtype='float32'), np.array([[-1, -1]]))
+    second = (np.array([[-0.5]], dtype='float32'), np.array([[6]]))
+
+    _, indices = merge_top_k([first, second], 2)
+
+    np.testing.assert_array_equal(indices, [[6, -1]])
+
+
+def test_merge_breaks_ties_by_shard_order():
+    first = (np.array([[0.5]], dtype='float32'), np.array([[9]]))
+    second = (np.array([[0.5]], dtype='float32'), np.array([[2]]))
+
+    _, indices = merge_top_k([first, second], 2)
+
+    np.testing.assert_array_equal(indices, [[9, 2]])
+
+
+def test_shard_search_returns_global_positions(tmp_path, live):
+    vectors = np.random.default_rng(5).normal(size=(50, 16)).astype('float32')
+    ids = np.arange(100, 150, dtype='int64')
+    index = live.build_faiss_index_sync(vectors.copy(), "flat")
+    index_shards.write_shard(tmp_path / "shard", index, ids, vectors)
+    assert index_shards.open_shard("test", str(tmp_path / "shard"), mmap=False) == 50
+    try:
+        queries = unit_rows(vectors[:3])
+        _, found = index_shards.search_shard("test", queries, 5)
+        np.testing.assert_array_equal(found[:, 0], [100, 101, 102])
+
+        _, found = index_shards.search_shard("test", queries, 5, allowed=np.array([101, 140, 999]))
+        assert set(found.ravel()) <= {101, 140}
+        assert found[1, 0] == 101
+
+        extra = np.random.default_rng(6).normal(size=(1, 16)).astype('float32')
+        assert index_shards.add_to_shard("test", np.array([500]), extra) == 51
+        _, found = index_shards.search_shard("test", unit_rows(extra), 1)
+        assert found[0, 0] == 500
+    finally:
+        index_shards.close_shard("test")
+
+
+@pytest.fixture
+def sharded(live, monkeypatch):
+    monkeypatch.setattr(live, "INDEX_SHARDS", 3)
+    yield live
+    for worker in live.shard_workers:
+        worker.shutdown(wait=True, cancel_futures=True)
+    live.shard_workers.clear()
+
+
+def test_sharded_search_matches_exact_search(sharded, mongo):
+    live = sharded
+    rng = np.random.default_rng(7)
+    vectors = {category: rng.normal(size=(40, 16)).astype('float32') for category in ("cats", "dogs")}
+    for category, rows in vectors.items():
+        write_images(live.DATASET_DIR, category, rows, live.embedding_cache)
+
+    assert run(live.build_index())
+
+    index = live.faiss_index
+    assert isinstance(index, live.ShardedIndex)
+    manifest = json.loads((live.live_dir / "manifest.json").read_text())
+    assert len(manifest["shards"]["shards"]) == 3
+    assert sum(shard["vectors"] for shard in manifest["shards"]["shards"]) == 80
+
+    features = np.asarray(live.features_array)
+    queries = unit_rows(features[::7])
+    scores, ids = live.search_live(index, features, queries, 10, SearchOptions())
+    truth = queries @ unit_rows(features).T
+    expected = np.argsort(-truth, axis=1, kind='stable')[:, :10]
+    np.testing.assert_array_equal(ids, expected)
+    np.testing.assert_allclose(scores, np.take_along_axis(truth, ids, axis=1), rtol=1e-5)
+
+    _, ids = live.search_live(index, features, queries, 5, SearchOptions(categories=("dogs",)))
+    assert all("/dogs/" in live.image_paths[i] for i in ids.ravel())
+
+
+def test_shared_shards_scan_appends_until_a_checkpoint(sharded, mongo, monkeypatch):
+    live = sharded
+    for name, value in (("SHARED_INDEX", True), ("INDEX_MMAP", True), ("MMAP_FEATURES", True),
+                        ("SHARED_CHECKPOINT_ROWS", 3)):
+        monkeypatch.setattr(live, name, value)
+    rng = np.random.default_rng(8)
+    write_images(live.DATASET_DIR, "cats", rng.normal(size=(30, 16)).astype('float32'), live.embedding_cache)
+    assert run(live.build_index())
+    first = live.live_dir
+
+    extra = rng.normal(size=(3, 16)).astype('float32')
+    added = [f"/d/dogs/{i}.jpg" for i in range(3)]
+    live.append_to_live_index(extra[:2], added[:2])
+
+    # The shard workers keep the published files; the coordinator scans the new rows
+    assert live.live_dir == first
+    assert live.faiss_index.ntotal == 30
+    _, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(extra[:2]), 1, SearchOptions())
+    assert ids[:, 0].tolist() == [30, 31]
+    _, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(extra[:2]), 1,
+                              SearchOptions(categories=("dogs",)))
+    assert ids[:, 0].tolist() == [30, 31]
+
+    live.append_to_live_index(extra[2:], added[2:])
+
+    directory = live.live_dir
+    assert directory != first
+    assert live.CURRENT_SNAPSHOT_FILE.read_text() == directory.name
+    manifest = json.loads((directory / "manifest.json").read_text())["shards"]
+    assert manifest["built"] == 33
+    assert sum(shard["vectors"] for shard in manifest["shards"]) == 33
+    assert live.faiss_index.ntotal == 33
+    scores, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(extra), 1, SearchOptions())
+    assert ids[:, 0].tolist() == [30, 31, 32]
+    np.testing.assert_allclose(scores[:, 0], 1.0, rtol=1e-5)
@@ -0,0 +1,36 @@
+import numpy as np
+import pytest
+from fastapi.testclient import TestClient
+
+
+@pytest.fixture
+def client(live, mongo):
+    vectors = np.random.default_rng(8).normal(size=(5, 8)).astype('float32')
+    live.features_array = vectors
+    live.faiss_index = live.build_faiss_index_sync(vectors.copy(), "flat")
+    live.image_paths = [f"/d/cats/{i}.jpg" for i in range(5)]
+    # Without a context manager the startup handlers (Mongo, model warm-up) do not run
+    return TestClient(live.app)
+
+
+def test_similar_excludes_the_image_itself(client):
+    response = client.get("/api/search/similar", params={"image_id": 2, "top_k": 3})
+
+    assert response.status_code == 200
+    results = response.json()["results"]
+    assert len(results) == 3
+    assert "/d/cats/2.jpg" not in [result["filepath"] for result in results]
+
+
+@pytest.mark.parametrize("top_k", [0, -1])
+def test_similar_rejects_top_k_below_one(client, top_k):
+    response = client.get("/api/search/similar", params={"image_id": 2, "top_k": top_k})
+    assert response.status_code == 422
+
+
+def test_similar_by_filepath(client):
+    response = client.get("/api/search/similar", params={"filepath": "/d/cats/4.jpg", "top_k": 2})
+
+    assert response.status_code == 200
+    assert response.json()["query_image"] == "/d/cats/4.jpg"
+    assert client.get("/api/search/similar", params={"filepath": "/d/cats/9.jpg"}).status_code == 404
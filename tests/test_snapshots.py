@@ -0,0 +1,107 @@
+import json
+
+import faiss
+import numpy as np
+import pytest
+
+from server import PathTable, SearchOptions
+from tests.conftest import run, unit_rows, write_images
+
+
+def test_build_publishes_a_snapshot(live, mongo):
+    vectors = np.random.default_rng(0).random((20, 16), dtype='float32')
+    paths = write_images(live.DATASET_DIR, "cats", vectors, live.embedding_cache)
+
+    assert run(live.build_index())
+
+    directory = live.SNAPSHOTS_DIR / live.CURRENT_SNAPSHOT_FILE.read_text()
+    assert live.live_dir == directory
+    manifest = json.loads((directory / "manifest.json").read_text())
+    assert manifest["count"] == 20
+    assert manifest["model_id"] == live.MODEL_ID
+    assert sorted(PathTable(directory)) == sorted(paths)
+    assert live.faiss_index.ntotal == 20
+    assert live.dataset_stats.categories == {"cats": 20}
+
+
+def test_uploads_during_a_build_are_carried_over(live, mongo, monkeypatch):
+    rng = np.random.default_rng(1)
+    write_images(live.DATASET_DIR, "cats", rng.random((20, 16), dtype='float32'), live.embedding_cache)
+    assert run(live.build_index())
+    first = live.live_dir
+
+    uploaded_vectors = rng.random((3, 16), dtype='float32')
+    uploaded = []
+    save_index_artifacts = live.save_index_artifacts
+
+    def save_during_upload(directory, index, features, paths):
+        # An upload lands in the live (old) snapshot after the build scanned the dataset
+        uploaded.extend(write_images(live.DATASET_DIR, "dogs", uploaded_vectors, live.embedding_cache))
+        live.append_to_live_index(uploaded_vectors, uploaded)
+        save_index_artifacts(directory, index, features, paths)
+
+    monkeypatch.setattr(live, "save_index_artifacts", save_during_upload)
+    assert run(live.build_index())
+
+    directory = live.live_dir
+    assert directory != first
+    assert live.CURRENT_SNAPSHOT_FILE.read_text() == directory.name
+    assert list(PathTable(directory))[-3:] == uploaded
+    assert len(np.load(str(directory / "features.npy"))) == 23
+    assert live.faiss_index.ntotal == 23
+    assert list(live.image_paths)[-3:] == uploaded
+
+    scores, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(uploaded_vectors), 1, SearchOptions())
+    assert [live.image_paths[i] for i in ids[:, 0]] == uploaded
+    np.testing.assert_allclose(scores[:, 0], 1.0, rtol=1e-5)
+
+
+def test_failed_build_keeps_the_live_snapshot(live, mongo):
+    write_images(live.DATASET_DIR, "cats", np.random.default_rng(2).random((5, 16), dtype='float32'),
+                 live.embedding_cache)
+    assert run(live.build_index())
+    current = live.CURRENT_SNAPSHOT_FILE.read_text()
+
+    for path in live.DATASET_DIR.rglob("*.jpg"):
+        path.unlink()
+    assert not run(live.build_index())
+
+    assert live.CURRENT_SNAPSHOT_FILE.read_text() == current
+    assert live.faiss_index.ntotal == 5
+
+
+def test_files_already_indexed_by_a_build_are_not_added_again(live, mongo):
+    vectors = np.random.default_rng(3).normal(size=(6, 16)).astype('float32')
+    paths = write_images(live.DATASET_DIR, "cats", vectors[:4], live.embedding_cache)
+    assert run(live.build_index())
+
+    more = write_images(live.DATASET_DIR, "dogs", vectors[4:], live.embedding_cache)
+    count, duplicates = run(live.add_images_to_index(paths[:2] + more, dedup="reject"))
+
+    assert (count, duplicates) == (2, [])
+    assert list(live.image_paths)[4:] == more
+
+
+@pytest.mark.parametrize("mmap", [False, True])
+def test_appended_rows_are_folded_into_a_new_index_file(live, mongo, monkeypatch, mmap):
+    monkeypatch.setattr(live, "INDEX_MMAP", mmap)
+    monkeypatch.setattr(live, "APPEND_FOLD_ROWS", 3)
+    rng = np.random.default_rng(4)
+    write_images(live.DATASET_DIR, "cats", rng.normal(size=(5, 16)).astype('float32'), live.embedding_cache)
+    assert run(live.build_index())
+    index_path = live.live_dir / "faiss_index.bin"
+
+    extra = rng.normal(size=(3, 16)).astype('float32')
+    live.append_to_live_index(extra[:2], ["/d/dogs/0.jpg", "/d/dogs/1.jpg"])
+    # Below the threshold the rows are only scanned exactly
+    assert live.faiss_index.ntotal == 5
+    assert faiss.read_index(str(index_path)).ntotal == 5
+
+    live.append_to_live_index(extra[2:], ["/d/dogs/2.jpg"])
+    assert live.faiss_index.ntotal == 8
+    assert faiss.read_index(str(index_path)).ntotal == 8
+    assert live.index_mmapped == mmap
+    assert not index_path.with_suffix(".tmp").exists()
+
+    _, ids = live.search_live(live.faiss_index, live.features_array, unit_rows(extra), 1, SearchOptions())
+    assert ids[:, 0].tolist() == [5, 6, 7]